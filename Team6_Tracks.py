@@ -66,13 +66,19 @@ import seaborn as sns
 from sklearn.metrics import precision_score
 from sklearn.metrics import recall_score
 from sklearn.metrics import roc_auc_score
+from tracks_profile import stage, report
+from tracks_select import importances, select_features
+from tracks_topk import TopK
+from tracks_index import TrackIndex
 
 
 
 #%%
 #Importing dataset 
 
-spotify = pd.read_csv('tracks.csv')
+with stage('read_csv') as s:
+    spotify = pd.read_csv('tracks.csv')
+    s.rows_out = len(spotify)
 # %%
 print(spotify.head())
 print(spotify.info())
@@ -85,7 +91,9 @@ print(spotify.shape)
 spotify.isna().sum()
 
 #Dropping null values
-spotify.dropna(axis=0,inplace=True)
+with stage('dropna', rows_in=len(spotify)) as s:
+    spotify.dropna(axis=0,inplace=True)
+    s.rows_out = len(spotify)
 
 # %%
 #Reformatting variables of interest
@@ -99,37 +107,38 @@ spotify = spotify[spotify['popularity'] != 0]
 #%%
 #EDA on popular songs 
 
-x = spotify[spotify['popularity'] > 90]
+top = TopK(spotify)
+popular = [('popularity', '>', 90)]
 
-x = x[['name', 'artists', 'popularity']].sort_values('popularity', ascending=False)
+x = top.top('popularity', 10, where=popular, columns=['name', 'artists', 'popularity'])
 
-x.head(10)
+x
 
 #%%
 #EDA on popular songs -> danceability
 
-x = spotify[spotify['popularity'] > 90]
+x = top.top('danceability', 10, where=popular, ties=[('popularity', False)],
+          columns=['name', 'artists', 'popularity','danceability'])
 
-x = x[['name', 'artists', 'popularity','danceability']].sort_values('popularity', ascending=False).sort_values('danceability', ascending=False)
-
-x.head(10)
+x
 
 #%%
 #EDA on popular songs -> energy
 
-x = spotify[spotify['popularity'] > 90]
-
-x = x[['name', 'artists', 'popularity','energy']].sort_values('popularity', ascending=False).sort_values('energy', ascending=True)
+x = top.bottom('energy', 10, where=popular, ties=[('popularity', False)],
+               columns=['name', 'artists', 'popularity','energy'])
 
-x.head(10)
+x
 
 
 #%%
 #Dropping songs with 0 popularity given that it will skew the results later on...
 
-spotify['popularity'] = spotify['popularity'].map(lambda x: 0 if x <= 50 else 1 if x <= 100 else np.nan)
+with stage('popularity_classes', rows_in=len(spotify)) as s:
+    spotify['popularity'] = spotify['popularity'].map(lambda x: 0 if x <= 50 else 1 if x <= 100 else np.nan)
 
-spotify = spotify.dropna()
+    spotify = spotify.dropna()
+    s.rows_out = len(spotify)
 
 sns.countplot(x = 'popularity', data = spotify,palette = "Set2").set(title='Countplot for popularity')
 
@@ -141,17 +150,20 @@ spotify['duration_min'] = round(spotify['duration_ms']* 1.6667e-5, 2)
 #%%
 #Reformating release_date
 
-spotify['release_date'] = pd.to_datetime(spotify['release_date'])
+with stage('release_date', rows_in=len(spotify)) as s:
+    spotify['release_date'] = pd.to_datetime(spotify['release_date'])
 
-spotify["year"] = spotify["release_date"].dt.year
+    spotify["year"] = spotify["release_date"].dt.year
 
-spotify["month"] = spotify["release_date"].dt.month
+    spotify["month"] = spotify["release_date"].dt.month
 
 #%%
 #Deleting songs whose release year is past 2022
-spotify['year'] = spotify['year'].map(lambda x: np.nan if x > 2022 else x)
+with stage('drop_future_years', rows_in=len(spotify)) as s:
+    spotify['year'] = spotify['year'].map(lambda x: np.nan if x > 2022 else x)
 
-spotify = spotify.dropna()
+    spotify = spotify.dropna()
+    s.rows_out = len(spotify)
 
 #%%
 #Dropping columns for EDA and modeling
@@ -172,7 +184,8 @@ fig, ax = plt.subplots(figsize = (15,15))
 
 mask1 = np.triu(np.ones_like(spotifydf.corr(), dtype=np.bool))
 
-spotifydfcorr = spotifydf.corr(method='spearman')
+with stage('spearman_corr', rows_in=len(spotifydf)):
+    spotifydfcorr = spotifydf.corr(method='spearman')
 sns.heatmap(spotifydfcorr, 
             annot =True, 
             mask=mask1)
@@ -181,14 +194,17 @@ plt.title('Spearman Correlation Heatmap of Spotifydf')
 
 #%%
 # Spotifydf at a glance
-spotifydf.hist(bins = 20, color = 'lightgreen', figsize = (20, 14))
+with stage('hist_grid', rows_in=len(spotifydf)):
+    spotifydf.hist(bins = 20, color = 'lightgreen', figsize = (20, 14))
 
 #%%
 # EDA on popular and unpopular data over the years
 
-unpopular = spotifydf[spotifydf['popularity'] == 0]
+spotify_idx = TrackIndex(spotifydf)
 
-popular = spotifydf[spotifydf['popularity'] == 1]
+unpopular = spotify_idx.eq('popularity', 0).take(spotifydf)
+
+popular = spotify_idx.eq('popularity', 1).take(spotifydf)
 
 #%%
 
@@ -316,7 +332,9 @@ x_train, x_test, y_train, y_test = train_test_split(x_spotifydf, y_spotifydf, te
 
 smo = SMOTE(random_state = 2)
 
-x_train_res, y_train_res = smo.fit_resample(x_train, y_train)
+with stage('smote', rows_in=len(x_train)) as s:
+    x_train_res, y_train_res = smo.fit_resample(x_train, y_train)
+    s.rows_out = len(x_train_res)
 
 modelLogistic = LogisticRegression()
 
@@ -333,7 +351,8 @@ print(confusion_matrix(y_test, y_predLogistic))
 #%%
 #Cross validation
 
-cv_logistic = cross_val_score(modelLogistic, x_train_res, y_train_res, cv = 10)
+with stage('logistic_cv', rows_in=len(x_train_res)):
+    cv_logistic = cross_val_score(modelLogistic, x_train_res, y_train_res, cv = 10)
 
 print(cv_logistic)
 print(cv_logistic.mean())
@@ -401,18 +420,19 @@ X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_
 #Modelling
 
 b=pd.DataFrame(columns=['K', 'Accuracy'])
-for i in range(1,21):
-    knn = KNeighborsClassifier(n_neighbors = i)
-    knn.fit(X_train,y_train)
-    knn.predict(X_test)
-    print(i)
-    print(knn.score(X_test, y_test))
-    temp=knn.score(X_test, y_test)
-    #new_row = {'K':i, 'Accuracy':temp}
-    #b = b.append(new_row, ignore_index=True)
-    b.loc[i]=[i,temp]
-    #b.update({i:knn.score(X_test, y_test)})
-    print("   ")
+with stage('knn_k_loop', rows_in=len(X_test)):
+    for i in range(1,21):
+        knn = KNeighborsClassifier(n_neighbors = i)
+        knn.fit(X_train,y_train)
+        knn.predict(X_test)
+        print(i)
+        print(knn.score(X_test, y_test))
+        temp=knn.score(X_test, y_test)
+        #new_row = {'K':i, 'Accuracy':temp}
+        #b = b.append(new_row, ignore_index=True)
+        b.loc[i]=[i,temp]
+        #b.update({i:knn.score(X_test, y_test)})
+        print("   ")
 
 #%%
 plt.plot(b['K'], b['Accuracy'])
@@ -641,19 +661,21 @@ plt.close()
 
 #%%
 # Feature Selection
-sel = SelectFromModel(RandomForestClassifier(n_estimators = 100))
-sel.fit(X_train, Y_train)
+# Reusing the importances of the forest fitted above instead of fitting a new one
+# just for SelectFromModel (same 'mean' threshold). MDI is read off the fitted
+# forest; only the permutation and SHAP importances are cached on disk.
+with stage('feature_selection', rows_in=len(X_train)):
+    selected_feat = select_features(rf_best, X_train)
 
-print(sel.get_support())
+print(importances(rf_best, X_train).sort_values(ascending=False))
 
-selected_feat= X_train.columns[(sel.get_support())]
 print(len(selected_feat))
 
 print(selected_feat)
 
 #%%
 #Based on Feature selection creating new training data
-x_spotifydf1 = spotifydf.loc[:,['danceability', 'energy', 'loudness', 'speechiness', 'acousticness','liveness', 'valence', 'tempo', 'duration_min', 'year']]
+x_spotifydf1 = spotifydf.loc[:,selected_feat]
 
 y_spotifydf1 = spotifydf[['popularity']]
 
@@ -687,7 +709,8 @@ print(f"The best hyperparameters for RF using GridSearchCV were: max_features='a
 #%%
 #Training RF on best parameters
 rf_best = RandomForestClassifier(random_state=42, max_features='auto', n_estimators= 200, max_depth=8, criterion='gini', bootstrap=True, oob_score=True)
-rf_best.fit(X_train, Y_train)
+with stage('rf_fit', rows_in=len(X_train)):
+    rf_best.fit(X_train, Y_train)
 y_pred=rf_best.predict(X_test)
 print(accuracy_score(Y_test,y_pred))
 
@@ -740,7 +763,7 @@ plt.close()
 
 #%%
 # SMOTE_RF_with FE
-x_spotifydf1 = spotifydf.loc[:,['danceability', 'energy', 'loudness', 'speechiness', 'acousticness','liveness', 'valence', 'tempo', 'duration_min', 'year']]
+x_spotifydf1 = spotifydf.loc[:,selected_feat]
 y_spotifydf1 = spotifydf[['popularity']]
 X_train, X_test, Y_train, Y_test = train_test_split(x_spotifydf1, y_spotifydf1, test_size= 0.2, random_state= 321)
 smo = SMOTE(random_state = 2)
@@ -799,5 +822,6 @@ plt.title('Actual vs Fitted Values for Popularity')
 plt.show()
 plt.close()
 
-
-
+#%%
+# Stage timings (only populated when run with TRACKS_PROFILE=1)
+report('tracks_trace.json')
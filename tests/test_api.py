@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import tracks_api  # noqa: E402
+from tracks_apicache import ResponseCache  # noqa: E402
+
+IDS = [f'{i:022d}' for i in range(250)]
+
+
+def fetch(out_dir, ids=IDS, mock=None, **client_args):
+    """Run `fetch_catalogue` against a mock on an ephemeral port; (rows written, mock state, client)."""
+    async def run():
+        async with tracks_api.serve_mock(**(mock or {})) as (api_url, state):
+            async with tracks_api.SpotifyClient(token='mock', api_url=api_url, **client_args) as client:
+                return await tracks_api.fetch_catalogue(ids, out_dir, client=client), state, client
+
+    return asyncio.run(run())
+
+
+def test_batches_ids_per_endpoint(tmp_path):
+    written, state, client = fetch(str(tmp_path))
+    assert written == len(IDS)
+    # 5 /tracks calls of 50 ids and 3 /audio-features calls of 100
+    assert state['requests'] == client.requests == 8
+    tracks = pd.read_parquet(tmp_path)
+    assert sorted(tracks['id']) == IDS
+    assert tracks['danceability'].notna().all()
+
+
+def test_rate_limits_wait_without_using_retries(tmp_path):
+    t0 = time.monotonic()
+    written, state, client = fetch(str(tmp_path), mock={'rate_limit_every': 3}, max_retries=0)
+    assert written == len(IDS)
+    assert client.requests > 8
+    # Every 429 answers Retry-After: 1
+    assert time.monotonic() - t0 >= 1
+
+
+def test_rate_limits_have_their_own_cap(tmp_path):
+    with pytest.raises(tracks_api.SpotifyError, match='rate limited'):
+        fetch(str(tmp_path), mock={'rate_limit_every': 1}, max_rate_limits=1)
+
+
+def test_failed_fetch_keeps_finished_rows_and_resumes(tmp_path):
+    with pytest.raises(tracks_api.SpotifyError):
+        fetch(str(tmp_path), mock={'fail_after': 4}, concurrency=1, max_retries=0)
+    first = pd.read_parquet(tmp_path)
+    assert 0 < len(first) < len(IDS)
+
+    written, state, _ = fetch(str(tmp_path))
+    assert written == len(IDS) - len(first)
+    assert state['requests'] < 8
+    tracks = pd.read_parquet(tmp_path)
+    assert sorted(tracks['id']) == IDS
+
+
+def test_cache_serves_fresh_items_without_requests(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    fetch(str(tmp_path / 'first'), cache=cache)
+    written, state, client = fetch(str(tmp_path / 'second'), cache=cache)
+    assert written == len(IDS)
+    assert state['requests'] == client.requests == 0
+    assert cache.stats['fresh'] == 2 * len(IDS)
+
+
+def test_cache_revalidates_expired_items_with_etags(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttls={'/tracks': 0})
+    fetch(str(tmp_path / 'first'), cache=cache)
+    written, state, _ = fetch(str(tmp_path / 'second'), cache=cache)
+    assert written == len(IDS)
+    # Only the 5 /tracks batches go out again, and every one is a 304
+    assert state['requests'] == state['not_modified'] == 5
+    assert cache.stats['revalidated'] == len(IDS)
+    assert sorted(pd.read_parquet(tmp_path / 'second')['id']) == IDS
+
+
+def test_cache_evicts_down_to_max_bytes(tmp_path):
+    full = ResponseCache(str(tmp_path / 'full.sqlite'))
+    fetch(str(tmp_path / 'full'), cache=full)
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=full.size // 2)
+    fetch(str(tmp_path / 'first'), cache=cache)
+    assert cache.stats['evicted'] > 0
+    assert cache.size <= cache.max_bytes
+
+    written, state, _ = fetch(str(tmp_path / 'second'), cache=cache)
+    assert written == len(IDS)
+    # Evicted items are fetched again, the ones still cached are not
+    assert 0 < state['requests'] and state['not_modified'] == 0
+    assert cache.size <= cache.max_bytes
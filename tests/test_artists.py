@@ -0,0 +1,14 @@
+import pandas as pd
+
+from tracks_artists import ArtistTable, naive_join
+
+
+def test_genres_with_apostrophes_survive_both_joins():
+    artists = pd.DataFrame({'id': ['a1', 'a2'], 'followers': [10, 20], 'popularity': [5, 6],
+                            'genres': ['["children\'s music", \'pop\']', "['rock, indie']"]})
+    tracks = pd.DataFrame({'id_artists': ["['a1', 'a2']", "['a2']", "['zz']"]})
+    assert sorted(ArtistTable(artists).genres) == ["children's music", 'pop', 'rock, indie']
+    genres = naive_join(tracks, artists)['genre']
+    assert sorted(genres.dropna().unique()) == ["children's music", 'pop', 'rock, indie']
+    features, matrix = ArtistTable(artists).join(tracks)
+    assert features['artists_genres'].tolist() == [3, 1, 0]
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import tracks_profile
+from tracks_bench import BenchmarkStore, compare
+
+
+def summary(wall):
+    return pd.DataFrame({'calls': [1], 'wall_s': [wall], 'cpu_s': [wall], 'peak_rss_delta_mb': [0.0],
+                         'rows_in': [10], 'rows_out': [10]}, index=['fit'])
+
+
+def test_dirty_runs_are_left_out_by_default(tmp_path):
+    store = BenchmarkStore(str(tmp_path / 'bench.sqlite'))
+    for _ in range(3):
+        store.record(summary(1.0), 'train', rows=10, commit='a', dirty=False)
+        store.record(summary(1.0), 'train', rows=10, commit='b', dirty=False)
+        store.record(summary(5.0), 'train', rows=10, commit='b', dirty=True)
+
+    assert len(store.history()) == 6
+    assert len(store.history(include_dirty=True)) == 9
+    assert not compare(store, 'a', 'b')['regressed'].any()
+    assert compare(store, 'a', 'b', include_dirty=True).loc[0, 'n_head'] == 6
+
+
+@pytest.mark.skipif(not tracks_profile.HAVE_PROC, reason='needs /proc')
+def test_peak_rss_is_per_stage():
+    profiler = tracks_profile.Profiler(enabled=True)
+    with profiler.stage('first'):
+        a = np.ones(2 ** 27 // 8)
+    del a
+    # ru_maxrss would report ~0 here: the process peak was already set above
+    with profiler.stage('second'):
+        b = np.ones(2 ** 26 // 8)
+    del b
+    peaks = profiler.summary()['peak_rss_delta_mb']
+    assert peaks['first'] > 100
+    assert peaks['second'] > 40
+
+
+def _wall_verdict(base, head):
+    store = BenchmarkStore(':memory:')
+    for commit, walls in (('a', base), ('b', head)):
+        for wall in walls:
+            store.record(summary(wall), 'train', rows=10, commit=commit, dirty=False)
+    out = compare(store, 'a', 'b')
+    return out[out['metric'] == 'wall_s'].iloc[0]
+
+
+def test_clear_slowdown_with_enough_runs_is_a_tested_regression():
+    verdict = _wall_verdict([1.0, 1.02, 0.98, 1.01, 0.99], [1.5, 1.52, 1.48, 1.51, 1.49])
+    assert verdict['n_base'] == verdict['n_head'] == 5
+    # 5 vs 5 runs: the smallest attainable one-sided p-value is 1/252 < alpha
+    assert verdict['p_value'] < 0.01
+    assert verdict['regressed']
+
+
+def test_few_runs_fall_back_to_the_noise_threshold():
+    slower = _wall_verdict([1.0, 1.02, 0.98], [1.5, 1.52, 1.48])
+    assert np.isnan(slower['p_value'])
+    assert slower['ratio'] > 1 + slower['threshold']
+    assert slower['regressed']
+
+    within_noise = _wall_verdict([1.0, 1.02, 0.98], [1.03, 1.04, 1.02])
+    assert np.isnan(within_noise['p_value'])
+    assert within_noise['ratio'] < 1 + within_noise['threshold']
+    assert not within_noise['regressed']
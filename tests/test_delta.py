@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import tracks_synth
+from tracks_delta import DeltaStore
+
+
+@pytest.fixture
+def tracks():
+    return tracks_synth.generate_chunk(3000, 0, seed=0)
+
+
+def test_failed_apply_leaves_store_unchanged(tmp_path, tracks, monkeypatch):
+    store = DeltaStore(str(tmp_path))
+    store.build(tracks.iloc[:2500])
+    before = store.correlations()
+
+    def broken(clean):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(store, '_insert', broken)
+    with pytest.raises(OSError):
+        store.apply(tracks.iloc[2000:])
+    np.testing.assert_array_equal(store.correlations(), before)
+
+    reopened = DeltaStore(str(tmp_path))
+    np.testing.assert_array_equal(reopened.correlations(), before)
+    assert len(reopened.tracks()) == len(store.tracks())
+
+
+def test_replayed_delta_is_a_no_op(tmp_path, tracks):
+    store = DeltaStore(str(tmp_path))
+    store.build(tracks.iloc[:2500])
+    delta = tracks.iloc[2000:].assign(popularity=tracks['popularity'].iloc[2000:] + 1)
+    first = store.apply(delta)
+    after = store.correlations()
+
+    replay = DeltaStore(str(tmp_path)).apply(delta)
+    assert replay['replayed'] and replay['seq'] == first['seq'] == 1
+    np.testing.assert_array_equal(DeltaStore(str(tmp_path)).correlations(), after)
+
+    # The summaries still match a full rebuild of the same rows
+    rebuilt = DeltaStore(str(tmp_path / 'full'))
+    rebuilt.build(pd.concat([tracks.iloc[:2000], delta]))
+    np.testing.assert_allclose(store.correlations(), rebuilt.correlations(), atol=1e-9)
+
+
+def test_delta_back_to_an_earlier_state_is_applied(tmp_path, tracks):
+    store = DeltaStore(str(tmp_path))
+    store.build(tracks.iloc[:2500])
+    week = tracks.iloc[:100]
+    a, b = week.assign(popularity=10), week.assign(popularity=90)
+    assert not store.apply(a)['replayed']
+    assert not store.apply(b)['replayed']
+    again = store.apply(a)
+    assert not again['replayed'] and again['seq'] == 3
+    popularity = store.tracks().set_index('id').loc[week['id'], 'popularity']
+    assert (popularity == 0).all()  # cleaned: 10 is not popular, 90 is
+    assert store.apply(a)['replayed']
@@ -0,0 +1,33 @@
+import numpy as np
+
+from tracks_histforest import HistRandomForestClassifier
+
+
+def test_unbounded_depth_grows_until_pure():
+    rng = np.random.default_rng(0)
+    x = rng.random((400, 3))
+    # A checkerboard needs far more than 8 levels to fit exactly
+    y = ((x[:, 0] * 16).astype(int) + (x[:, 1] * 16).astype(int)) % 2
+    kwargs = dict(n_estimators=1, max_features=None, bootstrap=False, random_state=0)
+    shallow = HistRandomForestClassifier(max_depth=8, **kwargs).fit(x, y)
+    full = HistRandomForestClassifier(max_depth=None, **kwargs).fit(x, y)
+    assert shallow.score(x, y) < 1.0
+    assert full.score(x, y) == 1.0
+    assert full.get_params()['max_depth'] is None
+
+
+def test_wide_levels_in_chunks_grow_the_same_trees(monkeypatch):
+    import tracks_histforest
+
+    rng = np.random.default_rng(1)
+    x = rng.random((3000, 6))
+    y = (x[:, 0] + x[:, 1] * x[:, 2] + 0.3 * rng.random(3000) > 0.9).astype(int)
+    kwargs = dict(n_estimators=3, max_depth=None, random_state=0)
+    whole = HistRandomForestClassifier(**kwargs).fit(x, y)
+    # Room for the histograms of 4 nodes only
+    monkeypatch.setattr(tracks_histforest, 'HIST_CHUNK_BYTES', 4 * 6 * 256 * 8)
+    chunked = HistRandomForestClassifier(**kwargs).fit(x, y)
+    for a, b in zip(whole.trees_, chunked.trees_):
+        np.testing.assert_array_equal(a['feature'], b['feature'])
+        np.testing.assert_array_equal(a['threshold'], b['threshold'])
+    np.testing.assert_array_equal(whole.predict_proba(x), chunked.predict_proba(x))
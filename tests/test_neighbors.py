@@ -0,0 +1,28 @@
+import threading
+
+import numpy as np
+
+from tracks_neighbors import IncrementalKNN
+
+
+def test_update_during_compaction_keeps_one_copy():
+    rng = np.random.default_rng(0)
+    x, y = rng.random((2000, 4)), rng.integers(0, 2, 2000)
+    index = IncrementalKNN(n_neighbors=3, background=True).fit(x, y)
+
+    # Hold the background rebuild until the update is in
+    release = threading.Event()
+    build = index._build
+    index._build = lambda rows: (release.wait(), build(rows))[1]
+    index.compact(wait=False)
+    index.insert(x[[7]] + 10, y[[7]], ids=[7])
+    release.set()
+    index.compact(wait=True)
+
+    assert index.n_live == 2000
+    dist, _ = index.kneighbors(x[[7]])
+    assert dist[0, 0] > 0
+    assert index.delete([7]) == 1
+    index.compact(wait=True)
+    assert index.n_live == 1999
+    assert index.kneighbors(x[[7]] + 10)[0][0, 0] > 0
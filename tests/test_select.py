@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from tracks_select import importances
+
+
+def test_same_params_different_fit_do_not_share_the_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    x = pd.DataFrame(rng.random((400, 3)), columns=['a', 'b', 'c'])
+    y_a, y_b = (x['a'] > 0.5).astype(int), (x['c'] > 0.5).astype(int)
+    params = dict(n_estimators=10, max_depth=4, random_state=0)
+    on_a = RandomForestClassifier(**params).fit(x, y_a)
+    on_c = RandomForestClassifier(**params).fit(x, y_b)
+    kwargs = dict(method='permutation', cache_dir=str(tmp_path), n_jobs=1)
+    first = importances(on_a, x, y_a, **kwargs)
+    second = importances(on_c, x, y_a, **kwargs)
+    assert first.idxmax() == 'a'
+    assert not np.allclose(first, second)
+    assert len(list(tmp_path.iterdir())) == 2
+    assert importances(on_a, x, y_a, **kwargs).equals(first)
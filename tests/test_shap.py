@@ -0,0 +1,57 @@
+import itertools
+from math import factorial
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from tracks_shap import forest_shap
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    rng = np.random.default_rng(0)
+    x = rng.random((300, 4))
+    y = ((x[:, 0] + x[:, 1] * x[:, 2] + 0.2 * rng.random(300)) > 0.8).astype(int)
+    forest = RandomForestClassifier(n_estimators=5, max_depth=4, random_state=0).fit(x, y)
+    return forest, x[:20]
+
+
+def _expected(tree, x, subset, node=0):
+    """Path-dependent v(S): follow x on features in S, average the children by cover otherwise."""
+    t = tree.tree_
+    if t.children_left[node] == -1:
+        value = t.value[node, 0]
+        return value[1] / value.sum()
+    left, right = t.children_left[node], t.children_right[node]
+    if t.feature[node] in subset:
+        return _expected(tree, x, subset, left if x[t.feature[node]] <= t.threshold[node] else right)
+    cover = t.weighted_n_node_samples
+    return (cover[left] * _expected(tree, x, subset, left)
+            + cover[right] * _expected(tree, x, subset, right)) / cover[node]
+
+
+def _brute_force(forest, x):
+    n = x.shape[0]
+    phi = np.zeros(n)
+    for i in range(n):
+        others = [j for j in range(n) if j != i]
+        for size in range(n):
+            w = factorial(size) * factorial(n - size - 1) / factorial(n)
+            for s in itertools.combinations(others, size):
+                phi[i] += w * np.mean([_expected(t, x, set(s) | {i}) - _expected(t, x, set(s))
+                                       for t in forest.estimators_])
+    return phi
+
+
+def test_attributions_add_up_to_the_prediction(fitted):
+    forest, x = fitted
+    phi, expected = forest_shap(forest, x, workers=1)
+    np.testing.assert_allclose(phi.sum(axis=1) + expected, forest.predict_proba(x)[:, 1], atol=1e-5)
+
+
+def test_matches_brute_force_shapley_values(fitted):
+    forest, x = fitted
+    phi, _ = forest_shap(forest, x[:5], workers=1)
+    for row, attributions in zip(x[:5], phi):
+        np.testing.assert_allclose(attributions, _brute_force(forest, row), atol=1e-5)
@@ -0,0 +1,12 @@
+import os
+
+import pytest
+
+import tracks_cli
+
+
+@pytest.mark.parametrize('command', sorted(tracks_cli.STARTUP_BUDGETS))
+def test_startup_within_budget(command):
+    budget = tracks_cli.STARTUP_BUDGETS[command] * float(os.environ.get(tracks_cli.STARTUP_SCALE_ENV, 1.0))
+    took = tracks_cli.measure_startup(command)
+    assert took <= budget, f"{command} took {took:.2f}s to start (budget {budget:.2f}s)"
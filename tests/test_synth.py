@@ -0,0 +1,15 @@
+import tracks_synth as ts
+
+TOLERANCE = 0.05
+
+
+def test_synthetic_spearman_matches_profile():
+    tracks = ts.generate_chunk(200_000, 0, seed=1)
+    gaps = ts.spearman_gaps(tracks)
+    assert gaps['gap'].abs().max() < TOLERANCE, gaps.head()
+
+
+def test_discrete_pairs_are_calibrated():
+    # explicit and speechiness: the discrete margin used to halve the rank correlation
+    gaps = ts.spearman_gaps(ts.generate_chunk(200_000, 0, seed=2)).set_index(['a', 'b'])
+    assert abs(gaps.loc[('speechiness', 'explicit'), 'gap']) < 0.02
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from tracks_dedup import group_folds
+from tracks_target import ArtistTargetEncoder
+
+
+def test_group_folds_keep_groups_together_and_stratify():
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 3000, 10_000)
+    y = (rng.random(3000) < 0.2)[groups].astype(int)
+    fold = group_folds(y, groups, n_folds=5)
+    assert pd.Series(fold).groupby(groups).nunique().max() == 1
+    rates = [y[fold == k].mean() for k in range(5)]
+    assert max(rates) - min(rates) < 0.03
+
+
+def test_duplicates_do_not_see_each_others_label():
+    # Two copies of every track under a one-track artist: the only signal is the twin's label
+    n = 2000
+    y = np.repeat(np.random.default_rng(1).integers(0, 2, n), 2)
+    x = pd.DataFrame({'id_artists': [f"['a{i // 2}']" for i in range(2 * n)]})
+    groups = np.arange(2 * n) // 2
+    encoded = ArtistTargetEncoder(smoothing=1.0).fit_transform(x, y, groups=groups)
+    assert np.corrcoef(encoded['artist_popularity'], y)[0, 1] < 0.1
+    leaky = ArtistTargetEncoder(smoothing=1.0).fit_transform(x, y)
+    assert np.corrcoef(leaky['artist_popularity'], y)[0, 1] > 0.5
@@ -0,0 +1,13 @@
+import numpy as np
+import pandas as pd
+
+from tracks_topk import TopK
+
+
+def test_empty_where_means_all_rows():
+    frame = pd.DataFrame({'popularity': np.arange(100) % 7, 'danceability': np.linspace(0, 1, 100)})
+    top = TopK(frame)
+    assert top.mask([]) is None
+    expected = top.top('danceability', 5)
+    assert top.top('danceability', 5, where=[]).equals(expected)
+    assert top.top('danceability', 3, where=[('popularity', '==', 1)])['popularity'].eq(1).all()
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from tracks_tunequeue import open_queue
+
+
+@pytest.fixture(params=['queue.sqlite', 'queue'])
+def queue_path(request, tmp_path):
+    return str(tmp_path / request.param)
+
+
+def test_init_resumes_same_study_and_clears_another(queue_path):
+    specs = [{'shard': i} for i in range(3)]
+    queue = open_queue(queue_path)
+    assert not queue.init({'study': 'a'}, specs)
+    trial_id, _ = queue.claim('w')
+    queue.finish(trial_id, result={'rows': 1})
+
+    assert not queue.init({'study': 'a'}, specs)
+    assert sorted(queue.trials()['status']) == ['done', 'pending', 'pending']
+
+    assert queue.init({'study': 'b'}, specs)
+    trials = queue.trials()
+    assert list(trials['status']) == ['pending'] * 3
+
+
+def test_requeue_stale_fails_a_trial_after_max_attempts(queue_path):
+    queue = open_queue(queue_path)
+    queue.init({'study': 'a'}, [{'n_estimators': 10}])
+    for attempt in range(1, 4):
+        assert queue.claim('w') is not None
+        # lease=-1: every running trial counts as expired
+        queue.requeue_stale(lease=-1, max_attempts=3)
+        trial = queue.trials().iloc[0]
+        assert trial['attempts'] == attempt
+        assert trial['status'] == ('failed' if attempt == 3 else 'pending')
+    assert 'lease expired' in trial['error']
+    assert queue.claim('w') is None
+
+
+def test_trials_are_keyed_by_their_parameters(queue_path):
+    queue = open_queue(queue_path)
+    queue.init({'study': 'a'}, [{'max_depth': 4}, {'max_depth': 8}])
+    trial_id, params = queue.claim('w')
+    queue.finish(trial_id, result={'score': 1.0})
+    # Same study, the grid now lists the finished trial second
+    queue.init({'study': 'a'}, [{'max_depth': 2}, params])
+    trials = queue.trials()
+    done = trials[trials['status'] == 'done']
+    assert list(done['params']) == [json.dumps(params, sort_keys=True)]
+    assert sorted(trials['status']) == ['done', 'pending', 'pending']
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracks_validate import REQUIRED_COLUMNS, SchemaError, validate
+
+
+def _tracks(n=4):
+    frame = pd.DataFrame({c: np.full(n, 0.5) for c in REQUIRED_COLUMNS})
+    return frame.assign(id=[f't{i}' for i in range(n)], popularity=50, duration_ms=1000, explicit=0,
+                        key=1, mode=1, loudness=-5.0, tempo=120.0)
+
+
+def test_missing_column_is_a_schema_error():
+    with pytest.raises(SchemaError, match='energy'):
+        validate(_tracks().drop(columns='energy'))
+
+
+def test_keep_mask_and_valid_rows():
+    tracks = _tracks()
+    tracks.loc[1, 'energy'] = 1.5
+    tracks.loc[2, 'loudness'] = 3.0  # soft rule: counted, not quarantined
+    result = validate(tracks)
+    assert result.keep.tolist() == [True, False, True, True]
+    assert result.valid(tracks)['id'].tolist() == ['t0', 't2', 't3']
+    assert result.counts()[['energy_range', 'loudness_range']].tolist() == [1, 1]
+    clean = _tracks()
+    assert validate(clean).valid(clean) is clean
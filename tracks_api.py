@@ -0,0 +1,395 @@
+#%%[markdown]
+## Async Spotify Web API client
+#
+# Builds `tracks.csv`-shaped data straight from the API endpoints documented at
+# the top of `Team6_Tracks.py` ('Get Tracks' and 'Get Tracks Audio Features'):
+#
+# * ids are batched (50 per /v1/tracks call, 100 per /v1/audio-features call);
+# * one aiohttp session keeps a pool of keep-alive connections;
+# * a semaphore bounds the number of requests in flight;
+# * a 429 makes *every* task wait out `Retry-After` (counted against its own
+#   `max_rate_limits`, not the retries), 5xx/timeouts back off exponentially,
+#   a 401 refreshes the client-credentials token once;
+# * finished batches are written as typed parquet parts, so the output
+#   directory reads back with `pd.read_parquet` / `tracks_pipeline.read_tracks`;
+# * when a batch fails for good the other batches are cancelled, the rows
+#   already fetched are flushed and the error is re-raised; a rerun into the
+#   same directory skips the ids its parts already hold (ids the API had no
+#   track for are asked again).
+#
+#   python tracks_cli.py fetch --ids ids.txt --out api_tracks
+#   python tracks_cli.py fetch --ids ids.txt --out api_popularity --popularity-only
+#
+# Credentials come from SPOTIFY_CLIENT_ID / SPOTIFY_CLIENT_SECRET (or a ready
+# token in SPOTIFY_TOKEN). Needs `aiohttp`.
+
+#%%
+import asyncio
+import base64
+import contextlib
+import glob
+import json
+import os
+import random
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+API_URL = 'https://api.spotify.com/v1'
+TOKEN_URL = 'https://accounts.spotify.com/api/token'
+
+TRACKS_PER_CALL = 50
+FEATURES_PER_CALL = 100
+
+AUDIO_COLUMNS = ['danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                 'instrumentalness', 'liveness', 'valence', 'tempo', 'time_signature']
+
+# Column types of the cache; nullable ints because audio features can be missing
+TRACKS_DTYPES = {'id': 'string', 'name': 'string', 'popularity': 'Int16', 'duration_ms': 'Int64',
+                 'explicit': 'Int8', 'artists': 'string', 'id_artists': 'string', 'release_date': 'string',
+                 'danceability': 'float32', 'energy': 'float32', 'key': 'Int8', 'loudness': 'float32',
+                 'mode': 'Int8', 'speechiness': 'float32', 'acousticness': 'float32',
+                 'instrumentalness': 'float32', 'liveness': 'float32', 'valence': 'float32',
+                 'tempo': 'float32', 'time_signature': 'Int8'}
+
+
+class SpotifyError(Exception):
+    pass
+
+
+def _chunks(seq, size):
+    return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+
+def track_row(track):
+    """A /v1/tracks object as a tracks.csv row."""
+    artists = track.get('artists') or []
+    return {'id': track['id'], 'name': track.get('name'), 'popularity': track.get('popularity'),
+            'duration_ms': track.get('duration_ms'), 'explicit': int(bool(track.get('explicit'))),
+            'artists': str([a.get('name') for a in artists]),
+            'id_artists': str([a.get('id') for a in artists]),
+            'release_date': (track.get('album') or {}).get('release_date')}
+
+#%%
+
+
+class SpotifyClient:
+
+    def __init__(self, token=None, client_id=None, client_secret=None, api_url=API_URL,
+                 token_url=TOKEN_URL, concurrency=16, max_retries=6, max_rate_limits=30, timeout=30,
+                 cache=None):
+        self.token = token or os.environ.get('SPOTIFY_TOKEN')
+        self.client_id = client_id or os.environ.get('SPOTIFY_CLIENT_ID')
+        self.client_secret = client_secret or os.environ.get('SPOTIFY_CLIENT_SECRET')
+        self.api_url = api_url.rstrip('/')
+        self.token_url = token_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_rate_limits = max_rate_limits
+        self.timeout = timeout
+        self.cache = cache  # optional tracks_apicache.ResponseCache
+        self.session = None
+        self.requests = 0
+        self._resume_at = 0.0  # shared Retry-After deadline
+        self._token_lock = None
+
+    async def __aenter__(self):
+        import aiohttp
+
+        self._aiohttp = aiohttp
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._token_lock = asyncio.Lock()
+        if not self.token:
+            await self._refresh_token()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _refresh_token(self, stale=None):
+        async with self._token_lock:
+            if stale is not None and self.token != stale:
+                return  # another task already refreshed it
+            if not (self.client_id and self.client_secret):
+                raise SpotifyError("No token and no SPOTIFY_CLIENT_ID / SPOTIFY_CLIENT_SECRET")
+            auth = base64.b64encode(f'{self.client_id}:{self.client_secret}'.encode()).decode()
+            async with self.session.post(self.token_url, data={'grant_type': 'client_credentials'},
+                                         headers={'Authorization': f'Basic {auth}'}) as resp:
+                if resp.status != 200:
+                    raise SpotifyError(f"Token request failed: HTTP {resp.status}")
+                self.token = (await resp.json())['access_token']
+
+    async def get(self, path, **params):
+        return (await self.request(path, **params))[0]
+
+    async def request(self, path, etag=None, **params):
+        """
+        GET with bounded concurrency, shared 429 back-off and retries.
+
+        Returns (json, etag); with `etag` the request is conditional and a 304
+        returns (None, etag). A 429 is not a failure of the request, so it only
+        counts against `max_rate_limits`.
+        """
+        refreshed = False
+        attempt = limited = 0
+        while attempt <= self.max_retries:
+            wait = self._resume_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            token = self.token
+            try:
+                async with self._sem:
+                    self.requests += 1
+                    headers = {'Authorization': f'Bearer {token}'}
+                    if etag:
+                        headers['If-None-Match'] = etag
+                    async with self.session.get(f'{self.api_url}{path}', params=params, headers=headers) as resp:
+                        if resp.status == 200:
+                            return await resp.json(), resp.headers.get('ETag')
+                        if resp.status == 304:
+                            return None, etag
+                        if resp.status == 429:
+                            limited += 1
+                            if limited > self.max_rate_limits:
+                                raise SpotifyError(f"GET {path}: still rate limited after {limited - 1} waits")
+                            delay = float(resp.headers.get('Retry-After', 1))
+                            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                            continue
+                        if resp.status == 401 and not refreshed:
+                            refreshed = True
+                            await self._refresh_token(stale=token)
+                            attempt += 1
+                            continue
+                        if resp.status < 500:
+                            raise SpotifyError(f"GET {path}: HTTP {resp.status}")
+            except (self._aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    raise
+            # 5xx or network error: exponential back-off with jitter
+            if attempt < self.max_retries:
+                await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+        raise SpotifyError(f"GET {path}: giving up after {self.max_retries} retries")
+
+    async def items(self, path, field, ids):
+        """Objects for `ids` from one endpoint, through the cache when there is one."""
+        if self.cache is None:
+            data = await self.get(path, ids=','.join(ids))
+            return [item for item in data[field] if item]
+
+        cached, stale, missing = self.cache.lookup(path, ids)
+        todo = stale + missing
+        if todo:
+            # Revalidate only when every id of the request is cached under its ETag
+            etag = self.cache.etag(path, todo) if not missing else None
+            data, etag = await self.request(path, etag=etag, ids=','.join(todo))
+            if data is None:
+                self.cache.renew(path, todo)
+            else:
+                fetched = dict(zip(todo, data[field]))
+                self.cache.put(path, fetched)
+                self.cache.set_etag(path, todo, etag)
+                cached.update(fetched)
+        return [cached[i] for i in ids if cached.get(i)]
+
+    async def tracks(self, ids):
+        return [track_row(t) for t in await self.items('/tracks', 'tracks', ids)]
+
+    async def audio_features(self, ids):
+        return [{'id': f['id'], **{c: f.get(c) for c in AUDIO_COLUMNS}}
+                for f in await self.items('/audio-features', 'audio_features', ids)]
+
+    async def batch(self, ids, audio_features=True):
+        """One batch of up to 100 ids as a typed tracks frame."""
+        jobs = [self.tracks(chunk) for chunk in _chunks(ids, TRACKS_PER_CALL)]
+        if audio_features:
+            jobs.append(self.audio_features(ids))
+        results = await asyncio.gather(*jobs)
+        n_track_calls = len(results) - audio_features
+        frame = pd.DataFrame([row for part in results[:n_track_calls] for row in part],
+                             columns=list(TRACKS_DTYPES)[:8])
+        if audio_features:
+            features = pd.DataFrame(results[-1], columns=['id'] + AUDIO_COLUMNS)
+            frame = frame.merge(features, on='id', how='left')
+        return frame.astype({c: TRACKS_DTYPES[c] for c in frame.columns})
+
+#%%
+# Catalogue fetch
+
+
+def fetched_ids(out_dir):
+    """(ids already in the parquet parts of `out_dir`, next part number)."""
+    parts = sorted(glob.glob(os.path.join(out_dir, 'part-*.parquet')))
+    ids = set()
+    for path in parts:
+        ids.update(pd.read_parquet(path, columns=['id'])['id'])
+    return ids, (int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0)
+
+
+async def fetch_catalogue(ids, out_dir, audio_features=True, rows_per_part=200_000,
+                          client=None, **client_args):
+    """
+    Fetch the `ids` not yet in `out_dir` and write them there as parquet
+    parts; returns the number of rows this call wrote.
+
+    Batches run concurrently (bounded by the client's semaphore); finished
+    batches are buffered and flushed every `rows_per_part` rows, so memory stays
+    flat however many ids are fetched. On a failure the pending batches are
+    cancelled and the finished ones flushed before the error propagates.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    done_ids, part = fetched_ids(out_dir)
+    ids = [i for i in dict.fromkeys(ids) if i not in done_ids]
+    batches = _chunks(ids, FEATURES_PER_CALL)
+    buffered, n_buffered, written = [], 0, 0
+
+    def flush():
+        nonlocal buffered, n_buffered, written, part
+        if buffered:
+            frame = pd.concat(buffered, ignore_index=True)
+            frame.to_parquet(os.path.join(out_dir, f'part-{part:05d}.parquet'), index=False)
+            written += len(frame)
+            part += 1
+        buffered, n_buffered = [], 0
+
+    def collect(done):
+        """Buffer the finished batches, then raise the first failure among them."""
+        nonlocal n_buffered
+        failed = [t for t in done if t.cancelled() or t.exception() is not None]
+        for task in done:
+            if task not in failed:
+                buffered.append(task.result())
+                n_buffered += len(buffered[-1])
+        if failed:
+            failed[0].result()
+
+    own = client is None
+    client = client or SpotifyClient(**client_args)
+    if own:
+        await client.__aenter__()
+    pending = set()
+    try:
+        # Keep a bounded window of batch tasks so millions of ids do not become
+        # millions of pending coroutines at once
+        window = max(4 * client.concurrency, 1)
+        for batch in batches:
+            pending.add(asyncio.ensure_future(client.batch(batch, audio_features)))
+            if len(pending) >= window:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+                if n_buffered >= rows_per_part:
+                    flush()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            collect(done)
+        flush()
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            buffered.extend(t.result() for t in done if not t.cancelled() and t.exception() is None)
+        flush()
+        raise
+    finally:
+        if own:
+            await client.__aexit__(None, None, None)
+    return written
+
+
+def fetch(ids, out_dir, audio_features=True, mock=False, **client_args):
+    """Blocking wrapper around `fetch_catalogue`; `mock=True` serves `mock_app` locally."""
+    if not mock:
+        return asyncio.run(fetch_catalogue(ids, out_dir, audio_features, **client_args))
+
+    async def run():
+        async with serve_mock(**mock if isinstance(mock, dict) else {}) as (api_url, _):
+            return await fetch_catalogue(ids, out_dir, audio_features, token='mock', api_url=api_url,
+                                         **client_args)
+
+    return asyncio.run(run())
+
+#%%
+# Local mock of the two endpoints, for dry runs without credentials
+
+
+def mock_app(n_artists=1000, rate_limit_every=0, fail_after=None, seed=0, state=None):
+    """aiohttp app serving /v1/tracks and /v1/audio-features with deterministic fake data.
+
+    Every `rate_limit_every`-th request answers 429 with Retry-After: 1, and
+    with `fail_after` every request after that many answers 503 (an outage).
+    Request counts go to the `state` dict.
+    """
+    from aiohttp import web
+
+    state = {} if state is None else state
+    state.update(requests=0, not_modified=0)
+
+    def _rng(track_id):
+        return np.random.default_rng([seed, zlib.crc32(track_id.encode())])
+
+    def _limited():
+        state['requests'] += 1
+        if fail_after is not None and state['requests'] > fail_after:
+            raise web.HTTPServiceUnavailable()
+        return rate_limit_every and state['requests'] % rate_limit_every == 0
+
+    def _respond(request, body):
+        text = json.dumps(body)
+        etag = f'"{zlib.crc32(text.encode()):08x}"'
+        if request.headers.get('If-None-Match') == etag:
+            state['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=text, content_type='application/json', headers={'ETag': etag})
+
+    async def tracks(request):
+        if _limited():
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        out = []
+        for track_id in request.query['ids'].split(','):
+            rng = _rng(track_id)
+            artist = int(rng.integers(n_artists))
+            out.append({'id': track_id, 'name': f'Track {track_id[:6]}', 'popularity': int(rng.integers(0, 101)),
+                        'duration_ms': int(rng.integers(60_000, 400_000)), 'explicit': bool(rng.random() < 0.05),
+                        'artists': [{'id': f'artist{artist:06d}', 'name': f'Artist {artist}'}],
+                        'album': {'release_date': f'{int(rng.integers(1950, 2022))}-01-01'}})
+        return _respond(request, {'tracks': out})
+
+    async def features(request):
+        if _limited():
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        out = []
+        for track_id in request.query['ids'].split(','):
+            rng = _rng(track_id)
+            row = {c: float(rng.random()) for c in AUDIO_COLUMNS}
+            row.update(id=track_id, key=int(rng.integers(0, 12)), mode=int(rng.integers(0, 2)),
+                       loudness=-60 * row['loudness'], tempo=200 * row['tempo'], time_signature=4)
+            out.append(row)
+        return _respond(request, {'audio_features': out})
+
+    app = web.Application()
+    app.router.add_get('/v1/tracks', tracks)
+    app.router.add_get('/v1/audio-features', features)
+    return app
+
+
+@contextlib.asynccontextmanager
+async def serve_mock(**kwargs):
+    """Serve `mock_app(**kwargs)` on an ephemeral local port; yields (api_url, request counts)."""
+    from aiohttp import web
+
+    state = {}
+    runner = web.AppRunner(mock_app(state=state, **kwargs))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f'http://{host}:{port}/v1', state
+    finally:
+        await runner.cleanup()
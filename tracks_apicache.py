@@ -0,0 +1,167 @@
+#%%[markdown]
+## On-disk response cache for the Spotify client
+#
+# Audio features of a track never change after release; popularity (returned
+# by /v1/tracks) moves daily. `ResponseCache` keeps every item the client
+# fetched in one SQLite file, keyed by endpoint and track id:
+#
+# * per-endpoint TTLs: items younger than the TTL are served without a request
+#   (`DEFAULT_TTLS`: one day for tracks, a year for audio features);
+# * expired items are re-requested with the ETag of the batch they came from
+#   in `If-None-Match`; a 304 just renews them;
+# * values are zlib-compressed JSON and the file is bounded to `max_bytes`,
+#   evicting the least recently used items first.
+#
+#   python tracks_cli.py fetch --ids ids.txt --out api_tracks --cache api_cache.sqlite
+#
+# A second pull of the same catalogue within a day makes no requests; after a
+# day only the /v1/tracks batches go out again, as conditional requests.
+
+#%%
+import json
+import sqlite3
+import time
+import zlib
+
+DAY = 24 * 3600
+DEFAULT_TTLS = {'/tracks': DAY, '/audio-features': 365 * DAY}
+DEFAULT_MAX_BYTES = 512 * 2 ** 20
+
+
+class ResponseCache:
+
+    def __init__(self, path, ttls=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS items (
+                key TEXT PRIMARY KEY, value BLOB, size INTEGER,
+                fetched_at REAL, accessed_at REAL);
+            CREATE INDEX IF NOT EXISTS items_accessed ON items (accessed_at);
+            CREATE TABLE IF NOT EXISTS etags (key TEXT PRIMARY KEY, etag TEXT, size INTEGER,
+                                              accessed_at REAL);
+        ''')
+        self.size = self._total_size()
+        self.stats = {'fresh': 0, 'revalidated': 0, 'fetched': 0, 'evicted': 0}
+
+    def _total_size(self):
+        items = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM items').fetchone()[0]
+        etags = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM etags').fetchone()[0]
+        return items + etags
+
+    @staticmethod
+    def _key(path, item_id):
+        return f'{path}:{item_id}'
+
+    def lookup(self, path, ids):
+        """
+        Split `ids` into (items, stale, missing).
+
+        `items` maps id -> cached item (None for ids the API did not know) for
+        every id in the cache, fresh or not; `stale` lists the cached ids past
+        the endpoint TTL and `missing` the ids never fetched.
+        """
+        now = time.time()
+        ttl = self.ttls.get(path, 0)
+        keys = [self._key(path, i) for i in ids]
+        rows = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows.update((k, (v, t)) for k, v, t in self.conn.execute(
+                f'SELECT key, value, fetched_at FROM items WHERE key IN ({",".join("?" * len(chunk))})', chunk))
+
+        items, stale, missing = {}, [], []
+        for item_id, key in zip(ids, keys):
+            if key not in rows:
+                missing.append(item_id)
+                continue
+            value, fetched_at = rows[key]
+            items[item_id] = json.loads(zlib.decompress(value))
+            if now - fetched_at > ttl:
+                stale.append(item_id)
+        stale_set = set(stale)
+        fresh = [self._key(path, i) for i in items if i not in stale_set]
+        self.conn.executemany('UPDATE items SET accessed_at = ? WHERE key = ?', [(now, k) for k in fresh])
+        self.conn.commit()
+        self.stats['fresh'] += len(fresh)
+        return items, stale, missing
+
+    def put(self, path, items):
+        """Store `items` ({id: item or None}) as fetched now."""
+        now = time.time()
+        rows = []
+        for item_id, item in items.items():
+            value = zlib.compress(json.dumps(item, separators=(',', ':')).encode())
+            rows.append((self._key(path, item_id), value, len(value), now, now))
+        old = self._sizes([r[0] for r in rows])
+        self.conn.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)', rows)
+        self.size += sum(r[2] for r in rows) - old
+        self.stats['fetched'] += len(rows)
+        self._evict()
+        self.conn.commit()
+
+    def renew(self, path, ids):
+        """Mark cached items as fetched now (after a 304)."""
+        now = time.time()
+        self.conn.executemany('UPDATE items SET fetched_at = ?, accessed_at = ? WHERE key = ?',
+                              [(now, now, self._key(path, i)) for i in ids])
+        self.conn.commit()
+        self.stats['revalidated'] += len(ids)
+
+    def _sizes(self, keys):
+        total = 0
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            total += self.conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM items '
+                                       f'WHERE key IN ({",".join("?" * len(chunk))})', chunk).fetchone()[0]
+        return total
+
+    # ETags are per request (endpoint + exact id list), items per id
+
+    @staticmethod
+    def _request_key(path, ids):
+        return f'{path}?ids={",".join(ids)}'
+
+    def etag(self, path, ids):
+        key = self._request_key(path, ids)
+        row = self.conn.execute('SELECT etag FROM etags WHERE key = ?', (key,)).fetchone()
+        if row:
+            self.conn.execute('UPDATE etags SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        return row[0] if row else None
+
+    def set_etag(self, path, ids, etag):
+        if not etag:
+            return
+        key = self._request_key(path, ids)
+        size = len(key) + len(etag)
+        old = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM etags WHERE key = ?', (key,)).fetchone()[0]
+        self.conn.execute('INSERT OR REPLACE INTO etags VALUES (?, ?, ?, ?)', (key, etag, size, time.time()))
+        self.size += size - old
+        self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used items until back under 90% of max_bytes."""
+        if self.size <= self.max_bytes:
+            return
+        target = 0.9 * self.max_bytes
+        while self.size > target:
+            rows = self.conn.execute('SELECT key, size FROM items ORDER BY accessed_at LIMIT 1000').fetchall()
+            if not rows:
+                break
+            drop = []
+            for key, size in rows:
+                if self.size <= target:
+                    break
+                drop.append((key,))
+                self.size -= size
+            self.conn.executemany('DELETE FROM items WHERE key = ?', drop)
+            self.stats['evicted'] += len(drop)
+        # ETags older than every remaining item belong to evicted batches
+        self.conn.execute('DELETE FROM etags WHERE accessed_at < (SELECT MIN(accessed_at) FROM items)')
+        self.size = self._total_size()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,151 @@
+#%%[markdown]
+## Join with the artists table (followers, popularity, genres)
+#
+# Tracks reference their artists only through the `id_artists` list; followers,
+# artist popularity and genres live in the Kaggle `artists.csv`
+# (id, followers, genres, name, popularity). Exploding both lists and merging
+# on the 22-character id strings materializes one row per track x artist x
+# genre, several times the size of either table. `ArtistTable` instead
+#
+# * hashes artist ids to uint64 once and keeps them sorted, so an id becomes a
+#   dense row number with one `np.searchsorted` (-1 when unknown);
+# * keeps the genres as CSR arrays (indptr, indices into a genre vocabulary);
+# * joins with array lookups: per-track followers/popularity are segment
+#   reductions over the (track, artist row) entries, and the per-track genres
+#   are the sparse product tracks x artists @ artists x genres.
+#
+#   python tracks_cli.py artists --data tracks_clean.parquet --artists artists.csv --out tracks_artists.parquet
+#
+# writes the tracks with METADATA_FEATURES and `<out>.genres.npz` (tracks x
+# genres, vocabulary in `<out>.genres.txt`). `compare_naive` times both joins.
+
+#%%
+import time
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+from tracks_target import LIST_ITEM, artist_entries
+
+ARTISTS_COLUMNS = ['id', 'followers', 'genres', 'name', 'popularity']
+
+METADATA_FEATURES = ['artists_followers', 'artists_popularity', 'artists_genres']
+
+
+def read_artists(path):
+    with stage('read_artists') as s:
+        artists = pd.read_csv(path, usecols=ARTISTS_COLUMNS) if path.endswith('.csv') else pd.read_parquet(path)
+        s.rows_out = len(artists)
+    return artists
+
+
+def hash_ids(ids):
+    return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+
+def list_csr(lists):
+    """(indptr, indices, vocabulary) of "['a', 'b']" list strings."""
+    pos, values = artist_entries(lists)
+    indices, vocabulary = pd.factorize(values)
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pos, minlength=len(lists)), out=indptr[1:])
+    return indptr, indices.astype(np.int32), np.asarray(vocabulary, dtype=object)
+
+
+class ArtistTable:
+
+    def __init__(self, artists):
+        with stage('artist_table', rows_in=len(artists)) as s:
+            artists = artists.drop_duplicates('id')
+            hashes = hash_ids(artists['id'])
+            order = np.argsort(hashes)
+            self.hashes = hashes[order]
+            if len(self.hashes) and (self.hashes[1:] == self.hashes[:-1]).any():
+                raise ValueError("Artist id hash collision")
+            self.followers = artists['followers'].to_numpy(np.float64, na_value=np.nan)[order]
+            self.popularity = artists['popularity'].to_numpy(np.float64, na_value=np.nan)[order]
+            self.genre_indptr, self.genre_indices, self.genres = list_csr(artists['genres'].to_numpy()[order])
+            s.rows_out = len(self.hashes)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup(self, ids):
+        """Dense row number per artist id, -1 for ids not in the table."""
+        h = hash_ids(ids)
+        rows = np.searchsorted(self.hashes, h)
+        rows[rows == len(self.hashes)] = 0
+        return np.where(self.hashes[rows] == h, rows, -1) if len(self.hashes) else np.full(len(h), -1)
+
+    def genre_matrix(self):
+        """artists x genres, CSR."""
+        from scipy.sparse import csr_matrix
+
+        return csr_matrix((np.ones(len(self.genre_indices), dtype=np.float32), self.genre_indices,
+                           self.genre_indptr), shape=(len(self), len(self.genres)))
+
+    def join(self, tracks, column='id_artists'):
+        """
+        (frame of METADATA_FEATURES aligned with `tracks`, tracks x genres CSR).
+        Followers are log1p of the most followed artist; genres are the union
+        over the track's known artists.
+        """
+        from scipy.sparse import csr_matrix
+
+        n = len(tracks)
+        with stage('artist_join', rows_in=n) as s:
+            pos, ids = artist_entries(tracks[column])
+            rows = self.lookup(ids)
+            known = rows >= 0
+            pos, rows = pos[known], rows[known]
+
+            followers = np.full(n, np.nan)
+            np.fmax.at(followers, pos, np.log1p(self.followers[rows]))
+            popularity = np.full(n, np.nan)
+            np.fmax.at(popularity, pos, self.popularity[rows])
+
+            track_artists = csr_matrix((np.ones(len(pos), dtype=np.float32), (pos, rows)), shape=(n, len(self)))
+            genres = (track_artists @ self.genre_matrix()).tocsr()
+            genres.data[:] = 1
+            features = pd.DataFrame({'artists_followers': followers, 'artists_popularity': popularity,
+                                     'artists_genres': np.diff(genres.indptr)}, index=tracks.index)
+            s.rows_out = n
+        return features, genres
+
+
+def add_metadata(tracks, artists, column='id_artists'):
+    """`tracks` with METADATA_FEATURES, and the tracks x genres matrix."""
+    table = artists if isinstance(artists, ArtistTable) else ArtistTable(artists)
+    features, genres = table.join(tracks, column)
+    return pd.concat([tracks, features], axis=1), genres, table.genres
+
+#%%
+# Against explode-and-merge
+
+
+def naive_join(tracks, artists, column='id_artists'):
+    """The pandas version: explode the lists, merge on the id strings, explode the genres."""
+    entries = tracks[[column]].assign(artist=tracks[column].str.findall(LIST_ITEM)).explode('artist')
+    entries['artist'] = entries['artist'].str[1:-1]
+    merged = entries.merge(artists[['id', 'followers', 'popularity', 'genres']],
+                           left_on='artist', right_on='id', how='left')
+    merged['genre'] = merged['genres'].str.findall(LIST_ITEM)
+    merged = merged.explode('genre')
+    merged['genre'] = merged['genre'].str[1:-1]
+    return merged
+
+
+def compare_naive(tracks, artists, column='id_artists'):
+    """Seconds and result size of `ArtistTable.join` against `naive_join`."""
+    rows = []
+    t0 = time.perf_counter()
+    features, genres = ArtistTable(artists).join(tracks, column)
+    rows.append({'join': 'arrays + csr', 'seconds': time.perf_counter() - t0,
+                 'result_mb': (features.memory_usage(deep=True).sum() + genres.data.nbytes
+                               + genres.indices.nbytes + genres.indptr.nbytes) / 2 ** 20})
+    t0 = time.perf_counter()
+    merged = naive_join(tracks, artists, column)
+    rows.append({'join': 'explode + merge', 'seconds': time.perf_counter() - t0,
+                 'result_mb': merged.memory_usage(deep=True).sum() / 2 ** 20})
+    return pd.DataFrame(rows)
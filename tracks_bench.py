@@ -0,0 +1,218 @@
+#%%[markdown]
+## Benchmark history and regression detection
+#
+# `--profile` prints one run's stage timings and forgets them. With
+# `--bench DB` the CLI also appends the stage summary to a SQLite store, keyed
+# by git commit, subcommand, dataset size and stage:
+#
+#   python tracks_cli.py --bench benchmarks.sqlite train --data tracks_clean.parquet --models rf
+#
+# `compare` tells a slowdown from noise per (command, rows, stage):
+#
+# * with enough runs on both commits for the test to reach `alpha` (5 vs 5 at
+#   the default 0.01), a one-sided Mann-Whitney U test on wall time and peak
+#   RSS growth, and the median must also move by more than the noise
+#   threshold;
+# * with fewer runs, only the threshold: max(`min_effect`, 3 x the relative
+#   spread (MAD) of the base runs, or `DEFAULT_NOISE` when the base has a
+#   single run).
+#
+#   python tracks_cli.py bench compare --db benchmarks.sqlite --base <commit> --head <commit>
+#   python tracks_cli.py bench history --db benchmarks.sqlite --plot bench.png
+#
+# `compare` exits with 1 when something regressed, so the nightly job can run
+# it after the benchmarks. `plot_history` draws every stage's wall time over
+# the recorded commits.
+#
+# Runs recorded from a dirty work tree are stored under the commit they
+# started from but left out of `compare`, `history` and the plot unless
+# `include_dirty` (`--include-dirty`) is set. Peak RSS growth is the per-stage
+# sampled RSS of the process tree (see tracks_profile).
+
+#%%
+import os
+import platform
+import sqlite3
+import subprocess
+import time
+from math import comb
+
+import numpy as np
+import pandas as pd
+
+MIN_SAMPLES = 3
+ALPHA = 0.01
+MIN_EFFECT = 0.05
+DEFAULT_NOISE = 0.10
+# Peak RSS growth below this is allocator noise
+MIN_RSS_MB = 16.0
+
+METRICS = ('wall_s', 'peak_rss_delta_mb')
+
+
+def git_commit(path='.'):
+    """(short commit, dirty flag) of the work tree, or (None, None) outside git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=path, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+class BenchmarkStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY, git_commit TEXT, dirty INTEGER, command TEXT,
+                dataset TEXT, rows INTEGER, host TEXT, python TEXT, created_at REAL);
+            CREATE TABLE IF NOT EXISTS stages (
+                run_id INTEGER REFERENCES runs (id), stage TEXT, calls INTEGER, wall_s REAL,
+                cpu_s REAL, peak_rss_delta_mb REAL, rows_in INTEGER, rows_out INTEGER);
+            CREATE INDEX IF NOT EXISTS runs_key ON runs (command, rows, git_commit);
+            CREATE INDEX IF NOT EXISTS stages_run ON stages (run_id);
+        ''')
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, summary, command, dataset=None, rows=None, commit=None, dirty=None):
+        """Store a `tracks_profile.Profiler.summary()` table as one run; returns its id."""
+        if commit is None:
+            commit, dirty = git_commit(os.path.dirname(os.path.abspath(__file__)))
+        with self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO runs (git_commit, dirty, command, dataset, rows, host, python, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (commit, None if dirty is None else int(dirty), command, dataset,
+                 None if rows is None else int(rows), platform.node(), platform.python_version(), time.time()))
+            run_id = cur.lastrowid
+            self.conn.executemany(
+                'INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, name, int(r.calls), float(r.wall_s), float(r.cpu_s),
+                  _float(r.peak_rss_delta_mb), _int(r.rows_in), _int(r.rows_out))
+                 for name, r in summary.iterrows()])
+        return run_id
+
+    def history(self, command=None, rows=None, stage=None, include_dirty=False):
+        """One row per (run, stage), oldest run first; clean work trees only unless `include_dirty`."""
+        where, params = [], []
+        for column, value in (('r.command', command), ('r.rows', rows), ('s.stage', stage)):
+            if value is not None:
+                where.append(f'{column} = ?')
+                params.append(value)
+        if not include_dirty:
+            where.append('(r.dirty IS NULL OR r.dirty = 0)')
+        sql = ('SELECT r.id AS run_id, r.git_commit, r.dirty, r.command, r.dataset, r.rows, r.created_at, '
+               's.stage, s.calls, s.wall_s, s.cpu_s, s.peak_rss_delta_mb, s.rows_in, s.rows_out '
+               'FROM stages s JOIN runs r ON r.id = s.run_id'
+               + (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY r.id')
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def commits(self, include_dirty=False):
+        """Recorded commits, oldest first."""
+        where = '' if include_dirty else ' WHERE dirty IS NULL OR dirty = 0'
+        rows = self.conn.execute(f'SELECT git_commit FROM runs{where} GROUP BY git_commit ORDER BY MIN(id)').fetchall()
+        return [r[0] for r in rows]
+
+
+def _float(v):
+    return None if pd.isna(v) else float(v)
+
+
+def _int(v):
+    return None if pd.isna(v) else int(v)
+
+#%%
+# Regression detection
+
+
+def _noise(base):
+    """Relative spread of the base runs (scaled MAD / median)."""
+    if len(base) < 2 or np.median(base) <= 0:
+        return DEFAULT_NOISE
+    return 1.4826 * np.median(np.abs(base - np.median(base))) / np.median(base)
+
+
+def compare_samples(base, head, metric='wall_s', alpha=ALPHA, min_effect=MIN_EFFECT):
+    """Verdict for one metric of one stage: dict with ratio, p-value, threshold and regressed."""
+    base, head = np.asarray(base, dtype=np.float64), np.asarray(head, dtype=np.float64)
+    base, head = base[~np.isnan(base)], head[~np.isnan(head)]
+    if not len(base) or not len(head):
+        return None
+    b, h = float(np.median(base)), float(np.median(head))
+    threshold = max(min_effect, 3 * _noise(base))
+    if metric == 'peak_rss_delta_mb' and max(b, h) < MIN_RSS_MB:
+        return {'base': b, 'head': h, 'ratio': np.nan, 'p_value': np.nan, 'threshold': threshold,
+                'regressed': False}
+    ratio = h / b if b > 0 else np.inf
+    p_value = np.nan
+    regressed = ratio > 1 + threshold
+    # The test only has a say when it can reach `alpha` at all (3 vs 3 runs: p >= 0.05)
+    attainable = 1 / comb(len(base) + len(head), len(head)) <= alpha
+    if len(base) >= MIN_SAMPLES and len(head) >= MIN_SAMPLES and attainable:
+        from scipy.stats import mannwhitneyu
+
+        p_value = float(mannwhitneyu(head, base, alternative='greater').pvalue)
+        regressed = regressed and p_value < alpha
+    return {'base': b, 'head': h, 'ratio': ratio, 'p_value': p_value, 'threshold': threshold,
+            'regressed': bool(regressed)}
+
+
+def compare(store, base, head, alpha=ALPHA, min_effect=MIN_EFFECT, metrics=METRICS, include_dirty=False):
+    """
+    Per (command, rows, stage, metric) verdicts of `head` against `base`
+    commits, regressions first.
+    """
+    table = store.history(include_dirty=include_dirty)
+    table = table[table['git_commit'].isin([base, head])]
+    rows = []
+    for (command, n, stage), group in table.groupby(['command', 'rows', 'stage'], dropna=False):
+        for metric in metrics:
+            verdict = compare_samples(group.loc[group['git_commit'] == base, metric],
+                                      group.loc[group['git_commit'] == head, metric],
+                                      metric, alpha, min_effect)
+            if verdict is None:
+                continue
+            rows.append(dict(command=command, rows=n, stage=stage, metric=metric,
+                             n_base=int((group['git_commit'] == base).sum()),
+                             n_head=int((group['git_commit'] == head).sum()), **verdict))
+    out = pd.DataFrame(rows, columns=['command', 'rows', 'stage', 'metric', 'n_base', 'n_head', 'base',
+                                      'head', 'ratio', 'p_value', 'threshold', 'regressed'])
+    return out.sort_values(['regressed', 'ratio'], ascending=False, ignore_index=True)
+
+#%%
+# History plot
+
+
+def plot_history(store, path, command=None, rows=None, top=8, include_dirty=False):
+    """Median wall time of the `top` slowest stages per recorded commit, one line per stage."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    table = store.history(command=command, rows=rows, include_dirty=include_dirty)
+    if table.empty:
+        return None
+    commits = list(dict.fromkeys(table['git_commit'].fillna('-')))
+    table = table.assign(git_commit=table['git_commit'].fillna('-'))
+    medians = table.pivot_table(index='git_commit', columns='stage', values='wall_s', aggfunc='median')
+    medians = medians.reindex(commits)
+    stages = medians.max().sort_values(ascending=False).index[:top]
+
+    fig, ax = plt.subplots(figsize=(max(7, len(commits) * 0.6), 6))
+    for stage in stages:
+        ax.plot(range(len(commits)), medians[stage].to_numpy(), marker='o', label=stage)
+    ax.set_xticks(range(len(commits)), commits, rotation=45, ha='right')
+    ax.set(ylabel='wall time (s, median over runs)', title='Stage timings by commit'
+           + (f': {command}' if command else '') + (f', {rows} rows' if rows else ''))
+    ax.set_yscale('log')
+    ax.legend(fontsize='small')
+    fig.savefig(path, dpi=80, bbox_inches='tight')
+    plt.close(fig)
+    return path
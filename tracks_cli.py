@@ -0,0 +1,639 @@
+#%%[markdown]
+## Command line entry point
+#
+#   python tracks_cli.py ingest --csv tracks.csv --out tracks_clean.parquet
+#   python tracks_cli.py eda    --data tracks_clean.parquet --out report --models rf
+#   python tracks_cli.py train  --data tracks_clean.parquet --models logistic knn rf
+#   python tracks_cli.py tune   --data tracks_clean.parquet
+#   python tracks_cli.py score  --data new_tracks.csv --models-dir models --out scores.csv
+#   python tracks_cli.py startup        # cold-start time of every subcommand vs budget
+#
+# Only argparse is imported at module level; each subcommand imports what it
+# needs inside its handler. `--startup-only` stops a subcommand right after its
+# imports, which is what `startup` times in a fresh interpreter.
+
+#%%
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Cold-start budget per subcommand in seconds (fresh interpreter, imports only)
+STARTUP_BUDGETS = {'ingest': 1.5, 'score': 3.0, 'eda': 4.0, 'train': 4.0, 'tune': 4.0}
+# Environment variable that scales every budget (slow CI machines); `startup --budget-scale` overrides it
+STARTUP_SCALE_ENV = 'TRACKS_STARTUP_BUDGET_SCALE'
+
+# Same names as tracks_pipeline.MODEL_NAMES, kept here so parsing needs no pandas
+MODEL_CHOICES = ['logistic', 'knn', 'rf_all', 'rf', 'rf_hist', 'logistic_sparse', 'sgd']
+
+
+def cmd_ingest(args):
+    import pandas as pd
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    from tracks_validate import ChunkedValidator, SchemaError
+
+    if args.chunksize:
+        chunks = pd.read_csv(args.csv, chunksize=args.chunksize)
+    else:
+        chunks = [tp.read_tracks(args.csv)]
+    validator = ChunkedValidator(args.quarantine)
+    try:
+        tracks = pd.concat([tp.clean_tracks(chunk) for chunk in validator.run(chunks)], ignore_index=True)
+    except SchemaError as e:
+        raise SystemExit(f"{args.csv}: {e}")
+    print(validator.counts[validator.counts > 0].to_string())
+    print(f"{validator.rejected} of {validator.rows} rows quarantined"
+          + (f" to {args.quarantine}" if args.quarantine else ''))
+    path = tp.write_cache(tracks, args.out, args.quantize)
+    print(f"{len(tracks)} cleaned tracks written to {path}")
+    return 0
+
+
+def cmd_eda(args):
+    import tracks_pipeline as tp
+    import tracks_report
+    from tracks_topk import TopK
+    if args.startup_only:
+        return 0
+
+    spotifydf = tp.modeling_frame(tp.read_tracks(args.data))
+
+    top = TopK(spotifydf, ['popularity', 'danceability'])
+    print(top.top('danceability', 10, where=[('popularity', '==', 1)],
+                  columns=['name', 'artists', 'danceability', 'energy']))
+
+    roc, fitted, shap = {}, {}, {}
+    for name in args.models:
+        bundle = tp.load_model(os.path.join(args.models_dir, f'{name}.pkl'))
+        _, x_test, _, y_test = tp.split(spotifydf, bundle['features'])
+        roc[name] = (y_test, bundle['model'].predict_proba(x_test)[:, 1])
+        fitted[name] = (y_test, bundle['model'].predict(x_test))
+        if args.shap and name in ('rf', 'rf_all'):
+            import tracks_shap
+
+            # A `train --artists` pipeline: explain its forest on the encoded columns
+            forest, x_explain = tp.final_estimator(bundle['model'], x_test)
+            phi, _ = tracks_shap.forest_shap(forest, x_explain, workers=args.workers)
+            shap[name] = tracks_shap.summarize(phi, x_explain.columns)
+
+    entries = tracks_report.build_report(spotifydf, args.out, roc, fitted, args.workers, shap)
+    redrawn = sum(not e['cached'] for e in entries)
+    print(f"{len(entries)} figures in {args.out}/index.html ({redrawn} redrawn)")
+    return 0
+
+
+def cmd_train(args):
+    import tracks_pipeline as tp
+    from tracks_select import model_file_key
+    if args.startup_only:
+        return 0
+
+    spotifydf = tp.modeling_frame(tp.read_tracks(args.data))
+    os.makedirs(args.models_dir, exist_ok=True)
+    names = list(args.models)
+    forest_path = os.path.join(args.models_dir, 'rf_all.pkl')
+    if args.select and 'rf' in names and ('rf_all' in names or not os.path.exists(forest_path)):
+        # rf's features come from the rf_all forest: fit it first, also when no earlier run saved one
+        if 'rf_all' not in names:
+            print(f"no {forest_path} yet: fitting rf_all for the feature selection")
+        names = [n for n in names if n != 'rf_all']
+        names.insert(names.index('rf'), 'rf_all')
+    fitted = {}
+    for name in names:
+        features = tp.MODEL_FEATURES[name]
+        if name == 'rf' and args.select:
+            # Importances of the rf_all forest, fitted in this run or an earlier one
+            forest = fitted.get('rf_all') or tp.load_model(forest_path)['model']
+            features = tp.select_rf_features(spotifydf, forest, method=args.select,
+                                             model_key=model_file_key(forest_path))
+            print('selected features:', features)
+        oob = args.oob and name in ('rf', 'rf_all')
+        model, metrics = tp.train_model(name, spotifydf, use_smote=args.smote and not oob,
+                                        features=features, oob=oob, artists=args.artists)
+        fitted[name] = model
+        if args.artists:
+            features = tp.with_artists(features)
+        tp.save_model(model, features, os.path.join(args.models_dir, f'{name}.pkl'))
+        print(name, ' '.join(f'{k}={v:.4f}' for k, v in metrics.items()))
+    return 0
+
+
+def cmd_tune(args):
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    spotifydf = tp.modeling_frame(tp.read_tracks(args.data))
+    if args.warm:
+        results = tp.tune_rf_warm(spotifydf, cv=args.cv)
+        print(results.head(10).to_string())
+        return 0
+    search = tp.tune_rf(spotifydf, cv=args.cv, n_jobs=args.n_jobs)
+    print(search.best_params_, search.best_score_)
+    return 0
+
+
+def cmd_score(args):
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    bundles = {}
+    for name in args.models:
+        bundles[name] = tp.load_model(os.path.join(args.models_dir, f'{name}.pkl'))
+    scores = tp.score_tracks(tp.read_tracks(args.data), bundles)
+    scores.to_csv(args.out, index=False)
+    print(f"{len(scores)} tracks scored into {args.out}")
+    return 0
+
+
+def measure_startup(command, repeat=3):
+    """Best-of-`repeat` wall time of `command --startup-only` in a fresh interpreter."""
+    argv = [sys.executable, os.path.abspath(__file__), '--startup-only', command]
+    argv += STARTUP_ARGS.get(command, [])
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(argv, check=True, stdout=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def cmd_startup(args):
+    unknown = set(args.commands) - set(STARTUP_BUDGETS)
+    if unknown:
+        raise SystemExit(f"Unknown command(s): {', '.join(sorted(unknown))}")
+    over = 0
+    for command in args.commands or list(STARTUP_BUDGETS):
+        took = measure_startup(command, args.repeat)
+        budget = STARTUP_BUDGETS[command] * args.budget_scale
+        flag = 'OK' if took <= budget else 'OVER BUDGET'
+        over += took > budget
+        print(f"{command:<8}{took:7.3f}s  (budget {budget:.2f}s)  {flag}")
+    return 1 if over else 0
+
+
+# Dummy arguments so `startup` can launch commands whose arguments are required
+STARTUP_ARGS = {'ingest': ['--csv', 'x.csv'], 'eda': ['--data', 'x'], 'train': ['--data', 'x'],
+                'tune': ['--data', 'x'], 'score': ['--data', 'x']}
+
+
+def cmd_parity(args):
+    import tracks_histforest
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    spotifydf = tp.modeling_frame(tp.read_tracks(args.data))
+    x_train, x_test, y_train, y_test = tp.split(spotifydf, tp.RF_FEATURES)
+    params = {k: v for k, v in tp.RF_BEST_PARAMS.items() if k not in ('criterion', 'oob_score')}
+    params['n_estimators'] = args.n_estimators
+    print(tracks_histforest.compare_with_sklearn(x_train, y_train, x_test, y_test, **params))
+    return 0
+
+
+def cmd_queue(args):
+    import tracks_tunequeue as tq
+    if args.startup_only:
+        return 0
+
+    if args.action == 'init':
+        if not args.data:
+            raise SystemExit('queue init needs --data')
+        tq.init_study(args.queue, args.data, n_iter=args.random, cv=args.cv)
+    elif args.action == 'worker':
+        print(f"{tq.run_worker(args.queue)} trials run by {tq.worker_name()}")
+        return 0
+    elif args.action == 'local':
+        tq.run_local(args.queue, args.workers, lease=args.lease, max_attempts=args.max_attempts)
+
+    counts, table = tq.results(args.queue, lease=args.lease, max_attempts=args.max_attempts)
+    print(counts.to_string())
+    if len(table):
+        print(table.head(10).to_string())
+    return 0
+
+
+def cmd_shard(args):
+    import tracks_shard as ts
+    if args.startup_only:
+        return 0
+
+    if args.action == 'init':
+        if not (args.data and args.work):
+            raise SystemExit('shard init needs --data and --work')
+        ts.init_scoring(args.queue, args.data, args.work, args.shards, args.models, args.models_dir)
+    elif args.action == 'worker':
+        print(f"{ts.run_worker(args.queue)} shards scored by {ts.worker_name()}")
+        return 0
+    elif args.action == 'local':
+        t0 = time.perf_counter()
+        ts.run_local(args.queue, args.workers, lease=args.lease, max_attempts=args.max_attempts)
+        print(f"scored in {time.perf_counter() - t0:.1f}s")
+    if args.action in ('local', 'merge'):
+        scores = ts.merge(args.queue, args.out)
+        print(f"{len(scores)} tracks scored into {args.out}")
+
+    print(ts.status(args.queue, args.lease, args.max_attempts).to_string())
+    return 0
+
+
+def cmd_delta(args):
+    import tracks_delta
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    store = tracks_delta.DeltaStore(args.store)
+    tracks = tp.read_tracks(args.csv)
+    if args.action == 'build':
+        print(f"{store.build(tracks)} cleaned tracks in {args.store}")
+        return 0
+
+    summary = store.apply(tracks, args.models_dir)
+    if summary['replayed']:
+        print(f"{args.csv} was already applied as delta #{summary['seq']}; nothing to do")
+        return 0
+    tracks_delta.write_rescore_lists(summary, os.path.join(args.store, 'rescore'))
+    print(f"{len(summary['inserted'])} inserted, {len(summary['updated'])} updated, "
+          f"{len(summary['removed'])} removed")
+    for model, ids in summary['rescore'].items():
+        print(f"  {model}: {len(ids)} tracks to rescore")
+    return 0
+
+
+def cmd_fetch(args):
+    import tracks_api
+    if args.startup_only:
+        return 0
+
+    with open(args.ids) as f:
+        ids = [line.strip() for line in f if line.strip()]
+    cache = None
+    if args.cache:
+        from tracks_apicache import ResponseCache
+        cache = ResponseCache(args.cache, max_bytes=args.cache_mb * 2 ** 20)
+    t0 = time.perf_counter()
+    n = tracks_api.fetch(ids, args.out, audio_features=not args.popularity_only,
+                         mock={'rate_limit_every': 50} if args.mock else False,
+                         concurrency=args.concurrency, cache=cache)
+    print(f"{n} tracks written to {args.out} in {time.perf_counter() - t0:.1f}s")
+    if cache is not None:
+        print('cache:', ', '.join(f'{k} {v}' for k, v in cache.stats.items()))
+    return 0
+
+
+def cmd_quantize(args):
+    import tracks_pipeline as tp
+    import tracks_quantize as tq
+    if args.startup_only:
+        return 0
+
+    tracks = tp.read_tracks(args.data)
+    for bits in args.bits:
+        spec = tq.quant_spec(bits)
+        fp = tq.footprint(tracks, bits)
+        print(f"uint{bits}: {fp['columns']} columns {fp['full_bytes'] / 2**20:.1f} MB -> "
+              f"{fp['quantized_bytes'] / 2**20:.1f} MB ({fp['ratio']:.1f}x), max error "
+              + ', '.join(f"{c} {spec[c]['max_error']:.1e}" for c in ('danceability', 'loudness', 'tempo')))
+    if args.models:
+        table = tq.compare_accuracy(tp.modeling_frame(tracks), args.models, args.bits)
+        print(table.round(4).to_string(index=False))
+    return 0
+
+
+def cmd_neighbors(args):
+    import tracks_neighbors
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    spotifydf = tp.modeling_frame(tp.read_tracks(args.data))
+    table = tracks_neighbors.benchmark(spotifydf, tp.KNN_FEATURES, args.batch, args.batches)
+    print(table.round(4).to_string(index=False))
+    print(f"mean insert {table['insert_s'].mean() * 1e3:.1f} ms vs rebuild {table['rebuild_s'].mean() * 1e3:.1f} ms")
+    return 0
+
+
+def cmd_dedup(args):
+    import numpy as np
+    import tracks_dedup
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    tracks = tp.read_tracks(args.data)
+    groups = tracks_dedup.find_duplicates(tracks, eps=args.eps)
+    sizes = np.bincount(groups)
+    print(f"{int((sizes[groups] > 1).sum())} of {len(tracks)} tracks in "
+          f"{int((sizes > 1).sum())} near-duplicate groups")
+    if args.drop:
+        tracks = tracks_dedup.drop_duplicates(tracks, groups)
+    else:
+        tracks = tracks.assign(dup_group=groups)
+    path = tp.write_cache(tracks, args.out)
+    print(f"{len(tracks)} tracks written to {path}")
+    return 0
+
+
+def cmd_artists(args):
+    import tracks_artists as ta
+    import tracks_pipeline as tp
+    if args.startup_only:
+        return 0
+
+    tracks = tp.read_tracks(args.data)
+    artists = ta.read_artists(args.artists)
+    if args.compare:
+        print(ta.compare_naive(tracks, artists).to_string(index=False))
+        return 0
+
+    from scipy.sparse import save_npz
+
+    tracks, genres, vocabulary = ta.add_metadata(tracks, artists)
+    path = tp.write_cache(tracks, args.out)
+    stem = os.path.splitext(path)[0]
+    save_npz(stem + '.genres.npz', genres)
+    with open(stem + '.genres.txt', 'w') as f:
+        f.write('\n'.join(vocabulary))
+    known = tracks['artists_followers'].notna().mean()
+    print(f"{len(tracks)} tracks written to {path} ({known:.1%} with artist metadata); "
+          f"genres {genres.shape[1]} x {genres.nnz} entries in {stem}.genres.npz")
+    return 0
+
+
+def cmd_stack(args):
+    import tracks_pipeline as tp
+    import tracks_stack
+    if args.startup_only:
+        return 0
+
+    spotifydf = tp.modeling_frame(tp.read_tracks(args.data))
+    _, table = tracks_stack.stack(spotifydf, args.models, meta=args.meta, n_folds=args.folds,
+                                  n_jobs=args.workers, cache_dir=args.cache_dir)
+    print(table.to_string(float_format='%.4f'))
+    return 0
+
+
+def cmd_explain(args):
+    import numpy as np
+    import tracks_pipeline as tp
+    import tracks_shap
+    if args.startup_only:
+        return 0
+
+    bundle = tp.load_model(args.model)
+    tracks = tp.read_tracks(args.data)
+    if args.rows and args.rows < len(tracks):
+        tracks = tracks.sample(args.rows, random_state=0)
+    forest, x = tp.final_estimator(bundle['model'], tracks[bundle['features']])
+    if not hasattr(forest, 'estimators_'):
+        raise SystemExit(f"{args.model} holds a {type(forest).__name__}; explain needs a sklearn random forest")
+    phi, expected = tracks_shap.forest_shap(forest, x, workers=args.workers)
+    np.save(args.out, phi)
+    print(f"{phi.shape[0]} x {phi.shape[1]} float32 attributions written to {args.out} "
+          f"(expected value {expected:.4f})")
+    print(tracks_shap.summarize(phi, x.columns).to_string(float_format='%.4f'))
+    return 0
+
+
+def cmd_bench(args):
+    import tracks_bench
+    if args.startup_only:
+        return 0
+
+    store = tracks_bench.BenchmarkStore(args.db)
+    if args.action == 'history':
+        table = store.history(command=args.bench_command, rows=args.rows, include_dirty=args.include_dirty)
+        print(table.groupby(['git_commit', 'command', 'rows', 'stage'], sort=False, dropna=False)
+              [['wall_s', 'peak_rss_delta_mb']].median().to_string(float_format='%.3f'))
+        if args.plot:
+            print('plot written to', tracks_bench.plot_history(store, args.plot, args.bench_command, args.rows,
+                                                               include_dirty=args.include_dirty))
+        return 0
+
+    commits = store.commits(args.include_dirty)
+    head = args.head or (commits[-1] if commits else None)
+    base = args.base or (commits[commits.index(head) - 1] if head in commits and commits.index(head) else None)
+    if not base or not head:
+        raise SystemExit('bench compare needs two recorded commits (--base/--head)')
+    table = tracks_bench.compare(store, base, head, alpha=args.alpha, min_effect=args.min_effect,
+                                 include_dirty=args.include_dirty)
+    print(f"{head} against {base}")
+    print(table.to_string(index=False, float_format='%.3f'))
+    regressed = table[table['regressed']]
+    if len(regressed):
+        print(f"{len(regressed)} regression(s): "
+              + ', '.join(f"{r.command}/{r.stage} {r.metric} x{r.ratio:.2f}" for r in regressed.itertuples()))
+        return 1
+    return 0
+
+
+def record_benchmark(args):
+    """Append this run's stage summary to the --bench store."""
+    import tracks_bench
+    import tracks_profile
+
+    records = tracks_profile.PROFILER.records
+    if not records:
+        return
+    reads = [r['rows_out'] for r in records if r['name'] == 'read_tracks' and r['rows_out'] is not None]
+    rows = reads[0] if reads else max((r['rows_in'] or 0 for r in records), default=None) or None
+    store = tracks_bench.BenchmarkStore(args.bench)
+    store.record(tracks_profile.PROFILER.summary(), args.command,
+                 dataset=getattr(args, 'data', None) or getattr(args, 'csv', None), rows=rows)
+    store.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='tracks_cli', description='Spotify tracks popularity pipeline')
+    parser.add_argument('--startup-only', action='store_true',
+                        help='exit right after the subcommand imports (for startup timing)')
+    parser.add_argument('--profile', metavar='TRACE_JSON', default=None,
+                        help='enable stage profiling and write a Chrome trace')
+    parser.add_argument('--bench', metavar='DB', default=None,
+                        help='enable stage profiling and append the run to this benchmark history')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('ingest', help='clean tracks.csv into the cached store')
+    p.add_argument('--csv', required=True)
+    p.add_argument('--out', default='tracks_clean.parquet')
+    p.add_argument('--quarantine', metavar='CSV', help='write rows failing validation here')
+    p.add_argument('--chunksize', type=int, default=None, help='validate and clean the CSV in chunks')
+    p.add_argument('--quantize', type=int, choices=[8, 16], default=None,
+                   help='store audio features as uint8/uint16 codes')
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser('eda', help='render the EDA report (PNG + HTML)')
+    p.add_argument('--data', required=True)
+    p.add_argument('--out', default='report')
+    p.add_argument('--models', nargs='*', default=[], choices=MODEL_CHOICES,
+                   help='trained models to add ROC and actual-vs-fitted figures for')
+    p.add_argument('--models-dir', default='models')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--shap', action='store_true', help='add a TreeSHAP importance figure for rf / rf_all')
+    p.set_defaults(func=cmd_eda)
+
+    p = sub.add_parser('train', help='fit the logistic, KNN and RF models')
+    p.add_argument('--data', required=True)
+    p.add_argument('--models', nargs='+', default=['logistic', 'knn', 'rf'],
+                   choices=MODEL_CHOICES)
+    p.add_argument('--smote', action='store_true')
+    p.add_argument('--oob', action='store_true',
+                   help='fit the sklearn forests on all rows and report out-of-bag metrics')
+    p.add_argument('--select', choices=['mdi', 'permutation'], default=None,
+                   help='pick the rf features from the fitted rf_all forest instead of the fixed list')
+    p.add_argument('--artists', action='store_true',
+                   help='add the out-of-fold artist popularity encoding to every feature list')
+    p.add_argument('--models-dir', default='models')
+    p.set_defaults(func=cmd_train)
+
+    p = sub.add_parser('tune', help='grid search for the random forest')
+    p.add_argument('--data', required=True)
+    p.add_argument('--cv', type=int, default=5)
+    p.add_argument('--n-jobs', type=int, default=-1)
+    p.add_argument('--warm', action='store_true',
+                   help='grow one warm-started forest per combination instead of one per n_estimators')
+    p.set_defaults(func=cmd_tune)
+
+    p = sub.add_parser('score', help='score tracks with trained models')
+    p.add_argument('--data', required=True)
+    p.add_argument('--models', nargs='+', default=['rf'])
+    p.add_argument('--models-dir', default='models')
+    p.add_argument('--out', default='scores.csv')
+    p.set_defaults(func=cmd_score)
+
+    p = sub.add_parser('fetch', help='build tracks data from the Spotify Web API')
+    p.add_argument('--ids', required=True, help='text file with one track id per line')
+    p.add_argument('--out', default='api_tracks', help='output directory of parquet parts')
+    p.add_argument('--popularity-only', action='store_true', help='skip audio features')
+    p.add_argument('--concurrency', type=int, default=16)
+    p.add_argument('--cache', metavar='SQLITE', help='response cache file (tracks_apicache)')
+    p.add_argument('--cache-mb', type=int, default=512, help='cache size bound in MB')
+    p.add_argument('--mock', action='store_true', help='serve fake data from a local mock server')
+    p.set_defaults(func=cmd_fetch)
+
+    p = sub.add_parser('quantize', help='footprint and accuracy of the quantized storage format')
+    p.add_argument('--data', required=True)
+    p.add_argument('--bits', type=int, nargs='+', choices=[8, 16], default=[8, 16])
+    p.add_argument('--models', nargs='*', default=['logistic', 'knn', 'rf'], choices=MODEL_CHOICES)
+    p.set_defaults(func=cmd_quantize)
+
+    p = sub.add_parser('delta', help='build the id-keyed store or upsert a weekly delta into it')
+    p.add_argument('action', choices=['build', 'apply'])
+    p.add_argument('--store', default='store')
+    p.add_argument('--csv', required=True, help='full tracks.csv (build) or the delta rows (apply)')
+    p.add_argument('--models-dir', default=None, help='trained models to check for rescoring')
+    p.set_defaults(func=cmd_delta)
+
+    p = sub.add_parser('queue', help='distributed RF tuning over a SQLite file or shared directory')
+    p.add_argument('action', choices=['init', 'worker', 'local', 'status'])
+    p.add_argument('--queue', required=True, help='path.sqlite (SQLite queue) or a directory')
+    p.add_argument('--data', help='cleaned tracks for init')
+    p.add_argument('--random', type=int, default=None, help='sample this many grid points (init)')
+    p.add_argument('--cv', type=int, default=5)
+    p.add_argument('--workers', type=int, default=os.cpu_count())
+    p.add_argument('--lease', type=float, default=600, help='seconds before a silent trial is requeued')
+    p.add_argument('--max-attempts', type=int, default=3,
+                   help='claims of a trial whose lease expires before it is marked failed')
+    p.set_defaults(func=cmd_queue)
+
+    p = sub.add_parser('shard', help='score the catalogue in hash-partitioned shards')
+    p.add_argument('action', choices=['init', 'worker', 'local', 'merge', 'status'])
+    p.add_argument('--queue', required=True, help='path.sqlite (SQLite queue) or a shared directory')
+    p.add_argument('--data', help='tracks to score (init)')
+    p.add_argument('--work', help='directory for shard inputs and outputs (init)')
+    p.add_argument('--shards', type=int, default=16)
+    p.add_argument('--models', nargs='+', default=['rf'], choices=MODEL_CHOICES)
+    p.add_argument('--models-dir', default='models')
+    p.add_argument('--workers', type=int, default=os.cpu_count())
+    p.add_argument('--lease', type=float, default=600, help='seconds before a silent shard is requeued')
+    p.add_argument('--max-attempts', type=int, default=3, help='tries per shard before giving up')
+    p.add_argument('--out', default='scores.csv')
+    p.set_defaults(func=cmd_shard)
+
+    p = sub.add_parser('neighbors', help='incremental KNN index: insert cost against a full rebuild')
+    p.add_argument('--data', required=True)
+    p.add_argument('--batch', type=int, default=1000, help='tracks per simulated daily release')
+    p.add_argument('--batches', type=int, default=10)
+    p.set_defaults(func=cmd_neighbors)
+
+    p = sub.add_parser('dedup', help='find near-duplicate tracks (LSH on audio features + name keys)')
+    p.add_argument('--data', required=True, help='cleaned tracks')
+    p.add_argument('--out', default='tracks_dedup.parquet')
+    p.add_argument('--eps', type=float, default=0.05, help='RMS distance in standard deviations')
+    p.add_argument('--drop', action='store_true',
+                   help='keep the most popular track per group instead of adding dup_group')
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser('artists', help='join the artists table (followers, popularity, genres)')
+    p.add_argument('--data', required=True, help='cleaned tracks')
+    p.add_argument('--artists', required=True, help='artists.csv or parquet')
+    p.add_argument('--out', default='tracks_artists.parquet')
+    p.add_argument('--compare', action='store_true', help='time against an explode-and-merge join instead')
+    p.set_defaults(func=cmd_artists)
+
+    p = sub.add_parser('stack', help='stacked ensemble over cached out-of-fold base model predictions')
+    p.add_argument('--data', required=True)
+    p.add_argument('--models', nargs='+', default=['logistic', 'knn', 'rf'], choices=MODEL_CHOICES)
+    p.add_argument('--meta', default='logistic', choices=['logistic', 'rf'])
+    p.add_argument('--folds', type=int, default=5)
+    p.add_argument('--workers', type=int, default=-1, help='joblib workers for the base model fits')
+    p.add_argument('--cache-dir', default=os.path.join('.cache', 'stacking'))
+    p.set_defaults(func=cmd_stack)
+
+    p = sub.add_parser('explain', help='exact TreeSHAP attributions of a random forest for every track')
+    p.add_argument('--data', required=True, help='cleaned tracks')
+    p.add_argument('--model', required=True, help='pickled rf/rf_all bundle from train')
+    p.add_argument('--out', default='shap.npy')
+    p.add_argument('--rows', type=int, default=None, help='explain a random sample of this many tracks')
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=cmd_explain)
+
+    p = sub.add_parser('parity', help='histogram forest vs sklearn forest: fit time, accuracy, AUC')
+    p.add_argument('--data', required=True)
+    p.add_argument('--n-estimators', type=int, default=200)
+    p.set_defaults(func=cmd_parity)
+
+    p = sub.add_parser('bench', help='benchmark history: compare commits for regressions, plot timings')
+    p.add_argument('action', choices=['compare', 'history'])
+    p.add_argument('--db', default='benchmarks.sqlite')
+    p.add_argument('--base', help='commit to compare against (default: the one recorded before --head)')
+    p.add_argument('--head', help='commit to check (default: the last recorded)')
+    p.add_argument('--command', dest='bench_command', help='only runs of this subcommand')
+    p.add_argument('--rows', type=int, default=None, help='only runs over this many tracks')
+    p.add_argument('--alpha', type=float, default=0.01, help='significance of the Mann-Whitney test')
+    p.add_argument('--min-effect', type=float, default=0.05, help='smallest relative slowdown to flag')
+    p.add_argument('--plot', metavar='PNG', help='history: draw stage timings over the commits')
+    p.add_argument('--include-dirty', action='store_true',
+                   help='also use runs recorded from a work tree with uncommitted changes')
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser('startup', help='measure subcommand cold start against its budget')
+    p.add_argument('commands', nargs='*', metavar='COMMAND', help=', '.join(STARTUP_BUDGETS))
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--budget-scale', type=float, default=float(os.environ.get(STARTUP_SCALE_ENV, 1.0)),
+                   help=f'multiply every budget, e.g. for slow CI machines (default: ${STARTUP_SCALE_ENV} or 1)')
+    p.set_defaults(func=cmd_startup)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile or args.bench:
+        import tracks_profile
+        tracks_profile.enable()
+    status = args.func(args)
+    if args.profile and not args.startup_only:
+        tracks_profile.report(args.profile)
+    if args.bench and not args.startup_only and args.command != 'bench':
+        record_benchmark(args)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
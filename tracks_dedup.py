@@ -0,0 +1,166 @@
+#%%[markdown]
+## Near-duplicate tracks
+#
+# Spotify rates the single and the album version of a song independently, so
+# the catalogue holds near-identical rows that inflate the training data and
+# leak between the two halves of `train_test_split`. `find_duplicates` labels
+# every track with a `dup_group`:
+#
+# * audio features are standardized and hashed with p-stable LSH (L tables of
+#   K quantized random projections), so near vectors share a bucket in at
+#   least one table;
+# * within a table, only rows that share the bucket *and* the normalized
+#   name/first-artist key are compared ("Song - 2011 Remaster" and
+#   "Song (feat. X)" normalize to "song");
+# * candidate pairs closer than `eps` standard deviations (RMS over the
+#   features) are joined, and clusters are the connected components.
+#
+# Buckets are capped at `max_bucket` rows (larger ones are compared to their
+# first rows only), so the cost stays about linear in the catalogue.
+#
+#   python tracks_cli.py dedup --data tracks_clean.parquet --out tracks_dedup.parquet
+#
+# `tracks_pipeline.split` keeps a `dup_group` together on one side of the
+# split when the frame has that column, `group_folds` does the same for the
+# out-of-fold loops of tracks_target and tracks_stack, and `drop_duplicates`
+# keeps one track per group.
+
+#%%
+import re
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+AUDIO_FEATURES = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness',
+                  'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_ms']
+
+_VERSION = re.compile(r'\s+-\s+.*\b(remaster\w*|live|version|edit|mix|mono|stereo|single|radio)\b.*$')
+_BRACKETS = re.compile(r'[\(\[][^\)\]]*[\)\]]')
+_NON_WORD = re.compile(r'[^\w ]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_names(names):
+    """Lowercased track names without version suffixes, brackets and punctuation."""
+    s = pd.Series(names, dtype='string').fillna('').str.lower()
+    s = s.str.replace(_VERSION, '', regex=True).str.replace(_BRACKETS, ' ', regex=True)
+    s = s.str.replace(_NON_WORD, ' ', regex=True).str.replace(_SPACES, ' ', regex=True).str.strip()
+    return s
+
+
+def first_artist(artists):
+    """First name in the "['A', 'B']" artists strings, normalized."""
+    s = pd.Series(artists, dtype='string').fillna('').str.extract(r"""^\[?\s*['"]?([^'",\]]*)""")[0]
+    return normalize_names(s)
+
+
+def name_keys(tracks):
+    """Integer id of the normalized (name, first artist) pair per row."""
+    key = normalize_names(tracks['name']) + '|' + first_artist(tracks['artists'])
+    return pd.factorize(key)[0]
+
+#%%
+# LSH candidate pairs
+
+
+def _lsh_codes(x, n_tables, n_projections, width, rng):
+    """(n_tables, n) int64 bucket codes."""
+    d = x.shape[1]
+    codes = np.empty((n_tables, len(x)), dtype=np.int64)
+    for t in range(n_tables):
+        a = rng.standard_normal((d, n_projections))
+        b = rng.uniform(0, width, n_projections)
+        codes[t] = _combine(np.floor((x @ a + b) / width).astype(np.int64))
+    return codes
+
+
+def _combine(q):
+    """Row-wise hash of integer columns."""
+    h = np.full(len(q), 1469598103934665603, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for col in q.T:
+            h = (h ^ col.astype(np.uint64)) * np.uint64(1099511628211)
+    return h.view(np.int64)
+
+
+def _bucket_pairs(keys, max_bucket):
+    """All index pairs sharing a key (star pairs to the first rows of oversized buckets)."""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+    left, right = [], []
+    for size in np.unique(sizes[sizes > 1]):
+        groups = order[starts[sizes == size][:, None] + np.arange(size)]
+        if size > max_bucket:
+            i, j = np.zeros(size - 1, dtype=int), np.arange(1, size)
+        else:
+            i, j = np.triu_indices(size, 1)
+        left.append(groups[:, i].ravel())
+        right.append(groups[:, j].ravel())
+    if not left:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def find_duplicates(tracks, eps=0.05, n_tables=6, n_projections=4, width=0.5, max_bucket=64,
+                    features=AUDIO_FEATURES, random_state=0):
+    """
+    Cluster id per row (`dup_group`, numbered by first occurrence); rows
+    without a near duplicate get a group of their own.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n = len(tracks)
+    with stage('find_duplicates', rows_in=n) as s:
+        x = tracks[features].to_numpy(np.float64)
+        sd = x.std(axis=0)
+        x = (x - x.mean(axis=0)) / np.where(sd > 0, sd, 1)
+        keys = name_keys(tracks).astype(np.int64)
+
+        rng = np.random.default_rng(random_state)
+        codes = _lsh_codes(x, n_tables, n_projections, width, rng)
+        pairs = []
+        for t in range(n_tables):
+            # Same LSH bucket in this table and same normalized name/artist
+            i, j = _bucket_pairs(_combine(np.stack([codes[t], keys], axis=1)), max_bucket)
+            close = np.sqrt(((x[i] - x[j]) ** 2).sum(axis=1)) <= eps * np.sqrt(len(features))
+            pairs.append(np.stack([i[close], j[close]]))
+        pairs = np.unique(np.concatenate(pairs, axis=1), axis=1)
+
+        graph = coo_matrix((np.ones(pairs.shape[1]), (pairs[0], pairs[1])), shape=(n, n))
+        _, labels = connected_components(graph, directed=False)
+        groups = pd.factorize(labels)[0]
+        s.rows_out = int(groups.max() + 1) if n else 0
+    return groups
+
+
+def group_folds(y, groups, n_folds=5, random_state=0):
+    """
+    Fold number per row, with every group in a single fold and the folds
+    stratified by the groups' majority label: StratifiedGroupKFold's
+    guarantees without its per-group Python loop (minutes on the catalogue).
+    Shuffled groups are dealt round-robin, one label stratum after the other.
+    """
+    codes, uniques = pd.factorize(np.asarray(groups))
+    size = np.bincount(codes, minlength=len(uniques))
+    label = np.bincount(codes, weights=np.asarray(y, dtype=np.float64), minlength=len(uniques)) >= size / 2
+    order = np.random.default_rng(random_state).permutation(len(uniques))
+    order = order[np.argsort(label[order], kind='stable')]
+    fold = np.empty(len(uniques), dtype=np.int64)
+    fold[order] = np.arange(len(uniques)) % n_folds
+    return fold[codes]
+
+
+def drop_duplicates(tracks, groups, keep='popularity'):
+    """One row per group: the most popular one (`keep='popularity'`) or the first."""
+    if keep == 'popularity':
+        order = np.lexsort([np.arange(len(tracks)), -tracks['popularity'].to_numpy()])
+        first = np.zeros(len(tracks), dtype=bool)
+        _, idx = np.unique(np.asarray(groups)[order], return_index=True)
+        first[order[idx]] = True
+        return tracks[first]
+    return tracks[~pd.Series(groups).duplicated().to_numpy()]
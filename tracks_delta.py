@@ -0,0 +1,251 @@
+#%%[markdown]
+## Incremental delta ingestion
+#
+# Each weekly export only adds a few tracks or changes their popularity, yet
+# `ingest` re-cleans the whole catalogue. `DeltaStore` keeps the cleaned tracks
+# in a SQLite table keyed by track `id` plus additive summaries of them:
+#
+# * moments (count, sums, cross-products) -> Pearson correlation matrix
+# * fixed-edge histogram counts per column
+# * per (year, popularity) count / sum / sum of squares -> year-trend means and CIs
+#
+# `apply(delta)` cleans only the delta rows, looks up the previous version of
+# each id, subtracts the old rows from every summary and adds the new ones, so
+# the cost is proportional to the delta. It also reports which trained models
+# have rows to rescore: every model for new tracks, and for updated tracks the
+# models whose feature columns changed.
+#
+# The summaries are pickled into the same SQLite file and written in the same
+# transaction as the rows, so a crash leaves either the old or the new state.
+# Every applied delta gets a sequence number and a digest of its rows;
+# applying the latest delta again (e.g. a retried weekly job) is a no-op. An
+# older delta applied again is a real update (rows going back to an earlier
+# state) and goes through.
+#
+#   python tracks_cli.py delta build --store store --csv tracks.csv
+#   python tracks_cli.py delta apply --store store --csv this_week.csv --models-dir models
+#
+# Spearman correlations are rank based and cannot be updated this way; the
+# store exposes Pearson, and the EDA report still recomputes Spearman.
+
+#%%
+import copy
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+import tracks_pipeline as tp
+from tracks_profile import stage
+
+AGG_COLUMNS = ['popularity'] + tp.RF_ALL_FEATURES
+HIST_BINS = 20
+
+
+class DeltaStore:
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, 'tracks.sqlite'))
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS aggregates (id INTEGER PRIMARY KEY CHECK (id = 0), seq INTEGER, blob BLOB);
+            CREATE TABLE IF NOT EXISTS deltas (
+                seq INTEGER PRIMARY KEY, digest TEXT, rows INTEGER, applied_at REAL);
+        ''')
+        self.aggs, self.seq = None, 0
+        row = self.conn.execute('SELECT seq, blob FROM aggregates').fetchone()
+        if row is not None:
+            self.seq, self.aggs = row[0], pickle.loads(row[1])
+
+    # Additive summaries
+
+    def _empty_aggs(self, clean):
+        values = clean[AGG_COLUMNS].to_numpy(np.float64)
+        k = len(AGG_COLUMNS)
+        return {'n': 0, 'sum': np.zeros(k), 'cross': np.zeros((k, k)),
+                'edges': {c: np.histogram_bin_edges(values[:, i], HIST_BINS) for i, c in enumerate(AGG_COLUMNS)},
+                'hist': {c: np.zeros(HIST_BINS, dtype=np.int64) for c in AGG_COLUMNS},
+                'trend': None}
+
+    @staticmethod
+    def _accumulate(a, clean, sign):
+        if not len(clean):
+            return
+        values = clean[AGG_COLUMNS].to_numpy(np.float64)
+        a['n'] += sign * len(values)
+        a['sum'] += sign * values.sum(axis=0)
+        a['cross'] += sign * (values.T @ values)
+        for i, col in enumerate(AGG_COLUMNS):
+            edges = a['edges'][col]
+            # Out-of-range values count in the end bins so add/remove stay symmetric
+            idx = np.clip(np.searchsorted(edges, values[:, i], side='right') - 1, 0, HIST_BINS - 1)
+            a['hist'][col] += sign * np.bincount(idx, minlength=HIST_BINS)
+
+        features = clean[AGG_COLUMNS].drop(columns='popularity')
+        keys = [clean['year'].astype(int), clean['popularity'].astype(int)]
+        grouped = pd.concat({'count': features.groupby(keys).size().to_frame('n'),
+                             'sum': features.groupby(keys).sum(),
+                             'sumsq': (features ** 2).groupby(keys).sum()}, axis=1)
+        grouped = grouped * sign
+        a['trend'] = grouped if a['trend'] is None else a['trend'].add(grouped, fill_value=0)
+
+    def correlations(self):
+        """Pearson correlation matrix of AGG_COLUMNS from the running moments."""
+        a = self.aggs
+        mean = a['sum'] / a['n']
+        cov = a['cross'] / a['n'] - np.outer(mean, mean)
+        sd = np.sqrt(np.diag(cov))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.DataFrame(cov / np.outer(sd, sd), index=AGG_COLUMNS, columns=AGG_COLUMNS)
+
+    def histograms(self):
+        return {c: (self.aggs['hist'][c].copy(), self.aggs['edges'][c]) for c in AGG_COLUMNS}
+
+    def year_trends(self):
+        """Mean and standard error per (year, popularity) for every feature."""
+        t = self.aggs['trend']
+        t = t[t[('count', 'n')] > 0]
+        n = t[('count', 'n')]
+        mean = t['sum'].div(n, axis=0)
+        var = (t['sumsq'].div(n, axis=0) - mean ** 2).mul(n / (n - 1), axis=0)
+        sem = np.sqrt(var.clip(lower=0)).div(np.sqrt(n), axis=0)
+        return pd.concat({'mean': mean, 'sem': sem}, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+    def _save_aggs(self, aggs, seq):
+        """Write the summaries; call inside the transaction that writes the rows."""
+        self.conn.execute('INSERT OR REPLACE INTO aggregates VALUES (0, ?, ?)',
+                          (seq, pickle.dumps(aggs, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    # Rows
+
+    def _to_sql_frame(self, clean):
+        return clean.assign(release_date=clean['release_date'].astype(str))
+
+    def _from_sql_frame(self, rows):
+        return rows.assign(release_date=pd.to_datetime(rows['release_date']))
+
+    def _insert(self, clean):
+        """Insert cleaned rows without committing (pandas' to_sql commits on its own)."""
+        frame = self._to_sql_frame(clean)
+        columns = ', '.join(f'"{c}"' for c in frame.columns)
+        self.conn.executemany(f'INSERT INTO tracks ({columns}) VALUES ({", ".join("?" * frame.shape[1])})',
+                              frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+    def _lookup(self, ids):
+        """Current cleaned rows for `ids` (through a temp table, so any number of ids)."""
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS lookup_ids (id TEXT PRIMARY KEY)')
+        self.conn.execute('DELETE FROM lookup_ids')
+        self.conn.executemany('INSERT OR IGNORE INTO lookup_ids VALUES (?)', [(i,) for i in ids])
+        rows = pd.read_sql_query('SELECT t.* FROM tracks t JOIN lookup_ids USING (id)', self.conn)
+        return self._from_sql_frame(rows)
+
+    def build(self, tracks):
+        """Full (re)build from raw tracks, e.g. the first tracks.csv."""
+        clean = tp.clean_tracks(tracks)
+        with stage('delta_build', rows_in=len(clean)):
+            aggs = self._empty_aggs(clean)
+            self._accumulate(aggs, clean, +1)
+            # Without summaries the store reads as not built until the rows are in
+            with self.conn:
+                self.conn.execute('DELETE FROM aggregates')
+                self.conn.execute('DELETE FROM deltas')
+            self._to_sql_frame(clean).to_sql('tracks', self.conn, if_exists='replace', index=False)
+            with self.conn:
+                self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS tracks_id ON tracks (id)')
+                self._save_aggs(aggs, 0)
+            self.aggs, self.seq = aggs, 0
+        return len(clean)
+
+    @staticmethod
+    def _digest(delta):
+        rows = pd.util.hash_pandas_object(delta, index=False).to_numpy()
+        return hashlib.sha256(json.dumps(list(delta.columns)).encode() + rows.tobytes()).hexdigest()
+
+    def apply(self, delta, models_dir=None):
+        """
+        Upsert the raw `delta` rows; returns a summary with the ids to rescore
+        per model, the delta's sequence number and whether it was a replay of
+        the latest applied delta.
+        """
+        if self.aggs is None:
+            raise RuntimeError(f"No store in {self.path}; run build first")
+        delta = delta.drop_duplicates('id', keep='last')
+        digest = self._digest(delta)
+        latest = self.conn.execute('SELECT seq, digest FROM deltas ORDER BY seq DESC LIMIT 1').fetchone()
+        if latest is not None and latest[1] == digest:
+            return {'inserted': [], 'removed': [], 'updated': [], 'changed_columns': {}, 'rescore': {},
+                    'seq': latest[0], 'replayed': True}
+
+        with stage('delta_apply', rows_in=len(delta)) as s:
+            old = self._lookup(delta['id'].tolist())
+            new = tp.clean_tracks(delta)
+
+            # Summaries: out with the previous version, in with the new one, on
+            # a copy that replaces the current one only once the rows are committed
+            aggs = copy.deepcopy(self.aggs)
+            self._accumulate(aggs, old, -1)
+            self._accumulate(aggs, new, +1)
+
+            with self.conn:
+                self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS delta_ids (id TEXT PRIMARY KEY)')
+                self.conn.execute('DELETE FROM delta_ids')
+                self.conn.executemany('INSERT OR IGNORE INTO delta_ids VALUES (?)',
+                                      [(i,) for i in delta['id']])
+                self.conn.execute('DELETE FROM tracks WHERE id IN (SELECT id FROM delta_ids)')
+                self._insert(new)
+                seq = self.conn.execute('INSERT INTO deltas (digest, rows, applied_at) VALUES (?, ?, ?)',
+                                        (digest, len(delta), time.time())).lastrowid
+                self._save_aggs(aggs, seq)
+            self.aggs, self.seq = aggs, seq
+            s.rows_out = len(new)
+
+        old_ids, new_ids = set(old['id']), set(new['id'])
+        summary = {'inserted': sorted(new_ids - old_ids), 'removed': sorted(old_ids - new_ids),
+                   'updated': sorted(new_ids & old_ids), 'seq': seq, 'replayed': False}
+        summary['changed_columns'] = self._changed_columns(old, new)
+        summary['rescore'] = self._rescore(summary, models_dir) if models_dir else {}
+        return summary
+
+    def _changed_columns(self, old, new):
+        """id -> columns whose cleaned value changed, for ids present before and after."""
+        cols = [c for c in new.columns if c != 'id']
+        both = old.merge(new, on='id', suffixes=('_old', '_new'))
+        changed = {}
+        for col in cols:
+            a, b = both[f'{col}_old'], both[f'{col}_new']
+            diff = ~((a == b) | (a.isna() & b.isna()))
+            for track_id in both.loc[diff.to_numpy(), 'id']:
+                changed.setdefault(track_id, []).append(col)
+        return changed
+
+    def _rescore(self, summary, models_dir):
+        rescore = {}
+        for file in sorted(os.listdir(models_dir)):
+            if not file.endswith('.pkl'):
+                continue
+            features = set(tp.load_model(os.path.join(models_dir, file))['features'])
+            ids = list(summary['inserted'])
+            ids += [i for i, cols in summary['changed_columns'].items() if features & set(cols)]
+            if ids:
+                rescore[file[:-4]] = sorted(ids)
+        return rescore
+
+    def tracks(self):
+        """All cleaned tracks currently in the store."""
+        return self._from_sql_frame(pd.read_sql_query('SELECT * FROM tracks', self.conn))
+
+
+def write_rescore_lists(summary, out_dir):
+    """One `<model>.txt` with the track ids to rescore per model."""
+    os.makedirs(out_dir, exist_ok=True)
+    for model, ids in summary['rescore'].items():
+        with open(os.path.join(out_dir, f'{model}.txt'), 'w') as f:
+            f.write('\n'.join(ids) + '\n')
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump({k: len(v) if isinstance(v, (list, dict)) else v for k, v in summary.items()}, f, indent=1)
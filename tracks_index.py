@@ -0,0 +1,166 @@
+#%%[markdown]
+## Secondary indexes for repeated slicing
+#
+# `spotify[spotify['popularity'] > 90]`, `spotifydf[spotifydf['popularity'] == 1]`
+# and friends each scan the whole frame. `TrackIndex` builds, once:
+#
+# * a sorted permutation per numeric column: a range predicate is two binary
+#   searches and a slice of row positions, O(log n + result);
+# * a bitmap per value of the low-cardinality columns (explicit, mode, key,
+#   popularity class, year), stored as uint64 words: AND / OR / NOT of
+#   bitmaps touch n/64 words.
+#
+# Predicates are `Selection`s combined with `&`, `|` and `~`. A selection is
+# kept as sorted row positions when it came from a range (so `&` with a
+# bitmap is a bit test per position, O(result)) and as a bitmap otherwise.
+#
+#   idx = TrackIndex(spotifydf)
+#   popular = idx.eq('popularity', 1)
+#   recent_hits = (popular & idx.range('year', 2015, 2022) & ~idx.eq('explicit', 1)).take(spotifydf)
+
+#%%
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+BITMAP_COLUMNS = ['explicit', 'mode', 'key', 'popularity', 'year', 'month', 'time_signature']
+MAX_BITMAP_VALUES = 256
+
+
+def _pack(mask):
+    """Boolean mask -> little-endian uint64 words."""
+    bits = np.packbits(mask, bitorder='little')
+    pad = -len(bits) % 8
+    if pad:
+        bits = np.concatenate([bits, np.zeros(pad, dtype=np.uint8)])
+    return bits.view(np.uint64)
+
+
+def _unpack(words, n):
+    return np.unpackbits(words.view(np.uint8), count=n, bitorder='little').view(bool)
+
+
+class Selection:
+    """Rows matching a predicate, as sorted positions (`rows`) or a bitmap (`words`)."""
+
+    def __init__(self, n, rows=None, words=None):
+        self.n = n
+        self.rows = rows
+        self.words = words
+
+    @classmethod
+    def from_mask(cls, mask):
+        return cls(len(mask), words=_pack(np.asarray(mask, dtype=bool)))
+
+    def _as_words(self):
+        if self.words is not None:
+            return self.words
+        return _pack(self.mask())
+
+    def contains(self, rows):
+        """Membership of each position in `rows`."""
+        if self.rows is not None:
+            idx = np.searchsorted(self.rows, rows)
+            idx[idx == len(self.rows)] = 0
+            return self.rows[idx] == rows if len(self.rows) else np.zeros(len(rows), dtype=bool)
+        return ((self.words[rows >> 6] >> (rows & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+
+    def __and__(self, other):
+        if self.rows is not None and (other.rows is None or len(self.rows) <= len(other.rows)):
+            return Selection(self.n, rows=self.rows[other.contains(self.rows)])
+        if other.rows is not None:
+            return other & self
+        return Selection(self.n, words=self.words & other.words)
+
+    def __or__(self, other):
+        if self.rows is not None and other.rows is not None:
+            return Selection(self.n, rows=np.union1d(self.rows, other.rows))
+        return Selection(self.n, words=self._as_words() | other._as_words())
+
+    def __invert__(self):
+        words = ~self._as_words()
+        tail = self.n % 64
+        if tail:
+            words[-1] &= np.uint64((1 << tail) - 1)
+        return Selection(self.n, words=words)
+
+    def positions(self):
+        if self.rows is not None:
+            return self.rows
+        return np.flatnonzero(_unpack(self.words, self.n))
+
+    def mask(self):
+        if self.words is not None:
+            return _unpack(self.words, self.n)
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self.rows] = True
+        return mask
+
+    def __len__(self):
+        if self.rows is not None:
+            return len(self.rows)
+        return int(np.bitwise_count(self.words).sum())
+
+    def take(self, frame, columns=None):
+        out = frame.iloc[self.positions()]
+        return out if columns is None else out[columns]
+
+
+class TrackIndex:
+
+    def __init__(self, frame, bitmap_columns=BITMAP_COLUMNS, sorted_columns=None):
+        self.n = len(frame)
+        sorted_columns = sorted_columns or [c for c in frame.columns if pd.api.types.is_numeric_dtype(frame[c])
+                                            and not pd.api.types.is_bool_dtype(frame[c])]
+        self.order, self.sorted, self.bitmaps = {}, {}, {}
+        with stage('build_index', rows_in=self.n):
+            for col in sorted_columns:
+                values = frame[col].to_numpy(dtype=np.float64, na_value=np.nan)
+                order = np.argsort(values, kind='stable')
+                n_valid = len(values) - int(np.isnan(values).sum())  # NaNs sort last and never match
+                self.order[col] = order[:n_valid]
+                self.sorted[col] = values[order[:n_valid]]
+            for col in bitmap_columns:
+                if col not in frame.columns:
+                    continue
+                codes, uniques = pd.factorize(frame[col], sort=True)
+                if len(uniques) > MAX_BITMAP_VALUES:
+                    continue
+                # One pass over the codes per column, not one per value
+                order = np.argsort(codes, kind='stable')
+                bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+                self.bitmaps[col] = {}
+                for i, value in enumerate(uniques):
+                    rows = order[bounds[i]:bounds[i + 1]]
+                    self.bitmaps[col][value] = Selection(self.n, rows=rows)._as_words()
+
+    def range(self, column, low=-np.inf, high=np.inf, inclusive='both'):
+        """Rows with low <= column <= high (`inclusive`: 'both', 'left', 'right', 'neither')."""
+        s = self.sorted[column]
+        lo = np.searchsorted(s, low, 'left' if inclusive in ('both', 'left') else 'right')
+        hi = np.searchsorted(s, high, 'right' if inclusive in ('both', 'right') else 'left')
+        return Selection(self.n, rows=np.sort(self.order[column][lo:hi]))
+
+    def gt(self, column, value):
+        return self.range(column, value, np.inf, 'right')
+
+    def lt(self, column, value):
+        return self.range(column, -np.inf, value, 'left')
+
+    def eq(self, column, value):
+        if column in self.bitmaps:
+            words = self.bitmaps[column].get(value)
+            if words is None:
+                return Selection(self.n, rows=np.empty(0, dtype=np.intp))
+            return Selection(self.n, words=words)
+        return self.range(column, value, value)
+
+    def isin(self, column, values):
+        out = Selection(self.n, rows=np.empty(0, dtype=np.intp))
+        for value in values:
+            out = out | self.eq(column, value)
+        return out
+
+    def all(self):
+        return ~Selection(self.n, rows=np.empty(0, dtype=np.intp))
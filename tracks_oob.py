@@ -0,0 +1,99 @@
+#%%[markdown]
+## Out-of-bag evaluation for the random forests
+#
+# Forests trained with `bootstrap=True` already hold an unbiased estimate of
+# their generalization: each row is predicted by the trees that did not see it.
+# This module turns the per-row OOB probabilities into the full metric set
+# (accuracy, precision, recall, F1, ROC AUC), the confusion matrix, the ROC
+# curve and bootstrap confidence intervals, with no extra fits.
+#
+#   from tracks_oob import oob_evaluation
+#   report = oob_evaluation(rf_best, X_train, Y_train)
+#   report['metrics'], report['ci'], report['roc']
+
+#%%
+import numpy as np
+import pandas as pd
+
+from tracks_warmstart import oob_indices
+
+
+def oob_probabilities(forest, x):
+    """
+    Positive-class OOB probability for every training row (NaN if no tree left it out).
+
+    Uses `oob_decision_function_` when the forest was fitted with
+    oob_score=True, otherwise replays the bootstrap of each tree.
+    """
+    pos = list(forest.classes_).index(1) if 1 in forest.classes_ else -1
+    if getattr(forest, 'oob_decision_function_', None) is not None:
+        return np.asarray(forest.oob_decision_function_)[:, pos].astype(np.float64)
+    if not forest.bootstrap:
+        raise ValueError("OOB evaluation needs a forest fitted with bootstrap=True")
+
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    total, count = np.zeros(len(x)), np.zeros(len(x))
+    for tree in forest.estimators_:
+        idx = oob_indices(forest, tree, len(x))
+        total[idx] += tree.predict_proba(x[idx], check_input=False)[:, pos]
+        count[idx] += 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count
+
+#%%
+# Metrics on (bootstrap-)weighted rows
+
+
+def _weighted_metrics(y, pred, groups, w):
+    """Metrics for rows weighted by `w` (ones, or bootstrap counts)."""
+    tp = np.sum(w * (pred == 1) * (y == 1))
+    fp = np.sum(w * (pred == 1) * (y == 0))
+    fn = np.sum(w * (pred == 0) * (y == 1))
+    tn = np.sum(w * (pred == 0) * (y == 0))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+
+    # Rank AUC with ties, from per-score-group positive/negative weights
+    n_groups = groups.max() + 1
+    neg = np.bincount(groups, w * (y == 0), minlength=n_groups)
+    pos = np.bincount(groups, w * (y == 1), minlength=n_groups)
+    below = np.cumsum(neg) - neg
+    auc = np.sum(pos * (below + 0.5 * neg)) / (pos.sum() * neg.sum()) if pos.sum() and neg.sum() else np.nan
+
+    return {'accuracy': (tp + tn) / (tp + tn + fp + fn), 'precision': precision, 'recall': recall,
+            'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            'roc_auc': auc}
+
+
+def oob_evaluation(forest, x, y, threshold=0.5, n_boot=1000, alpha=0.05, random_state=0):
+    """
+    OOB metric set, confusion matrix, ROC curve and (1 - alpha) bootstrap CIs.
+
+    CIs resample the OOB predictions (not the forest), so they cost a few
+    vectorized passes over the rows per bootstrap replicate.
+    """
+    from sklearn.metrics import confusion_matrix, roc_curve
+
+    y = np.asarray(y).ravel().astype(int)
+    prob = oob_probabilities(forest, x)
+    covered = ~np.isnan(prob)
+    y, prob = y[covered], prob[covered]
+    pred = (prob > threshold).astype(int)
+    _, groups = np.unique(prob, return_inverse=True)
+
+    metrics = _weighted_metrics(y, pred, groups, np.ones(len(y)))
+
+    rng = np.random.default_rng(random_state)
+    boots = []
+    for _ in range(n_boot):
+        w = np.bincount(rng.integers(0, len(y), len(y)), minlength=len(y)).astype(np.float64)
+        boots.append(_weighted_metrics(y, pred, groups, w))
+    boots = pd.DataFrame(boots)
+    ci = pd.DataFrame({'estimate': pd.Series(metrics),
+                       'lower': boots.quantile(alpha / 2), 'upper': boots.quantile(1 - alpha / 2)})
+
+    fpr, tpr, thresholds = roc_curve(y, prob)
+    return {'metrics': metrics, 'ci': ci,
+            'confusion_matrix': confusion_matrix(y, pred),
+            'roc': pd.DataFrame({'fpr': fpr, 'tpr': tpr, 'threshold': thresholds}),
+            'probabilities': prob, 'coverage': float(covered.mean())}
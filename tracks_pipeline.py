@@ -0,0 +1,318 @@
+#%%[markdown]
+## Pipeline stages from `Team6_Tracks.py` as importable functions
+#
+# Only numpy and pandas are imported at module level. sklearn, imblearn and
+# matplotlib are imported inside the functions that need them, so a command
+# that only scores or only ingests never pays for the plotting/modeling stack.
+
+#%%
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+LOGISTIC_FEATURES = ['explicit', 'danceability', 'loudness', 'acousticness', 'year']
+
+KNN_FEATURES = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness',
+                'liveness', 'valence', 'tempo', 'duration_min', 'year']
+
+# All candidate features for the random forest, before feature selection
+RF_ALL_FEATURES = ['explicit', 'danceability', 'energy', 'loudness', 'mode', 'speechiness',
+                   'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo',
+                   'duration_min', 'year', 'month']
+
+# Result of the "Feature Selection" cell; `select_rf_features` recomputes it
+# from a fitted forest
+RF_FEATURES = KNN_FEATURES
+
+# Best hyperparameters found by the (3 hour) GridSearchCV in Team6_Tracks.py.
+# max_features='auto' meant 'sqrt' for classifiers and was removed from sklearn.
+RF_BEST_PARAMS = dict(random_state=42, max_features='sqrt', n_estimators=200, max_depth=8,
+                      criterion='gini', bootstrap=True, oob_score=True)
+
+RF_PARAM_GRID = {
+    'n_estimators': [100, 200, 300, 400, 500],
+    'max_features': ['sqrt', 'log2', None],
+    'max_depth': [4, 5, 6, 7, 8, 10, 14, 20],
+    'criterion': ['gini', 'entropy', 'log_loss'],
+    'bootstrap': [True, False],
+    'oob_score': [True, False],
+}
+
+# Dense features plus the key/mode/month/year columns tracks_sparse one-hot encodes
+SPARSE_FEATURES = RF_ALL_FEATURES + ['key']
+
+MODEL_FEATURES = {'logistic': LOGISTIC_FEATURES, 'knn': KNN_FEATURES, 'rf': RF_FEATURES,
+                  'rf_all': RF_ALL_FEATURES, 'rf_hist': RF_FEATURES,
+                  'logistic_sparse': SPARSE_FEATURES, 'sgd': SPARSE_FEATURES}
+
+MODEL_NAMES = list(MODEL_FEATURES)
+
+# Input of the artist target encoding (`train --artists`, tracks_target)
+ARTIST_COLUMN = 'id_artists'
+
+#%%
+# Ingest and cleaning
+
+
+def read_tracks(path):
+    """Read tracks from tracks.csv, a parquet file/directory or a pickled frame."""
+    with stage('read_tracks') as s:
+        if path.endswith('.csv'):
+            tracks = pd.read_csv(path)
+        elif path.endswith('.pkl'):
+            tracks = pd.read_pickle(path)
+        else:
+            from tracks_quantize import read_quantized, read_spec
+
+            tracks = read_quantized(path) if read_spec(path) else pd.read_parquet(path)
+        s.rows_out = len(tracks)
+    return tracks
+
+
+def add_derived_columns(tracks):
+    """duration_min, year and month, as in the reformatting cells."""
+    tracks = tracks.copy()
+    tracks['duration_min'] = round(tracks['duration_ms'] * 1.6667e-5, 2)
+    release = pd.to_datetime(tracks['release_date'], format='ISO8601')
+    tracks['release_date'] = release
+    tracks['year'] = release.dt.year
+    tracks['month'] = release.dt.month
+    return tracks
+
+
+def clean_tracks(tracks):
+    """
+    The cleaning cells of Team6_Tracks.py: drop nulls and 0-popularity songs,
+    recode popularity to 0 (<= 50) / 1 (> 50), add derived columns and drop
+    release years past 2022.
+    """
+    with stage('clean_tracks', rows_in=len(tracks)) as s:
+        tracks = tracks.dropna()
+        tracks = tracks[(tracks['popularity'] != 0) & (tracks['popularity'] <= 100)]
+        tracks = tracks.assign(popularity=(tracks['popularity'] > 50).astype(int))
+        tracks = add_derived_columns(tracks)
+        tracks = tracks[tracks['year'] <= 2022]
+        s.rows_out = len(tracks)
+    return tracks
+
+
+def modeling_frame(tracks):
+    """`spotifydf`: the cleaned tracks without id and duration_ms."""
+    return tracks.drop(columns=['id', 'duration_ms'])
+
+
+def write_cache(tracks, path, bits=None):
+    """
+    Write the cleaned tracks as parquet, falling back to pickle without pyarrow.
+    `bits` (8 or 16) writes the quantized format of tracks_quantize.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        path = os.path.splitext(path)[0] + '.pkl'
+        tracks.to_pickle(path)
+        return path
+    if bits:
+        from tracks_quantize import write_quantized
+        return write_quantized(tracks, path, bits)
+    tracks.to_parquet(path, index=False)
+    return path
+
+#%%
+# Models
+
+
+def smote(x, y, random_state=2):
+    from imblearn.over_sampling import SMOTE
+
+    with stage('smote', rows_in=len(x)) as s:
+        x_res, y_res = SMOTE(random_state=random_state).fit_resample(x, y)
+        s.rows_out = len(x_res)
+    return x_res, y_res
+
+
+def make_model(name, **params):
+    if name == 'logistic':
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(**params)
+    if name == 'knn':
+        from sklearn.neighbors import KNeighborsClassifier
+        return KNeighborsClassifier(**dict({'n_neighbors': 9}, **params))
+    if name in ('rf', 'rf_all'):
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(**dict(RF_BEST_PARAMS, **params))
+    if name == 'rf_hist':
+        from tracks_histforest import HistRandomForestClassifier
+        best = {k: v for k, v in RF_BEST_PARAMS.items() if k not in ('criterion', 'oob_score')}
+        return HistRandomForestClassifier(**dict(best, **params))
+    if name in ('logistic_sparse', 'sgd'):
+        from sklearn.pipeline import make_pipeline
+        from tracks_sparse import SparseCategoricalEncoder
+        if name == 'sgd':
+            from sklearn.linear_model import SGDClassifier
+            model = SGDClassifier(**dict({'loss': 'log_loss', 'random_state': 42}, **params))
+        else:
+            from sklearn.linear_model import LogisticRegression
+            model = LogisticRegression(**dict({'max_iter': 1000}, **params))
+        return make_pipeline(SparseCategoricalEncoder(), model)
+    raise ValueError(f"Unknown model: {name}")
+
+
+def split(spotifydf, features, random_state=321, stratify=False):
+    """
+    80/20 train/test split. When the frame has a `dup_group` column
+    (tracks_dedup) near-duplicate tracks stay on the same side.
+    """
+    from sklearn.model_selection import train_test_split
+
+    y = spotifydf['popularity']
+    if 'dup_group' not in spotifydf.columns:
+        return train_test_split(spotifydf[features], y, test_size=0.2, random_state=random_state,
+                                stratify=y if stratify else None)
+
+    from sklearn.model_selection import GroupShuffleSplit
+
+    splitter = GroupShuffleSplit(n_splits=1, test_size=0.2, random_state=random_state)
+    train, test = next(splitter.split(spotifydf, y, groups=spotifydf['dup_group']))
+    x = spotifydf[features]
+    return x.iloc[train], x.iloc[test], y.iloc[train], y.iloc[test]
+
+
+def train_model(name, spotifydf, use_smote=False, features=None, oob=False, artists=False, **params):
+    """
+    Fit one model family on the train split; returns (model, metrics on the test split).
+
+    With `oob=True` (sklearn forests only) the forest is fitted on every row and
+    the metrics are its out-of-bag estimates, so no rows are held out.
+
+    With `artists=True` the features gain the out-of-fold artist encoding of
+    tracks_target, fitted on the train split; the returned model is a pipeline
+    that takes `features + [ARTIST_COLUMN]`.
+    """
+    features = features or MODEL_FEATURES[name]
+    if artists:
+        features = with_artists(features)
+    if oob:
+        if name not in ('rf', 'rf_all'):
+            raise ValueError(f"OOB evaluation needs a bootstrapped sklearn forest, not {name}")
+        if artists:
+            raise ValueError("OOB evaluation does not support the artist encoding")
+        from tracks_oob import oob_evaluation
+
+        model = make_model(name, **params)
+        x, y = spotifydf[features], spotifydf['popularity']
+        with stage(f'fit_{name}', rows_in=len(x)):
+            model.fit(x, y)
+        return model, oob_evaluation(model, x, y)['metrics']
+
+    x_train, x_test, y_train, y_test = split(spotifydf, features)
+    if artists:
+        from tracks_target import ArtistTargetEncoder
+
+        encoder = ArtistTargetEncoder(ARTIST_COLUMN)
+        groups = spotifydf.loc[x_train.index, 'dup_group'] if 'dup_group' in spotifydf.columns else None
+        x_train = encoder.fit_transform(x_train, y_train, groups=groups)
+    if use_smote:
+        x_train, y_train = smote(x_train, y_train)
+
+    model = make_model(name, **params)
+    with stage(f'fit_{name}', rows_in=len(x_train)):
+        model.fit(x_train, y_train)
+    if artists:
+        from sklearn.pipeline import make_pipeline
+
+        model = make_pipeline(encoder, model)
+    return model, evaluate(model, x_test, y_test)
+
+
+def with_artists(features):
+    """`features` plus the artist list column the ArtistTargetEncoder turns into features."""
+    return list(features) + [ARTIST_COLUMN] if ARTIST_COLUMN not in features else list(features)
+
+
+def evaluate(model, x_test, y_test):
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score
+
+    y_pred = model.predict(x_test)
+    y_prob = model.predict_proba(x_test)[:, 1]
+    return {'accuracy': accuracy_score(y_test, y_pred),
+            'precision': precision_score(y_test, y_pred, zero_division=0),
+            'recall': recall_score(y_test, y_pred),
+            'roc_auc': roc_auc_score(y_test, y_prob)}
+
+
+def final_estimator(model, x):
+    """(last step, `x` run through the steps before it) of a pipeline; (model, x) otherwise."""
+    if not hasattr(model, 'steps'):
+        return model, x
+    # Step by step: Pipeline.transform checks fitted-ness through sklearn tags,
+    # which the duck-typed transformers here do not have
+    for _, step in model.steps[:-1]:
+        x = step.transform(x)
+    return model.steps[-1][1], x
+
+
+def select_rf_features(spotifydf, forest, method='mdi', model_key=None, **params):
+    """
+    Feature selection for the RF from an already-fitted forest over
+    RF_ALL_FEATURES. A `train --artists` pipeline is unwrapped: its forest is
+    scored on the encoded columns and the encoder's own outputs are left out
+    of the selection (`--artists` adds them back).
+    """
+    from tracks_select import select_features
+
+    features = with_artists(RF_ALL_FEATURES) if hasattr(forest, 'steps') else RF_ALL_FEATURES
+    x_train, x_test, y_train, y_test = split(spotifydf, features)
+    if method == 'permutation':
+        model, x = final_estimator(forest, x_test)
+        selected = select_features(model, x, y_test, method=method, model_key=model_key, **params)
+    else:
+        model, x = final_estimator(forest, x_train)
+        selected = select_features(model, x, method=method, model_key=model_key, **params)
+    return [c for c in selected if c in RF_ALL_FEATURES]
+
+
+def tune_rf(spotifydf, param_grid=None, cv=5, n_jobs=-1, features=None):
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import GridSearchCV
+
+    x_train, _, y_train, _ = split(spotifydf, features or RF_FEATURES)
+    search = GridSearchCV(RandomForestClassifier(random_state=42), param_grid or RF_PARAM_GRID,
+                          cv=cv, n_jobs=n_jobs, error_score=np.nan)
+    with stage('tune_rf', rows_in=len(x_train)):
+        search.fit(x_train, y_train)
+    return search
+
+
+def tune_rf_warm(spotifydf, param_grid=None, cv=5, features=None):
+    """`tune_rf` with the n_estimators axis collapsed into warm-started fits."""
+    from tracks_warmstart import warm_grid_search
+
+    x_train, _, y_train, _ = split(spotifydf, features or RF_FEATURES)
+    with stage('tune_rf_warm', rows_in=len(x_train)):
+        return warm_grid_search(x_train, y_train, param_grid or RF_PARAM_GRID, cv=cv)
+
+
+def save_model(model, features, path):
+    with open(path, 'wb') as f:
+        pickle.dump({'model': model, 'features': list(features)}, f)
+
+
+def load_model(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def score_tracks(tracks, bundles):
+    """Popularity probability per model for raw (uncleaned) tracks, keyed by id."""
+    tracks = add_derived_columns(tracks.dropna(subset=['release_date']))
+    out = pd.DataFrame({'id': tracks['id'].to_numpy()})
+    for name, bundle in bundles.items():
+        with stage(f'score_{name}', rows_in=len(tracks)):
+            x = tracks[bundle['features']]
+            out[f'p_{name}'] = bundle['model'].predict_proba(x)[:, 1]
+    return out
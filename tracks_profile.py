@@ -0,0 +1,295 @@
+#%%[markdown]
+## Stage-level profiling
+#
+# Records wall time, CPU time, peak RSS growth and rows in/out for each logical
+# stage of the pipeline (read_csv, cleaning, SMOTE, the KNN loop, plotting...).
+#
+#   from tracks_profile import stage
+#
+#   with stage('read_csv') as s:
+#       spotify = pd.read_csv('tracks.csv')
+#       s.rows_out = len(spotify)
+#
+#   @profiled('smote')
+#   def resample(x, y): ...
+#
+# Profiling is off unless `TRACKS_PROFILE=1` is set (or `enable()` is called).
+# When off, `stage` hands back one shared no-op object, so instrumented code
+# pays an attribute lookup and a function call per stage and nothing else.
+#
+# Peak RSS growth is per stage: while a stage is open a background thread
+# samples the RSS of this process and all its descendants (joblib and
+# ProcessPool workers) every SAMPLE_S from /proc, and the stage records its
+# highest sample minus the RSS it started with. Spikes shorter than the
+# interval can be missed, and pages shared with forked children count once per
+# process. Without /proc (macOS, Windows) it falls back to the growth of the
+# process's own ru_maxrss, which stays at 0 once an earlier stage set the peak.
+#
+# Results export as Chrome trace-event JSON (open in chrome://tracing or
+# https://ui.perfetto.dev) and as a summary table.
+
+#%%
+import functools
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return 0
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if os.uname().sysname == 'Darwin' else peak
+
+
+SAMPLE_S = 0.01
+HAVE_PROC = os.path.exists('/proc/self/statm')
+_PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024 if HAVE_PROC else 0
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return 0  # exited meanwhile
+
+
+def _children(pid):
+    out = []
+    try:
+        tasks = os.listdir(f'/proc/{pid}/task')
+    except OSError:
+        return out
+    for tid in tasks:
+        try:
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                out += f.read().split()
+        except OSError:
+            continue
+    return out
+
+
+def _tree_rss_kb():
+    """Summed RSS of this process and all its descendants."""
+    total, todo = 0, [str(os.getpid())]
+    while todo:
+        pid = todo.pop()
+        total += _rss_kb(pid)
+        todo += _children(pid)
+    return total
+
+
+class _RssSampler:
+    """Tracks the peak process-tree RSS of every open stage from a background thread."""
+
+    def __init__(self, interval=SAMPLE_S):
+        self.interval = interval
+        self.peaks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, key):
+        """Begin tracking `key`; returns the RSS (KiB) it starts from."""
+        if not HAVE_PROC:
+            return _peak_rss_kb()
+        rss = _tree_rss_kb()
+        with self._lock:
+            self.peaks[key] = rss
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+                self._thread.start()
+        return rss
+
+    def stop(self, key):
+        """Stop tracking `key`; returns its peak RSS (KiB)."""
+        if not HAVE_PROC:
+            return _peak_rss_kb()
+        rss = _tree_rss_kb()
+        with self._lock:
+            return max(self.peaks.pop(key), rss)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self.peaks:
+                    self._thread = None
+                    return
+            rss = _tree_rss_kb()
+            with self._lock:
+                for key, peak in self.peaks.items():
+                    self.peaks[key] = max(peak, rss)
+
+
+_SAMPLER = _RssSampler()
+
+
+def _rows(obj):
+    shape = getattr(obj, 'shape', None)
+    if shape:
+        return int(shape[0])
+    if isinstance(obj, (tuple, list)) and obj and getattr(obj[0], 'shape', None):
+        return int(obj[0].shape[0])
+    return None
+
+#%%
+
+
+class _Stage:
+    """One timed stage; also usable as a decorator."""
+
+    __slots__ = ('profiler', 'name', 'rows_in', 'rows_out', 'args', '_cpu', '_rss', '_ts')
+
+    def __init__(self, profiler, name, rows_in=None, **args):
+        self.profiler = profiler
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.args = args
+
+    def __enter__(self):
+        self._rss = _SAMPLER.start(self)
+        self._ts = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._ts
+        cpu = time.process_time() - self._cpu
+        self.profiler._record({
+            'name': self.name,
+            'start': self._ts - self.profiler.origin,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'peak_rss_delta_mb': (_SAMPLER.stop(self) - self._rss) / 1024,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'tid': threading.get_ident(),
+            'args': self.args,
+        })
+        return False
+
+    def __call__(self, func):
+        profiler, name = self.profiler, self.name
+
+        @functools.wraps(func)
+        def wrapper(*a, **kw):
+            if not profiler.enabled:
+                return func(*a, **kw)
+            with _Stage(profiler, name, _rows(a[0]) if a else None) as s:
+                result = func(*a, **kw)
+                s.rows_out = _rows(result)
+            return result
+        return wrapper
+
+
+class _NullStage:
+    """Shared stand-in returned while profiling is disabled."""
+
+    __slots__ = ()
+    rows_in = rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __call__(self, func):
+        return func
+
+
+_NULL = _NullStage()
+
+
+class Profiler:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name, rows_in=None, **args):
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name, rows_in, **args)
+
+    def _record(self, rec):
+        with self._lock:
+            self.records.append(rec)
+
+    def reset(self):
+        self.records = []
+        self.origin = time.perf_counter()
+
+    def chrome_trace(self):
+        """Records as a Chrome trace-event document."""
+        pid = os.getpid()
+        events = []
+        for r in self.records:
+            args = {k: r[k] for k in ('cpu_s', 'peak_rss_delta_mb', 'rows_in', 'rows_out')
+                    if r[k] is not None}
+            args.update(r['args'])
+            events.append({'name': r['name'], 'cat': 'stage', 'ph': 'X', 'pid': pid,
+                           'tid': r['tid'], 'ts': r['start'] * 1e6, 'dur': r['wall_s'] * 1e6,
+                           'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+    def summary(self):
+        """Per-stage totals as a DataFrame, slowest first."""
+        import pandas as pd
+
+        cols = ['name', 'wall_s', 'cpu_s', 'peak_rss_delta_mb', 'rows_in', 'rows_out']
+        df = pd.DataFrame(self.records, columns=cols)
+        out = df.groupby('name', sort=False).agg(
+            calls=('wall_s', 'size'), wall_s=('wall_s', 'sum'), cpu_s=('cpu_s', 'sum'),
+            peak_rss_delta_mb=('peak_rss_delta_mb', 'max'),
+            rows_in=('rows_in', lambda v: v.sum(min_count=1)),
+            rows_out=('rows_out', lambda v: v.sum(min_count=1)))
+        return out.sort_values('wall_s', ascending=False)
+
+#%%
+# Module-level profiler used by the pipeline scripts
+
+PROFILER = Profiler(enabled=os.environ.get('TRACKS_PROFILE', '') not in ('', '0'))
+
+
+def stage(name, rows_in=None, **args):
+    return PROFILER.stage(name, rows_in, **args)
+
+
+def profiled(name):
+    """Decorator form of `stage`; checks `enabled` per call, so it can be switched on after import."""
+    return _Stage(PROFILER, name)
+
+
+def enable(flag=True):
+    PROFILER.enabled = flag
+
+
+def report(trace_path=None):
+    """Print the summary table and optionally write the Chrome trace."""
+    if not PROFILER.records:
+        return None
+    if trace_path:
+        PROFILER.write_chrome_trace(trace_path)
+    table = PROFILER.summary()
+    print(table.to_string(float_format=lambda v: f'{v:.3f}'))
+    return table
@@ -0,0 +1,184 @@
+#%%[markdown]
+## Quantized storage for the cleaned catalogue
+#
+# The bounded audio features are float64 although Spotify returns them with
+# 3-4 decimals. `quantize` stores each as an unsigned integer code with a
+# per-column offset and scale:
+#
+#   code = round((x - low) / scale),  scale = (high - low) / (2**bits - 1)
+#
+# so the reconstruction error is at most scale / 2:
+#
+#   bits  0-1 features   loudness (-60..6 dB)   tempo (0..250 BPM)
+#   16    7.6e-6         5.0e-4                 1.9e-3
+#   8     2.0e-3         0.13                   0.49
+#
+# Small integer columns are narrowed (int8/int16/int32) and duration_min is
+# stored exactly in hundredths. The offsets/scales travel in the parquet schema
+# metadata, and `read_quantized` dequantizes in vectorized record-batch blocks,
+# so `tracks_pipeline.read_tracks` reads a quantized cache transparently.
+#
+#   python tracks_cli.py ingest --csv tracks.csv --quantize 16
+#   python tracks_cli.py quantize --data tracks_clean.parquet --bits 8 16
+#
+# Values outside [low, high] are clipped (validation flags them beforehand).
+
+#%%
+import json
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+BOUNDED_FEATURES = ['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness',
+                    'liveness', 'valence']
+
+# column -> (low, high) for the quantized floats
+QUANT_RANGES = dict({c: (0.0, 1.0) for c in BOUNDED_FEATURES}, loudness=(-60.0, 6.0), tempo=(0.0, 250.0))
+
+# Exact fixed-point columns: column -> (dtype, scale)
+FIXED_POINT = {'duration_min': ('uint32', 0.01)}
+
+NARROW_INTS = {'popularity': 'int8', 'explicit': 'int8', 'key': 'int8', 'mode': 'int8',
+               'time_signature': 'int8', 'month': 'int8', 'year': 'int16', 'duration_ms': 'int32'}
+
+METADATA_KEY = b'tracks_quantize'
+
+
+def quant_spec(bits=16):
+    """column -> {dtype, offset, scale, max_error} for every quantized column."""
+    if bits not in (8, 16):
+        raise ValueError("bits must be 8 or 16")
+    spec = {}
+    for col, (low, high) in QUANT_RANGES.items():
+        scale = (high - low) / (2 ** bits - 1)
+        spec[col] = {'dtype': f'uint{bits}', 'offset': low, 'scale': scale, 'max_error': scale / 2}
+    for col, (dtype, scale) in FIXED_POINT.items():
+        spec[col] = {'dtype': dtype, 'offset': 0.0, 'scale': scale, 'max_error': 0.0}
+    return spec
+
+
+def encode(values, entry):
+    info = np.iinfo(entry['dtype'])
+    codes = np.rint((np.asarray(values, dtype=np.float64) - entry['offset']) / entry['scale'])
+    return np.clip(codes, info.min, info.max).astype(entry['dtype'])
+
+
+def decode(codes, entry, out=None):
+    """codes * scale + offset, written into `out` when given."""
+    out = np.multiply(codes, entry['scale'], out=out, dtype=np.float64, casting='unsafe')
+    out += entry['offset']
+    if entry['max_error'] == 0.0:
+        np.round(out, 2, out=out)  # fixed point in hundredths
+    return out
+
+
+def quantize(tracks, bits=16):
+    """`tracks` with quantized/narrowed columns; returns (frame, spec)."""
+    spec = {c: e for c, e in quant_spec(bits).items() if c in tracks.columns}
+    with stage('quantize', rows_in=len(tracks)):
+        out = tracks.assign(**{c: encode(tracks[c], e) for c, e in spec.items()})
+        narrow = {c: d for c, d in NARROW_INTS.items()
+                  if c in out.columns and pd.api.types.is_integer_dtype(out[c])}
+        out = out.astype(narrow)
+    return out, spec
+
+
+def dequantize(frame, spec, block_rows=65536):
+    """Float64 columns back from codes, decoded `block_rows` at a time."""
+    out = {}
+    for col, entry in spec.items():
+        if col not in frame.columns:
+            continue
+        codes = frame[col].to_numpy()
+        values = np.empty(len(codes), dtype=np.float64)
+        for start in range(0, len(codes), block_rows):
+            decode(codes[start:start + block_rows], entry, out=values[start:start + block_rows])
+        out[col] = values
+    return frame.assign(**out)
+
+#%%
+# Parquet cache
+
+
+def write_quantized(tracks, path, bits=16):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    frame, spec = quantize(tracks, bits)
+    narrowed = {c: str(tracks[c].dtype) for c in NARROW_INTS
+                if c in frame.columns and frame[c].dtype != tracks[c].dtype}
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps({'columns': spec, 'narrowed': narrowed}).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+    return path
+
+
+def read_spec(path):
+    """
+    The quantization metadata of a parquet file, or None if it is not quantized:
+    {'columns': spec, 'narrowed': {column: original dtype}}.
+    """
+    import pyarrow.parquet as pq
+
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, ValueError):
+        return None
+    return json.loads(metadata[METADATA_KEY]) if METADATA_KEY in metadata else None
+
+
+def read_quantized(path, columns=None, block_rows=65536, keep_codes=False):
+    """
+    Read a quantized parquet file, dequantizing one record batch at a time.
+
+    With `keep_codes=True` the integer codes are returned as stored (the
+    compact in-memory form) together with the spec.
+    """
+    import pyarrow.parquet as pq
+
+    stored = read_spec(path)
+    spec = stored['columns']
+    pf = pq.ParquetFile(path)
+    with stage('read_quantized') as s:
+        if keep_codes:
+            frame = pf.read(columns=columns).to_pandas()
+            s.rows_out = len(frame)
+            return frame, {c: e for c, e in spec.items() if c in frame.columns}
+        blocks = [dequantize(batch.to_pandas(), spec, block_rows)
+                  for batch in pf.iter_batches(batch_size=block_rows, columns=columns)]
+        frame = pd.concat(blocks, ignore_index=True) if blocks else pf.schema_arrow.empty_table().to_pandas()
+        frame = frame.astype({c: d for c, d in stored['narrowed'].items() if c in frame.columns})
+        s.rows_out = len(frame)
+    return frame
+
+#%%
+# Footprint and accuracy against full precision
+
+
+def footprint(tracks, bits=16, columns=None):
+    """Bytes in memory for `columns` at full precision and quantized."""
+    columns = columns or [c for c in list(QUANT_RANGES) + list(FIXED_POINT) + list(NARROW_INTS)
+                          if c in tracks.columns]
+    quantized, _ = quantize(tracks[columns], bits)
+    full = int(tracks[columns].memory_usage(index=False).sum())
+    small = int(quantized.memory_usage(index=False).sum())
+    return {'columns': len(columns), 'full_bytes': full, 'quantized_bytes': small, 'ratio': full / small}
+
+
+def compare_accuracy(spotifydf, models=('logistic', 'knn', 'rf'), bits=(8, 16)):
+    """Holdout metrics of each model trained on full-precision and on dequantized features."""
+    import tracks_pipeline as tp
+
+    variants = {'float64': spotifydf}
+    for b in bits:
+        frame, spec = quantize(spotifydf, b)
+        variants[f'uint{b}'] = dequantize(frame, spec)
+    rows = []
+    for name in models:
+        for label, frame in variants.items():
+            _, metrics = tp.train_model(name, frame)
+            rows.append(dict(model=name, storage=label, **metrics))
+    return pd.DataFrame(rows)
@@ -0,0 +1,248 @@
+#%%[markdown]
+## Headless EDA report
+#
+# Renders the figures of `Team6_Tracks.py` to PNG files on the Agg backend and
+# writes an `index.html` that shows them all.
+#
+# Each figure is split into an *aggregate* step and a *render* step. Aggregates
+# (value counts, histograms, correlation matrix, per-year means, ROC points) are
+# computed in the parent process with pandas/numpy and are small, so only they
+# are shipped to the worker processes that draw. The PNG file name contains a
+# hash of the aggregates, so a figure whose inputs did not change is found on
+# disk and skipped on re-run.
+#
+#   from tracks_report import build_report
+#   build_report(spotifydf, 'report', roc={'Logistic': (y_test, lr_probs)})
+
+#%%
+import hashlib
+import html
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tracks_profile import stage
+
+# Bump when a renderer changes so cached PNGs are redrawn
+RENDER_VERSION = 1
+
+HISTPLOT_COLUMNS = ['explicit', 'danceability', 'loudness', 'acousticness', 'year']
+TREND_COLUMNS = ['explicit', 'danceability', 'loudness', 'acousticness']
+
+#%%
+# Aggregates (parent process)
+
+
+def _hist_by_class(values, labels, bins=20):
+    edges = np.histogram_bin_edges(values, bins=bins)
+    counts = {int(c): np.histogram(values[labels == c], bins=edges)[0] for c in np.unique(labels)}
+    return {'edges': edges, 'counts': counts}
+
+
+def figure_aggregates(spotifydf, roc=None, fitted=None, shap=None):
+    """Small per-figure inputs, keyed by figure name."""
+    pop = spotifydf['popularity'].to_numpy()
+    # dup_group (tracks_dedup) is a cluster id, not a feature
+    numeric = spotifydf.select_dtypes('number').drop(columns='dup_group', errors='ignore')
+
+    aggs = {
+        'popularity_count': {'counts': spotifydf['popularity'].value_counts().sort_index()},
+        'spearman_heatmap': {'corr': numeric.corr(method='spearman')},
+        'hist_grid': {col: np.histogram(numeric[col].dropna(), bins=20) for col in numeric},
+        'histplot_by_popularity': {col: _hist_by_class(spotifydf[col].astype(float).to_numpy(), pop)
+                                   for col in HISTPLOT_COLUMNS},
+    }
+
+    grouped = spotifydf.groupby(['year', 'popularity'])[TREND_COLUMNS].agg(['mean', 'sem'])
+    aggs['year_trends'] = {'table': grouped}
+
+    for name, (y_true, y_prob) in (roc or {}).items():
+        from sklearn.metrics import roc_auc_score, roc_curve
+
+        fpr, tpr, _ = roc_curve(y_true, y_prob)
+        aggs[f'roc_{name}'] = {'name': name, 'fpr': fpr, 'tpr': tpr,
+                               'auc': roc_auc_score(y_true, y_prob)}
+    for name, (y_true, y_pred) in (fitted or {}).items():
+        aggs[f'fitted_{name}'] = {'name': name,
+                                  'actual': np.bincount(np.asarray(y_true).ravel().astype(int), minlength=2),
+                                  'fitted': np.bincount(np.asarray(y_pred).ravel().astype(int), minlength=2)}
+    for name, summary in (shap or {}).items():
+        aggs[f'shap_{name}'] = {'name': name, 'mean_abs': summary['mean_abs'], 'mean': summary['mean']}
+    return aggs
+
+
+def aggregate_hash(name, agg):
+    h = hashlib.sha256(f'{name}:{RENDER_VERSION}'.encode())
+    h.update(pickle.dumps(agg, protocol=4))
+    return h.hexdigest()[:16]
+
+#%%
+# Renderers (worker processes)
+
+
+def _render_popularity_count(plt, agg):
+    fig, ax = plt.subplots(figsize=(7, 7))
+    counts = agg['counts']
+    ax.bar(counts.index.astype(str), counts.to_numpy(), color=['#66c2a5', '#fc8d62'][:len(counts)])
+    ax.set(title='Countplot for popularity', xlabel='popularity', ylabel='count')
+    return fig
+
+
+def _render_spearman_heatmap(plt, agg):
+    import seaborn as sns
+
+    corr = agg['corr']
+    fig, ax = plt.subplots(figsize=(15, 15))
+    sns.heatmap(corr, annot=True, mask=np.triu(np.ones_like(corr, dtype=bool)), ax=ax)
+    ax.set_title('Spearman Correlation Heatmap of Spotifydf')
+    return fig
+
+
+def _render_hist_grid(plt, agg):
+    n = len(agg)
+    ncols = 4
+    nrows = (n + ncols - 1) // ncols
+    fig, axes = plt.subplots(nrows, ncols, figsize=(20, 14), squeeze=False)
+    for ax, (col, (counts, edges)) in zip(axes.flat, agg.items()):
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', color='lightgreen')
+        ax.set_title(col)
+    for ax in list(axes.flat)[n:]:
+        ax.set_visible(False)
+    return fig
+
+
+def _render_histplot_by_popularity(plt, agg):
+    fig, axes = plt.subplots(2, 3, figsize=(15, 10))
+    axes[1][2].set_visible(False)
+    for ax, (col, h) in zip(axes.flat, agg.items()):
+        edges, bottom = h['edges'], np.zeros(len(h['edges']) - 1)
+        for cls, counts in sorted(h['counts'].items()):
+            ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', bottom=bottom,
+                   alpha=0.7, label='Popular' if cls == 1 else 'Not popular')
+            bottom = bottom + counts
+        ax.set_title(f'Histplot {col.capitalize()}')
+    fig.legend(*axes[0][0].get_legend_handles_labels(), loc='right')
+    return fig
+
+
+def _render_year_trends(plt, agg):
+    table = agg['table']
+    fig, axes = plt.subplots(2, 2, figsize=(15, 10))
+    for ax, col in zip(axes.flat, TREND_COLUMNS):
+        for cls, label in ((0, 'Not popular'), (1, 'Popular')):
+            part = table.xs(cls, level='popularity')
+            mean, sem = part[(col, 'mean')], part[(col, 'sem')].fillna(0)
+            ax.plot(part.index, mean, label=label)
+            ax.fill_between(part.index, mean - 1.96 * sem, mean + 1.96 * sem, alpha=0.2)
+        ax.set_title(f'{col.capitalize()} vs Year')
+    fig.legend(*axes[0][0].get_legend_handles_labels(), loc=(0.89, 0.5))
+    return fig
+
+
+def _render_roc(plt, agg):
+    fig, ax = plt.subplots(figsize=(7, 7))
+    ax.plot([0, 1], [0, 1], linestyle='--', label='No Skill')
+    ax.plot(agg['fpr'], agg['tpr'], marker='.', label=f"{agg['name']} (AUC={agg['auc']:.3f})")
+    ax.set(xlabel='False Positive Rate', ylabel='True Positive Rate', title=f"ROC: {agg['name']}")
+    ax.legend()
+    return fig
+
+
+def _render_fitted(plt, agg):
+    fig, ax = plt.subplots(figsize=(5, 7))
+    x = np.arange(2)
+    ax.bar(x - 0.2, agg['actual'], width=0.4, color='r', label='Actual Value')
+    ax.bar(x + 0.2, agg['fitted'], width=0.4, color='b', label='Fitted Values')
+    ax.set_xticks(x, ['Not popular', 'Popular'])
+    ax.set_title(f"Actual vs Fitted Values for Popularity ({agg['name']})")
+    ax.legend()
+    return fig
+
+
+def _render_shap(plt, agg):
+    mean_abs = agg['mean_abs'].sort_values()
+    fig, ax = plt.subplots(figsize=(7, 7))
+    colors = np.where(agg['mean'][mean_abs.index] >= 0, '#fc8d62', '#66c2a5')
+    ax.barh(mean_abs.index, mean_abs.to_numpy(), color=colors)
+    ax.set(xlabel='mean |SHAP| (popularity probability)',
+           title=f"Feature importance (TreeSHAP): {agg['name']}")
+    return fig
+
+
+def _renderer(name):
+    if name.startswith('roc_'):
+        return _render_roc
+    if name.startswith('shap_'):
+        return _render_shap
+    if name.startswith('fitted_'):
+        return _render_fitted
+    return globals()[f'_render_{name}']
+
+
+def render_figure(task):
+    """Draw one figure to `path` on the Agg backend (runs in a worker process)."""
+    name, agg, path = task
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = _renderer(name)(plt, agg)
+    tmp = path + '.tmp.png'
+    fig.savefig(tmp, dpi=80, bbox_inches='tight')
+    plt.close(fig)
+    os.replace(tmp, path)
+    return path
+
+#%%
+
+
+def _write_html(out_dir, entries):
+    rows = '\n'.join(f'<h2>{html.escape(e["name"])}</h2>\n<img src="{html.escape(e["file"])}">'
+                     for e in entries)
+    with open(os.path.join(out_dir, 'index.html'), 'w') as f:
+        f.write(f'<!doctype html>\n<html><head><meta charset="utf-8"><title>Spotify tracks EDA</title>'
+                f'</head>\n<body>\n<h1>Spotify tracks EDA</h1>\n{rows}\n</body></html>\n')
+
+
+def build_report(spotifydf, out_dir='report', roc=None, fitted=None, workers=None, shap=None):
+    """
+    Render every EDA figure into `out_dir` and write `index.html`.
+
+    `roc` and `fitted` map a model name to (y_test, probabilities) and
+    (y_test, predictions), `shap` to a tracks_shap.summarize table. Returns the manifest: one entry per figure with its
+    file and whether it was redrawn or reused from the cache.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with stage('report_aggregates', rows_in=len(spotifydf)):
+        aggs = figure_aggregates(spotifydf, roc, fitted, shap)
+
+    entries, tasks = [], []
+    for name, agg in aggs.items():
+        file = f'{name}-{aggregate_hash(name, agg)}.png'
+        path = os.path.join(out_dir, file)
+        cached = os.path.exists(path)
+        entries.append({'name': name, 'file': file, 'cached': cached})
+        if not cached:
+            tasks.append((name, agg, path))
+
+    with stage('report_render', rows_in=len(tasks)):
+        if len(tasks) > 1 and (workers or os.cpu_count()) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(render_figure, tasks))
+        else:
+            for task in tasks:
+                render_figure(task)
+
+    # Drop stale renders of figures that were redrawn
+    current = {e['file'] for e in entries}
+    for file in os.listdir(out_dir):
+        if file.endswith('.png') and file not in current and file.rsplit('-', 1)[0] in aggs:
+            os.remove(os.path.join(out_dir, file))
+
+    _write_html(out_dir, entries)
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(entries, f, indent=1)
+    return entries
@@ -0,0 +1,157 @@
+#%%[markdown]
+## Feature selection from already-fitted forests
+#
+# The "Feature Selection" cell of `Team6_Tracks.py` fits a fresh
+# `SelectFromModel(RandomForestClassifier(n_estimators=100))` only to read its
+# importances. Here the importances come from a forest that was fitted anyway:
+#
+# * `mdi` reads `feature_importances_` (what SelectFromModel uses), no fit;
+# * `permutation` scores the fitted model on held-out rows with each column
+#   shuffled, spreading blocks of columns over joblib workers;
+# * `shap` is the mean |TreeSHAP| attribution of tracks_shap over the rows.
+#
+# `permutation` and `shap` results are cached on disk under a key made of a
+# hash of the data and of what identifies the fitted model: `model_key` (e.g.
+# `model_file_key` of the model file it was loaded from), else a hash of the
+# fitted model itself (parameters and fitted state, so two forests with the
+# same parameters fitted on different rows never share an entry). Re-running
+# a notebook cell or the CLI is then free; `mdi` is cheaper to recompute than
+# to cache.
+#
+#   from tracks_select import select_features
+#   selected_feat = select_features(rf_best, X_train, Y_train)
+#   x_spotifydf1 = spotifydf.loc[:, selected_feat]
+
+#%%
+import functools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+CACHE_DIR = os.path.join('.cache', 'feature_selection')
+
+
+def model_file_key(path):
+    """Identity of a model loaded from `path`: the file and its size and modification time."""
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def _cache_key(model, x, y, method, model_key=None, **params):
+    import joblib
+
+    if model_key is None:
+        # The pickled model: its parameters and every fitted tree / coefficient
+        model_key = (type(model).__name__, joblib.hash(model))
+    data = pd.util.hash_pandas_object(x, index=False).to_numpy()
+    target = None if y is None else np.asarray(y).ravel()
+    return joblib.hash((method, sorted(params.items()), list(x.columns), data, target, model_key))
+
+
+def _cached(key, compute, cache_dir):
+    path = os.path.join(cache_dir, f'{key}.json') if cache_dir else None
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return pd.Series(json.load(f))
+    result = compute()
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({k: float(v) for k, v in result.items()}, f)
+    return result
+
+#%%
+
+
+def forest_importances(model, columns):
+    """Mean decrease in impurity of a fitted forest, no refit."""
+    return pd.Series(model.feature_importances_, index=list(columns))
+
+
+def _permute_block(model, x, y, cols, baseline, scorer, n_repeats, seed):
+    rng = np.random.default_rng(seed)
+    out = {}
+    for col in cols:
+        original = x[col].to_numpy()
+        drops = []
+        for _ in range(n_repeats):
+            shuffled = x.copy(deep=False)
+            shuffled[col] = rng.permutation(original)
+            drops.append(baseline - scorer(model, shuffled, y))
+        out[col] = float(np.mean(drops))
+    return out
+
+
+def permutation_importances(model, x, y, n_repeats=5, n_jobs=-1, block_size=None,
+                            scoring='roc_auc', random_state=0):
+    """
+    Drop in `scoring` when each column of `x` is shuffled, for a fitted model.
+
+    Columns are split into blocks and each block is scored by one joblib worker,
+    so a worker deserializes the model once per block rather than per column.
+    """
+    from joblib import Parallel, delayed, effective_n_jobs
+    from sklearn.metrics import check_scoring
+
+    scorer = check_scoring(model, scoring=scoring)
+    y = np.asarray(y).ravel()
+    baseline = scorer(model, x, y)
+
+    cols = list(x.columns)
+    block_size = block_size or max(1, -(-len(cols) // effective_n_jobs(n_jobs)))
+    blocks = [cols[i:i + block_size] for i in range(0, len(cols), block_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(blocks))
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_permute_block)(model, x, y, block, baseline, scorer, n_repeats, seed)
+        for block, seed in zip(blocks, seeds))
+    merged = {}
+    for r in results:
+        merged.update(r)
+    return pd.Series(merged)[cols]
+
+
+def shap_importances(model, x, **params):
+    """Mean |TreeSHAP| attribution per column of `x`."""
+    from tracks_shap import forest_shap
+
+    return pd.Series(np.abs(forest_shap(model, x, **params)[0]).mean(axis=0), index=list(x.columns))
+
+
+def importances(model, x, y=None, method='mdi', cache_dir=CACHE_DIR, model_key=None, **params):
+    """Importances of a fitted model over the columns of `x`; cached unless `mdi`."""
+    if method == 'mdi':
+        return forest_importances(model, x.columns)
+    if method == 'permutation':
+        if y is None:
+            raise ValueError("permutation importances need the target")
+        compute = functools.partial(permutation_importances, model, x, y, **params)
+    elif method == 'shap':
+        compute = functools.partial(shap_importances, model, x, **params)
+    else:
+        raise ValueError(f"Unknown importance method: {method}")
+
+    with stage(f'importances_{method}', rows_in=len(x)):
+        return _cached(_cache_key(model, x, y, method, model_key, **params), compute, cache_dir)
+
+
+def select_features(model, x, y=None, method='mdi', threshold='mean', cache_dir=CACHE_DIR, model_key=None,
+                    **params):
+    """
+    Columns of `x` whose importance is at least `threshold`, in `x` order.
+
+    `threshold` is a number, 'mean' or 'median' (as in SelectFromModel), so with
+    the defaults this matches SelectFromModel on the same fitted forest.
+    """
+    imp = importances(model, x, y, method, cache_dir, model_key, **params)
+    if threshold == 'mean':
+        cut = imp.mean()
+    elif threshold == 'median':
+        cut = imp.median()
+    else:
+        cut = float(threshold)
+    return [col for col in x.columns if imp[col] >= cut]
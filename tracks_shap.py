@@ -0,0 +1,212 @@
+#%%[markdown]
+## Exact TreeSHAP for the random forests, over the whole catalogue
+#
+# Per-track explanations of `rf_best` ("why is this track predicted
+# popular?"). Path-dependent TreeSHAP splits a tree's prediction over the
+# features; for one leaf the game is a product over the distinct features on
+# its path,
+#
+#   v(S) = value * prod_{j in S} o_j * prod_{j not in S} z_j
+#
+# with o_j = 1 when the track follows every split on feature j down to the
+# leaf and z_j the fraction of the training cover that does. The Shapley
+# value of feature i is value * (o_i - z_i) * sum_s w(s, u) [t^s] prod_{j != i} (o_j t + z_j),
+# and since the o_j are 0/1 a leaf with u features has only 2^u patterns. So:
+#
+# * per tree, the attribution of every (leaf, pattern) is tabulated once from
+#   the node arrays, vectorized over leaves and patterns (u <= max_depth);
+# * per batch of tracks, the pattern of every leaf is a bitmask pushed down
+#   the tree level by level, and the attributions are a sparse
+#   (tracks x leaf patterns) @ (leaf patterns x features) product.
+#
+# Trees are split across worker processes. The output is a float32
+# (tracks x features) matrix whose rows add up to predict_proba minus the
+# expected value.
+#
+#   python tracks_cli.py explain --data tracks_clean.parquet --model models/rf.pkl --out shap.npy
+#
+# A `train --artists` bundle is a pipeline; its forest is explained on the
+# encoded columns (the artist features included).
+#
+# `summarize` gives the global view (mean |SHAP| per feature), which is also a
+# `method='shap'` importance in tracks_select and a figure in tracks_report.
+
+#%%
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import factorial
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+BATCH_ROWS = 8192
+
+# 2^u patterns per leaf: trees deeper than this (in distinct features per path) are refused
+MAX_PATH_FEATURES = 12
+
+
+class TreeTable:
+    """Per-leaf attribution tables of one fitted sklearn decision tree."""
+
+    def __init__(self, tree, positive=1):
+        t = tree.tree_
+        left, right = t.children_left, t.children_right
+        cover = t.weighted_n_node_samples
+        values = t.value[:, 0, :]
+        values = values[:, positive] / values.sum(axis=1)
+        n_nodes = t.node_count
+
+        # Walk the tree once: the edge bit of every node, and the distinct
+        # features, covers and value of every leaf's path
+        self.edge_bit = np.zeros(n_nodes, dtype=np.int64)
+        self.parent = np.full(n_nodes, -1)
+        self.is_left = np.zeros(n_nodes, dtype=bool)
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        leaves, paths = [], []
+        stack = [(0, [], [])]
+        while stack:
+            node, feats, zs = stack.pop()
+            if left[node] == -1:
+                leaves.append(node)
+                paths.append((feats, zs))
+                continue
+            f = t.feature[node]
+            slot = feats.index(f) if f in feats else len(feats)
+            for child, is_left in ((left[node], True), (right[node], False)):
+                frac = cover[child] / cover[node]
+                self.parent[child], self.is_left[child] = node, is_left
+                self.edge_bit[child] = 1 << slot
+                depth[child] = depth[node] + 1
+                if slot < len(feats):
+                    stack.append((child, feats, zs[:slot] + [zs[slot] * frac] + zs[slot + 1:]))
+                else:
+                    stack.append((child, feats + [f], zs + [frac]))
+
+        self.leaves = np.asarray(leaves)
+        self.u = np.array([len(f) for f, _ in paths])
+        self.d = int(self.u.max()) if len(paths) else 0
+        if self.d > MAX_PATH_FEATURES:
+            raise ValueError(f"Tree paths use up to {self.d} distinct features; "
+                             f"TreeTable supports {MAX_PATH_FEATURES} (limit max_depth)")
+        n_leaves = len(leaves)
+        self.features = np.zeros((n_leaves, self.d), dtype=np.int64)
+        z = np.ones((n_leaves, self.d))
+        for i, (feats, zs) in enumerate(paths):
+            self.features[i, :len(feats)] = feats
+            z[i, :len(zs)] = zs
+        self.full = (1 << self.u) - 1
+        self.split_feature = np.where(left == -1, 0, t.feature)
+        self.threshold = t.threshold
+        self.levels = [np.flatnonzero(depth == k) for k in range(1, int(depth.max()) + 1)]
+        self.n_features = tree.n_features_in_
+        self.expected_value = float(cover[self.leaves] @ values[self.leaves] / cover[0])
+        self.table = self._tabulate(values[self.leaves], z)
+
+    def _tabulate(self, value, z):
+        """(leaves * 2^d, n_features) attributions of every leaf and pattern."""
+        n_leaves, d = z.shape
+        patterns = np.arange(1 << d)
+        slots = np.arange(d)
+        real = slots[None, :] < self.u[:, None]                                    # (L, d)
+        o = ((patterns[:, None] >> slots) & 1).astype(np.float64)                  # (P, d)
+        o = np.where(real[:, None, :], o[None], 0.0)                               # (L, P, d)
+        zz = np.broadcast_to(z[:, None, :], o.shape)
+
+        # prod_j (o_j t + z_j), coefficients of t^0..t^d; padded slots are factor 1
+        poly = np.zeros(o.shape[:2] + (d + 1,))
+        poly[..., 0] = 1
+        for j in range(d):
+            shifted = np.concatenate([np.zeros(o.shape[:2] + (1,)), poly[..., :-1]], axis=-1)
+            poly = zz[..., j:j + 1] * poly + o[..., j:j + 1] * shifted
+
+        # Shapley weights w(s, u) = s! (u - s - 1)! / u!
+        w = np.zeros((n_leaves, d + 1))
+        for u in np.unique(self.u):
+            w[self.u == u, :u] = [factorial(s) * factorial(u - s - 1) / factorial(u) for s in range(u)]
+
+        phi = np.zeros(o.shape)
+        for j in range(d):
+            oj, zj = o[..., j:j + 1], zz[..., j:j + 1]
+            # Divide out factor j: by z_j when o_j = 0, synthetically by (t + z_j) when o_j = 1
+            q_zero = poly / zj
+            q_one = np.zeros_like(poly)
+            for s in range(d, 0, -1):
+                q_one[..., s - 1] = poly[..., s] - zj[..., 0] * (q_one[..., s] if s < d else 0)
+            q = np.where(oj == 1, q_one, q_zero)
+            phi[..., j] = (q * w[:, None, :]).sum(axis=-1) * (oj[..., 0] - zj[..., 0])
+        phi *= value[:, None, None]
+        phi[~np.broadcast_to(real[:, None, :], phi.shape)] = 0
+
+        table = np.zeros((n_leaves, 1 << d, self.n_features))
+        for j in range(d):
+            rows = np.flatnonzero(real[:, j])
+            table[rows, :, self.features[rows, j]] += phi[rows, :, j]
+        return table.reshape(n_leaves << d, self.n_features).astype(np.float32)
+
+    def patterns(self, xt):
+        """(leaves, n) pattern index of every leaf, for the rows of `xt` (float32, features x n)."""
+        # Node-major layout: gathering parents copies contiguous rows
+        goes_left = xt[self.split_feature] <= self.threshold[:, None]
+        fail = np.zeros((len(self.parent), xt.shape[1]), dtype=np.uint16)
+        for nodes in self.levels:
+            parents = self.parent[nodes]
+            wrong = goes_left[parents] != self.is_left[nodes, None]
+            fail[nodes] = fail[parents] | (wrong * self.edge_bit[nodes, None].astype(np.uint16))
+        code = self.full[:, None].astype(np.int32) & ~fail[self.leaves].astype(np.int32)
+        return (np.arange(len(self.leaves), dtype=np.int32)[:, None] << self.d) + code
+
+    def shap(self, xt):
+        from scipy.sparse import csr_matrix
+
+        idx = self.patterns(xt)
+        n_leaves, n = idx.shape
+        hits = csr_matrix((np.ones(idx.size, dtype=np.float32), idx.T.ravel(), np.arange(0, idx.size + 1, n_leaves)),
+                          shape=(n, len(self.table)))
+        return hits @ self.table
+
+
+def _forest_part(trees, x, positive, batch_rows):
+    """Summed attributions and expected values of a subset of the trees (runs in a worker)."""
+    phi = np.zeros((len(x), x.shape[1]))
+    expected = 0.0
+    for tree in trees:
+        table = TreeTable(tree, positive)
+        expected += table.expected_value
+        for start in range(0, len(x), batch_rows):
+            phi[start:start + batch_rows] += table.shap(np.ascontiguousarray(x[start:start + batch_rows].T))
+    return phi, expected
+
+
+def forest_shap(forest, x, workers=None, batch_rows=BATCH_ROWS):
+    """
+    (attributions float32 (n, features), expected value) of the positive
+    class probability of a fitted sklearn forest.
+    """
+    if not hasattr(forest, 'estimators_'):
+        raise ValueError(f"TreeSHAP needs a fitted sklearn forest, not a {type(forest).__name__} "
+                         "(unwrap pipelines with tracks_pipeline.final_estimator)")
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    positive = list(forest.classes_).index(1) if 1 in forest.classes_ else -1
+    trees = forest.estimators_
+    workers = min(workers or os.cpu_count() or 1, len(trees))
+    with stage('tree_shap', rows_in=len(x)) as s:
+        if workers > 1:
+            chunks = [trees[i::workers] for i in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(_forest_part, chunks, [x] * workers, [positive] * workers,
+                                      [batch_rows] * workers))
+        else:
+            parts = [_forest_part(trees, x, positive, batch_rows)]
+        phi = sum(p[0] for p in parts) / len(trees)
+        expected = sum(p[1] for p in parts) / len(trees)
+        s.rows_out = len(phi)
+    return phi.astype(np.float32), expected
+
+
+def summarize(phi, columns):
+    """Global view per feature: mean |SHAP| (the importance), mean and spread."""
+    phi = np.asarray(phi, dtype=np.float64)
+    return pd.DataFrame({'mean_abs': np.abs(phi).mean(axis=0), 'mean': phi.mean(axis=0),
+                         'std': phi.std(axis=0)}, index=list(columns)).sort_values('mean_abs', ascending=False)
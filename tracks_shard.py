@@ -0,0 +1,200 @@
+#%%[markdown]
+## Hash-sharded scoring
+#
+# `score` runs one `predict_proba` over the whole catalogue in one process.
+# Here the catalogue is partitioned by a hash of the track `id` into N shard
+# files and every shard becomes one task in the work queue of
+# `tracks_tunequeue` (a SQLite file on one host, a shared directory across
+# nodes). Workers load the models once, then claim and score shards until the
+# queue is empty; each shard's scores are written atomically next to it.
+#
+# A shard that raises is marked failed and put back on its own after
+# RETRY_DELAY_S (up to `max_attempts`), and a worker that dies loses only its
+# lease. `merge` joins the shard outputs back into the input row order, so the
+# result file does not depend on the number of workers or on which worker
+# scored what (the logistic model can differ from a single `score` run in the
+# last bit, as BLAS blocks the matrix product by shard size).
+#
+# Scores are written under `scores/<study>`, where the study key hashes the
+# data, the model files and the shard count. `init` on other inputs clears the
+# old shards' trials and scores, and `merge` refuses when the data or models
+# changed since `init` or a shard has no scores for the current study.
+#
+#   python tracks_cli.py shard init   --data tracks.csv --work shards --shards 16 --models rf knn
+#   python tracks_cli.py shard local  --queue shards/queue.sqlite --workers 4 --out scores.csv
+#   python tracks_cli.py shard worker --queue /shared/shards/queue    # on other nodes
+
+#%%
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+from tracks_tunequeue import LEASE_S, _keep_alive, open_queue, study_key, worker_name
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY_S = 5
+
+
+def shard_of(ids, n_shards):
+    """Shard number per id from a stable 64-bit hash (same on every host and run)."""
+    hashes = pd.util.hash_array(np.asarray(ids, dtype=object))
+    return (hashes % np.uint64(n_shards)).astype(np.int64)
+
+
+def shard_path(work_dir, shard, kind='tracks'):
+    return os.path.join(work_dir, kind, f'shard-{shard:05d}.parquet')
+
+
+def scores_kind(study):
+    return os.path.join('scores', study)
+
+
+def partition(tracks, work_dir, n_shards):
+    """Write `tracks` as `n_shards` parquet files; `_row` keeps the input order."""
+    with stage('partition', rows_in=len(tracks)):
+        os.makedirs(os.path.join(work_dir, 'tracks'), exist_ok=True)
+        tracks = tracks.assign(_row=np.arange(len(tracks)))
+        shards = shard_of(tracks['id'].to_numpy(), n_shards)
+        order = np.argsort(shards, kind='stable')
+        bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+        for shard in range(n_shards):
+            part = tracks.iloc[order[bounds[shard]:bounds[shard + 1]]]
+            part.to_parquet(shard_path(work_dir, shard), index=False)
+
+
+def _study(config):
+    """Study key of a scoring config, from the current contents of its data and model files."""
+    paths = [config['data']] + [os.path.join(config['models_dir'], f'{name}.pkl') for name in config['models']]
+    specs = [{'shard': i} for i in range(config['n_shards'])]
+    return study_key({k: config[k] for k in ('data', 'work_dir', 'models', 'models_dir', 'n_shards')},
+                     specs, paths)
+
+
+def init_scoring(queue_path, data, work_dir, n_shards, models, models_dir):
+    import tracks_pipeline as tp
+
+    config = {'data': os.path.abspath(data), 'work_dir': os.path.abspath(work_dir), 'models': list(models),
+              'models_dir': os.path.abspath(models_dir), 'n_shards': n_shards}
+    config['study'] = _study(config)
+    tracks = tp.read_tracks(data)
+    partition(tracks, work_dir, n_shards)
+    config['rows'] = len(tracks)
+    queue = open_queue(queue_path)
+    queue.init(config, [{'shard': i} for i in range(n_shards)])
+    # Scores of any other study are stale now
+    scores = os.path.join(work_dir, 'scores')
+    if os.path.isdir(scores):
+        for study in os.listdir(scores):
+            if study != config['study']:
+                shutil.rmtree(os.path.join(scores, study))
+    os.makedirs(os.path.join(work_dir, scores_kind(config['study'])), exist_ok=True)
+    return queue
+
+#%%
+# Worker and coordinator
+
+
+def score_shard(work_dir, shard, bundles, study):
+    import tracks_pipeline as tp
+
+    tracks = pd.read_parquet(shard_path(work_dir, shard))
+    scores = tp.score_tracks(tracks, bundles)
+    # score_tracks drops rows without release_date; keep the rest in input order
+    scores['_row'] = tracks.loc[tracks['release_date'].notna(), '_row'].to_numpy()
+    out = shard_path(work_dir, shard, scores_kind(study))
+    tmp = f'{out}.{worker_name()}.tmp'
+    scores.to_parquet(tmp, index=False)
+    os.replace(tmp, out)
+    return len(scores)
+
+
+def run_worker(queue_path, heartbeat_s=30):
+    """Load the models once, then score shards until none is pending."""
+    import tracks_pipeline as tp
+
+    queue = open_queue(queue_path)
+    config = queue.config()
+    bundles = {name: tp.load_model(os.path.join(config['models_dir'], f'{name}.pkl'))
+               for name in config['models']}
+
+    me, done = worker_name(), 0
+    while True:
+        claimed = queue.claim(me)
+        if claimed is None:
+            break
+        trial_id, params = claimed
+        stop = threading.Event()
+        threading.Thread(target=_keep_alive, args=(queue_path, trial_id, stop, heartbeat_s), daemon=True).start()
+        t0 = time.perf_counter()
+        try:
+            rows = score_shard(config['work_dir'], params['shard'], bundles, config['study'])
+            queue.finish(trial_id, result={'rows': rows, 'score_s': time.perf_counter() - t0})
+        except Exception as e:
+            queue.finish(trial_id, error=f'{type(e).__name__}: {e}')
+        finally:
+            stop.set()
+        done += 1
+    return done
+
+
+def status(queue_path, lease=LEASE_S, max_attempts=MAX_ATTEMPTS):
+    """Requeue expired and retryable failed shards; returns the status counts."""
+    queue = open_queue(queue_path)
+    queue.requeue_stale(lease, max_attempts)
+    queue.retry_failed(max_attempts, delay=RETRY_DELAY_S)
+    return queue.trials()['status'].value_counts()
+
+
+def run_local(queue_path, workers, lease=LEASE_S, max_attempts=MAX_ATTEMPTS, poll_s=1):
+    """Start local worker processes and keep them going until every shard is done or out of retries."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracks_cli.py')
+    argv = [sys.executable, script, 'shard', 'worker', '--queue', queue_path]
+    procs = [subprocess.Popen(argv) for _ in range(workers)]
+    while True:
+        time.sleep(poll_s)
+        counts = status(queue_path, lease, max_attempts)
+        pending, running = counts.get('pending', 0), counts.get('running', 0)
+        alive = [p for p in procs if p.poll() is None]
+        if not pending and not running and not alive and not _retryable(queue_path, max_attempts):
+            break
+        procs = alive + [subprocess.Popen(argv) for _ in range(min(workers - len(alive), pending))]
+    return status(queue_path, lease, max_attempts)
+
+
+def _retryable(queue_path, max_attempts):
+    trials = open_queue(queue_path).trials()
+    return bool(((trials['status'] == 'failed') & (trials['attempts'] < max_attempts)).any())
+
+
+def merge(queue_path, out):
+    """Concatenate the shard scores in input row order into `out` (.csv or .parquet)."""
+    queue = open_queue(queue_path)
+    config = queue.config()
+    if _study(config) != config['study']:
+        raise RuntimeError("The data or models changed since `shard init`; re-run it before merging")
+    failed = queue.trials().query("status != 'done'")
+    if len(failed):
+        errors = '; '.join(failed['error'].dropna().unique()[:3])
+        raise RuntimeError(f"{len(failed)} shard(s) not scored: {errors}")
+    paths = [shard_path(config['work_dir'], i, scores_kind(config['study'])) for i in range(config['n_shards'])]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} shard(s) have no scores for study {config['study']}, "
+                           f"e.g. {missing[0]}; re-run `shard init` and the workers")
+    with stage('merge_shards') as s:
+        parts = [pd.read_parquet(path) for path in paths]
+        scores = pd.concat(parts, ignore_index=True).sort_values('_row').drop(columns='_row')
+        scores = scores.reset_index(drop=True)
+        if out.endswith('.parquet'):
+            scores.to_parquet(out, index=False)
+        else:
+            scores.to_csv(out, index=False)
+        s.rows_out = len(scores)
+    return scores
@@ -0,0 +1,124 @@
+#%%[markdown]
+## Sparse one-hot encoding of key, mode, month and decade
+#
+# The models read `key` (pitch class), `month` and `year` as plain numbers, so
+# C# sits "between" C and D and a linear model gets one slope for the whole
+# calendar. `SparseCategoricalEncoder` one-hot encodes `key`, `mode`, `month`
+# and the release decade and puts them next to the (standardized) dense
+# features in one CSR matrix, built directly from the codes: every row has the
+# same number of entries, so indptr is an arange and nothing is densified.
+#
+# With `n_hash` the categories are hashed into that many shared columns
+# instead of one column per seen value (no vocabulary, unseen values still
+# land somewhere), which keeps the width fixed however many categories there
+# are.
+#
+# `logistic_sparse` and `sgd` (SGDClassifier, log loss) in tracks_pipeline are
+# pipelines of this encoder and the linear model, which fits the CSR matrix
+# directly:
+#
+#   python tracks_cli.py train --data tracks_clean.parquet --models logistic_sparse sgd
+
+#%%
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+CATEGORICAL_COLUMNS = ['key', 'mode', 'month', 'decade']
+
+
+def categorical_values(x, column):
+    """Integer values of a categorical column; `decade` is derived from `year`."""
+    if column == 'decade':
+        return (np.asarray(x['year'], dtype=np.float64) // 10 * 10).astype(np.int64)
+    return np.rint(np.asarray(x[column], dtype=np.float64)).astype(np.int64)
+
+
+class SparseCategoricalEncoder:
+    """
+    Frame -> CSR matrix of the standardized `dense` columns followed by the
+    one-hot (or hashed, with `n_hash`) `categorical` columns.
+    """
+
+    def __init__(self, dense=None, categorical=CATEGORICAL_COLUMNS, n_hash=None, scale=True):
+        self.dense = dense
+        self.categorical = categorical
+        self.n_hash = n_hash
+        self.scale = scale
+
+    def _dense_columns(self, x):
+        if self.dense is not None:
+            return list(self.dense)
+        # `year` stays a dense column next to its decade buckets
+        return [c for c in x.columns if c not in self.categorical]
+
+    def fit(self, x, y=None):
+        self.dense_ = self._dense_columns(x)
+        values = x[self.dense_].to_numpy(np.float64)
+        self.mean_ = values.mean(axis=0) if self.scale else np.zeros(len(self.dense_))
+        sd = values.std(axis=0) if self.scale else np.ones(len(self.dense_))
+        self.scale_ = np.where(sd > 0, sd, 1)
+        if self.n_hash:
+            self.categories_ = None
+            self.n_features_out_ = len(self.dense_) + self.n_hash
+            return self
+        self.categories_ = [np.unique(categorical_values(x, c)) for c in self.categorical]
+        self.offsets_ = len(self.dense_) + np.r_[0, np.cumsum([len(c) for c in self.categories_])]
+        self.n_features_out_ = int(self.offsets_[-1])
+        return self
+
+    def fit_transform(self, x, y=None):
+        return self.fit(x, y).transform(x)
+
+    def _columns(self, x):
+        """(n, n_categorical) output column per row and category; -1 for unseen values."""
+        cols = np.empty((len(x), len(self.categorical)), dtype=np.int64)
+        for j, column in enumerate(self.categorical):
+            values = categorical_values(x, column)
+            if self.n_hash:
+                h = pd.util.hash_array(values.astype(np.uint64) + np.uint64(j << 40))  # (column, value)
+                cols[:, j] = len(self.dense_) + (h % np.uint64(self.n_hash)).astype(np.int64)
+                continue
+            cats = self.categories_[j]
+            idx = np.searchsorted(cats, values)
+            idx[idx == len(cats)] = 0
+            found = cats[idx] == values if len(cats) else np.zeros(len(values), dtype=bool)
+            cols[:, j] = np.where(found, self.offsets_[j] + idx, -1)
+        return cols
+
+    def transform(self, x):
+        from scipy.sparse import csr_matrix
+
+        n, d, c = len(x), len(self.dense_), len(self.categorical)
+        with stage('sparse_encode', rows_in=n) as s:
+            dense = (x[self.dense_].to_numpy(np.float64) - self.mean_) / self.scale_
+            cols = self._columns(x)
+            unseen = cols < 0
+            # d dense + c one-hot entries per row; unseen values become explicit zeros
+            indices = np.hstack([np.broadcast_to(np.arange(d), (n, d)), np.where(unseen, 0, cols)])
+            data = np.hstack([dense, (~unseen).astype(np.float64)])
+            out = csr_matrix((data.ravel(), indices.ravel(), np.arange(0, n * (d + c) + 1, d + c)),
+                             shape=(n, self.n_features_out_))
+            if self.n_hash or unseen.any():
+                # Hash collisions/unseen zeros: merge duplicate columns, keep indices sorted
+                out.sum_duplicates()
+            out.eliminate_zeros()
+            s.rows_out = n
+        return out
+
+    def get_feature_names_out(self, input_features=None):
+        names = list(self.dense_)
+        if self.n_hash:
+            return np.asarray(names + [f'hash_{i}' for i in range(self.n_hash)], dtype=object)
+        for column, cats in zip(self.categorical, self.categories_):
+            names += [f'{column}_{v}' for v in cats]
+        return np.asarray(names, dtype=object)
+
+    def get_params(self, deep=True):
+        return {k: getattr(self, k) for k in ('dense', 'categorical', 'n_hash', 'scale')}
+
+    def set_params(self, **params):
+        for k, v in params.items():
+            setattr(self, k, v)
+        return self
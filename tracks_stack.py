@@ -0,0 +1,142 @@
+#%%[markdown]
+## Stacked ensemble over cached out-of-fold predictions
+#
+# The logistic, KNN and RF models are compared side by side; stacking feeds
+# their probabilities to a meta-model instead. The meta-model must be trained
+# on predictions the base models made for rows they did not see, so every base
+# model is fitted once per fold of the train split:
+#
+# * its out-of-fold probability for every train row is the meta-model's input;
+# * its probability for the test rows is the mean over the fold models, so the
+#   test split is scored without another fit on all train rows.
+#
+# Both are cached per base model under `.cache/stacking`, keyed by a hash of
+# the model, its parameters, the folds and the data it sees. With a
+# `dup_group` column (tracks_dedup) the folds keep near-duplicates together. Adding a base
+# model or trying another meta-model only fits what is not cached yet; the
+# (model, fold) fits that are missing run in parallel on joblib workers.
+#
+#   python tracks_cli.py stack --data tracks_clean.parquet --models logistic knn rf --meta logistic
+#
+# prints the test metrics of each base model and of the stack.
+
+#%%
+import os
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+CACHE_DIR = os.path.join('.cache', 'stacking')
+
+META_MODELS = ('logistic', 'rf')
+
+
+def _cache_key(name, features, params, x_train, y_train, x_test, folds):
+    import joblib
+
+    data = [pd.util.hash_pandas_object(x[features], index=False).to_numpy() for x in (x_train, x_test)]
+    return joblib.hash((name, list(features), sorted(params.items()), data, np.asarray(y_train),
+                        [val for _, val in folds]))
+
+
+def _fit_fold(name, params, x_train, y_train, x_test, train_idx, val_idx):
+    """Probabilities of the fold model for its held-out rows and for the test rows."""
+    import tracks_pipeline as tp
+
+    model = tp.make_model(name, **params)
+    with stage(f'stack_fit_{name}', rows_in=len(train_idx)):
+        model.fit(x_train.iloc[train_idx], y_train.iloc[train_idx])
+    return model.predict_proba(x_train.iloc[val_idx])[:, 1], model.predict_proba(x_test)[:, 1]
+
+
+def base_predictions(spotifydf, names, params=None, n_folds=5, random_state=321, n_jobs=-1,
+                     cache_dir=CACHE_DIR):
+    """
+    Out-of-fold probabilities on the train split and fold-averaged
+    probabilities on the test split, one `p_<name>` column per base model:
+    (oof, test, y_train, y_test).
+    """
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import StratifiedKFold
+
+    from tracks_dedup import group_folds
+
+    import tracks_pipeline as tp
+
+    params = params or {}
+    features = {name: tp.MODEL_FEATURES[name] for name in names}
+    columns = list(dict.fromkeys(c for name in names for c in features[name]))
+    x_train, x_test, y_train, y_test = tp.split(spotifydf, columns)
+    if 'dup_group' in spotifydf.columns:
+        fold = group_folds(y_train, spotifydf.loc[x_train.index, 'dup_group'], n_folds, random_state)
+        folds = [(np.flatnonzero(fold != k), np.flatnonzero(fold == k)) for k in range(n_folds)]
+    else:
+        folds = list(StratifiedKFold(n_folds, shuffle=True, random_state=random_state).split(x_train, y_train))
+
+    oof = pd.DataFrame(index=x_train.index)
+    test = pd.DataFrame(index=x_test.index)
+    paths, todo = {}, []
+    for name in names:
+        key = _cache_key(name, features[name], params.get(name, {}), x_train, y_train, x_test, folds)
+        paths[name] = os.path.join(cache_dir, f'{name}-{key}.npz') if cache_dir else None
+        if paths[name] and os.path.exists(paths[name]):
+            cached = np.load(paths[name])
+            oof[f'p_{name}'], test[f'p_{name}'] = cached['oof'], cached['test']
+        else:
+            todo.append(name)
+
+    with stage('stack_base_models', rows_in=len(x_train)) as s:
+        jobs = [(name, k) for name in todo for k in range(n_folds)]
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_fold)(name, params.get(name, {}), x_train[features[name]], y_train,
+                               x_test[features[name]], *folds[k])
+            for name, k in jobs)
+        s.rows_out = len(jobs)
+
+    for name in todo:
+        p_oof, p_test = np.empty(len(x_train)), np.zeros(len(x_test))
+        for (job_name, k), (p_val, p_fold_test) in zip(jobs, results):
+            if job_name == name:
+                p_oof[folds[k][1]] = p_val
+                p_test += p_fold_test / n_folds
+        oof[f'p_{name}'], test[f'p_{name}'] = p_oof, p_test
+        if paths[name]:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(paths[name], oof=p_oof, test=p_test)
+    return oof, test, y_train, y_test
+
+
+def make_meta(meta='logistic'):
+    if meta == 'logistic':
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression()
+    if meta == 'rf':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(n_estimators=200, max_depth=4, random_state=42)
+    raise ValueError(f"Unknown meta-model: {meta}; use one of {META_MODELS}")
+
+
+def stack(spotifydf, names, meta='logistic', **kwargs):
+    """
+    Fit the meta-model on the cached out-of-fold probabilities; returns
+    (meta-model, test metrics of every base model and of the stack).
+    """
+    import tracks_pipeline as tp
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score
+
+    oof, test, y_train, y_test = base_predictions(spotifydf, names, **kwargs)
+    model = make_meta(meta)
+    with stage('stack_fit_meta', rows_in=len(oof)):
+        model.fit(oof, y_train)
+
+    rows = {}
+    for column in test.columns:
+        prob = test[column].to_numpy()
+        pred = (prob > 0.5).astype(int)
+        rows[column[2:]] = {'accuracy': accuracy_score(y_test, pred),
+                            'precision': precision_score(y_test, pred, zero_division=0),
+                            'recall': recall_score(y_test, pred), 'roc_auc': roc_auc_score(y_test, prob)}
+    rows[f'stack_{meta}'] = tp.evaluate(model, test, y_test)
+    return model, pd.DataFrame(rows).T
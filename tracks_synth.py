@@ -0,0 +1,395 @@
+#%%[markdown]
+## Synthetic `tracks.csv` generator
+#
+# Writes files with the same schema as the Kaggle `tracks.csv` so the pipeline
+# can be exercised (and benchmarked) without downloading the real data.
+#
+# Columns are drawn from a Gaussian copula: correlated standard normals are
+# pushed through the normal CDF and then through each column's quantile
+# function. The copula correlation is derived from the Spearman matrix the EDA
+# heatmap shows, so rank correlations and marginals both survive. For
+# continuous margins that is r = 2 sin(pi * rho / 6); discrete and tied margins
+# (explicit, mode, key, time_signature, the zeros of instrumentalness) shrink
+# the rank correlation, so each pair's latent r is found by a 1-D root-find
+# against the Spearman of the discretized pair. `spearman_gaps` checks a
+# generated frame against its profile (pairs the positive-definite repair has
+# to move stay a few hundredths off). The default profile approximates the
+# Kaggle data; use `fit_profile` on a real `tracks.csv` to get an exact one.
+#
+# Usage:
+#
+#   python tracks_synth.py --rows 1000000 --out tracks.csv --workers 8
+#   python tracks_synth.py --rows 100000000 --out tracks_parquet --format parquet
+
+#%%
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+# Copula calibration: grid of the rank score functions and common random normals
+SCORE_GRID = 4096
+CALIBRATION_ROWS = 100_000
+
+TRACKS_COLUMNS = ['id', 'name', 'popularity', 'duration_ms', 'explicit', 'artists',
+                  'id_artists', 'release_date', 'danceability', 'energy', 'key',
+                  'loudness', 'mode', 'speechiness', 'acousticness', 'instrumentalness',
+                  'liveness', 'valence', 'tempo', 'time_signature']
+
+# Columns driven by the copula, in the order of the correlation matrix
+COPULA_COLUMNS = ['popularity', 'duration_ms', 'explicit', 'danceability', 'energy', 'key',
+                  'loudness', 'mode', 'speechiness', 'acousticness', 'instrumentalness',
+                  'liveness', 'valence', 'tempo', 'time_signature', 'year']
+
+QUANTILE_PROBS = [0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0]
+
+# Rounding Spotify uses for each numeric column in tracks.csv
+ROUNDING = {'popularity': 0, 'duration_ms': 0, 'danceability': 3, 'energy': 3,
+            'loudness': 3, 'speechiness': 4, 'acousticness': 6, 'instrumentalness': 6,
+            'liveness': 4, 'valence': 4, 'tempo': 3, 'year': 0}
+
+BASE62 = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'))
+
+NAME_WORDS = np.array(['Love', 'Night', 'Heart', 'Dance', 'Blue', 'Fire', 'Dream', 'Song',
+                       'Home', 'Baby', 'Time', 'Rain', 'Light', 'Summer', 'Girl', 'World',
+                       'Moon', 'Road', 'River', 'Gold', 'Sky', 'Waltz', 'Blues', 'Forever'])
+
+#%%
+# Default profile, approximating the Kaggle tracks.csv (~586k rows)
+
+DEFAULT_PROFILE = {
+    'quantiles': {
+        'popularity': [0, 0, 0, 2, 13, 27, 41, 52, 58, 69, 100],
+        'duration_ms': [3344, 60000, 120000, 145000, 175093, 214893, 263867, 330000, 390000, 600000, 5621218],
+        'danceability': [0.0, 0.15, 0.25, 0.31, 0.453, 0.577, 0.686, 0.77, 0.81, 0.88, 0.991],
+        'energy': [0.0, 0.02, 0.07, 0.12, 0.343, 0.549, 0.748, 0.87, 0.92, 0.97, 1.0],
+        'loudness': [-60.0, -27.0, -20.0, -17.0, -12.891, -9.243, -6.482, -4.7, -3.9, -2.5, 5.376],
+        'speechiness': [0.0, 0.025, 0.028, 0.03, 0.034, 0.0443, 0.0763, 0.2, 0.45, 0.93, 0.971],
+        'acousticness': [0.0, 0.0003, 0.003, 0.011, 0.0969, 0.422, 0.785, 0.95, 0.98, 0.993, 0.996],
+        'instrumentalness': [0.0, 0.0, 0.0, 0.0, 0.0, 0.0000245, 0.00955, 0.42, 0.77, 0.92, 1.0],
+        'liveness': [0.0, 0.04, 0.06, 0.075, 0.0983, 0.139, 0.278, 0.4, 0.6, 0.9, 1.0],
+        'valence': [0.0, 0.03, 0.09, 0.15, 0.346, 0.564, 0.769, 0.9, 0.94, 0.97, 1.0],
+        'tempo': [0.0, 65.0, 78.0, 85.0, 95.6, 117.384, 136.321, 158.0, 172.0, 195.0, 246.381],
+        'year': [1900, 1928, 1940, 1950, 1974, 1992, 2007, 2016, 2019, 2021, 2021],
+    },
+    'discrete': {
+        'explicit': {'0': 0.956, '1': 0.044},
+        'key': {'0': 0.127, '1': 0.095, '2': 0.110, '3': 0.035, '4': 0.077, '5': 0.089,
+                '6': 0.062, '7': 0.126, '8': 0.064, '9': 0.107, '10': 0.067, '11': 0.067},
+        'mode': {'0': 0.341, '1': 0.659},
+        'time_signature': {'0': 0.001, '1': 0.011, '3': 0.109, '4': 0.860, '5': 0.019},
+    },
+    # Spearman correlations off the diagonal; pairs not listed are ~0
+    'spearman': {
+        ('popularity', 'year'): 0.59, ('popularity', 'loudness'): 0.33,
+        ('popularity', 'energy'): 0.30, ('popularity', 'acousticness'): -0.37,
+        ('popularity', 'explicit'): 0.21, ('popularity', 'danceability'): 0.19,
+        ('popularity', 'instrumentalness'): -0.24, ('popularity', 'duration_ms'): 0.06,
+        ('energy', 'loudness'): 0.76, ('energy', 'acousticness'): -0.72,
+        ('energy', 'valence'): 0.37, ('energy', 'danceability'): 0.24,
+        ('energy', 'year'): 0.45, ('loudness', 'acousticness'): -0.52,
+        ('loudness', 'year'): 0.45, ('loudness', 'danceability'): 0.25,
+        ('loudness', 'instrumentalness'): -0.30, ('acousticness', 'year'): -0.50,
+        ('danceability', 'valence'): 0.53, ('danceability', 'year'): 0.21,
+        ('danceability', 'acousticness'): -0.18, ('speechiness', 'explicit'): 0.25,
+        ('speechiness', 'danceability'): 0.15, ('explicit', 'year'): 0.18,
+        ('explicit', 'danceability'): 0.15, ('liveness', 'speechiness'): 0.12,
+        ('valence', 'year'): -0.08, ('tempo', 'energy'): 0.22, ('tempo', 'loudness'): 0.19,
+        ('duration_ms', 'year'): 0.10, ('mode', 'key'): -0.14,
+        ('time_signature', 'energy'): 0.17, ('time_signature', 'danceability'): 0.17,
+    },
+    # Share of release_date values that are year-only / year-month / full date
+    'date_precision': {'year': 0.23, 'month': 0.005, 'day': 0.765},
+    'artists_per_track': {'1': 0.85, '2': 0.10, '3': 0.05},
+    'tracks_per_artist': 6.0,
+}
+
+#%%
+# Profiles
+
+
+def fit_profile(tracks):
+    """Build a generator profile from a real tracks frame (as read from tracks.csv)."""
+    tracks = tracks.dropna()
+    year = pd.to_numeric(tracks['release_date'].astype(str).str[:4], errors='coerce')
+    numeric = tracks.assign(year=year, explicit=tracks['explicit'].astype(int)).dropna(subset=['year'])
+
+    profile = {'quantiles': {}, 'discrete': {}, 'spearman': {}}
+    for col in COPULA_COLUMNS:
+        if col in DEFAULT_PROFILE['discrete']:
+            freqs = numeric[col].astype(int).value_counts(normalize=True).sort_index()
+            profile['discrete'][col] = {str(k): float(v) for k, v in freqs.items()}
+        else:
+            profile['quantiles'][col] = [float(v) for v in numeric[col].quantile(QUANTILE_PROBS)]
+
+    corr = numeric[COPULA_COLUMNS].corr(method='spearman').fillna(0.0)
+    for i, a in enumerate(COPULA_COLUMNS):
+        for b in COPULA_COLUMNS[i + 1:]:
+            profile['spearman'][(a, b)] = float(corr.loc[a, b])
+
+    length = tracks['release_date'].astype(str).str.len()
+    profile['date_precision'] = {'year': float((length == 4).mean()),
+                                 'month': float((length == 7).mean()),
+                                 'day': float((length == 10).mean())}
+    n_artists = tracks['id_artists'].astype(str).str.count(',') + 1
+    freqs = n_artists.clip(upper=3).value_counts(normalize=True).sort_index()
+    profile['artists_per_track'] = {str(k): float(v) for k, v in freqs.items()}
+    distinct = tracks['id_artists'].astype(str).str.strip("[]").str.split(', ').explode().nunique()
+    profile['tracks_per_artist'] = float(len(tracks) / max(distinct, 1))
+    return profile
+
+
+def save_profile(profile, path):
+    out = dict(profile, spearman=[[a, b, r] for (a, b), r in profile['spearman'].items()])
+    with open(path, 'w') as f:
+        json.dump(out, f, indent=1)
+
+
+def load_profile(path):
+    with open(path) as f:
+        profile = json.load(f)
+    profile['spearman'] = {(a, b): r for a, b, r in profile['spearman']}
+    return profile
+
+
+def marginal(profile, col, u):
+    """Values of `col` at copula uniforms `u` (its quantile function)."""
+    if col in profile['discrete']:
+        freqs = profile['discrete'][col]
+        values = np.array([int(k) for k in freqs])
+        cum = np.cumsum(list(freqs.values()))
+        return values[np.minimum(np.searchsorted(cum / cum[-1], u, side='right'), len(values) - 1)]
+    vals = np.interp(u, QUANTILE_PROBS, profile['quantiles'][col])
+    digits = ROUNDING.get(col, 4)
+    return np.round(vals, digits).astype(int) if digits == 0 else np.round(vals, digits)
+
+
+def _rank_score(profile, col):
+    """Mid-rank in [0, 1] of the value of `col`, per cell of a uniform grid over u."""
+    values = marginal(profile, col, (np.arange(SCORE_GRID) + 0.5) / SCORE_GRID)
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    return ((np.cumsum(counts) - counts / 2) / SCORE_GRID)[inverse]
+
+
+def _latent_r(score_a, score_b, rho, z, w):
+    """Latent normal correlation whose transformed pair has Spearman `rho`."""
+    from scipy.optimize import brentq
+
+    cell_a = np.minimum((ndtr(z) * SCORE_GRID).astype(np.intp), SCORE_GRID - 1)
+    a = score_a[cell_a]
+
+    def gap(r):
+        u = ndtr(r * z + np.sqrt(1 - r * r) * w)
+        b = score_b[np.minimum((u * SCORE_GRID).astype(np.intp), SCORE_GRID - 1)]
+        return np.corrcoef(a, b)[0, 1] - rho
+
+    lo, hi = -0.999, 0.999
+    # Ties cap the attainable rank correlation: take the closest end
+    if gap(hi) <= 0:
+        return hi
+    if gap(lo) >= 0:
+        return lo
+    return brentq(gap, lo, hi, xtol=1e-4)
+
+
+def copula_correlation(profile, seed=0):
+    """Pearson correlation of the latent normals, repaired to be positive definite."""
+    index = {col: i for i, col in enumerate(COPULA_COLUMNS)}
+    scores = {col: _rank_score(profile, col) for col in COPULA_COLUMNS}
+    z, w = np.random.default_rng(seed).standard_normal((2, CALIBRATION_ROWS))
+    corr = np.eye(len(COPULA_COLUMNS))
+    for (a, b), rho in profile['spearman'].items():
+        if rho == 0:
+            continue
+        r = _latent_r(scores[a], scores[b], rho, z, w)
+        corr[index[a], index[b]] = corr[index[b], index[a]] = r
+
+    # Clip negative eigenvalues and rescale back to a unit diagonal
+    vals, vecs = np.linalg.eigh(corr)
+    corr = (vecs * np.clip(vals, 1e-6, None)) @ vecs.T
+    d = np.sqrt(np.diag(corr))
+    return corr / np.outer(d, d)
+
+
+def spearman_gaps(tracks, profile=None):
+    """
+    Spearman correlation of every profile pair in a generated (or real)
+    tracks frame next to the profile's, largest absolute gap first.
+    """
+    profile = profile or DEFAULT_PROFILE
+    year = pd.to_numeric(tracks['release_date'].astype(str).str[:4], errors='coerce')
+    numeric = tracks.assign(year=year, explicit=tracks['explicit'].astype(int))
+    corr = numeric[COPULA_COLUMNS].corr(method='spearman')
+    gaps = pd.DataFrame([{'a': a, 'b': b, 'profile': rho, 'actual': corr.loc[a, b]}
+                         for (a, b), rho in profile['spearman'].items()])
+    gaps['gap'] = gaps['actual'] - gaps['profile']
+    return gaps.reindex(gaps['gap'].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+#%%
+# Chunk generation
+
+
+def _base62(values, width):
+    """Fixed-width base62 strings for an array of non-negative integers."""
+    values = np.asarray(values, dtype=np.uint64).copy()
+    digits = np.empty((len(values), width), dtype='<U1')
+    for pos in range(width - 1, -1, -1):
+        digits[:, pos] = BASE62[(values % np.uint64(62)).astype(np.intp)]
+        values //= np.uint64(62)
+    return digits.view(f'<U{width}').ravel()
+
+
+def _mix64(values):
+    """splitmix64 finaliser, used to scatter artist indexes into ids."""
+    with np.errstate(over='ignore'):
+        z = np.asarray(values, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _list_column(parts, counts):
+    """Format up to three string arrays as a stringified python list like tracks.csv."""
+    out = "['" + pd.Series(parts[0])
+    for i in range(1, len(parts)):
+        extra = np.where(counts > i, "', '" + pd.Series(parts[i]), '')
+        out = out + extra
+    return (out + "']").to_numpy()
+
+
+def generate_chunk(n, start, seed, profile=None, total_rows=None, corr=None):
+    """
+    Generate rows [start, start + n) of a synthetic tracks.csv as a DataFrame;
+    `corr` is the profile's `copula_correlation`, computed when not given.
+    """
+    profile = profile or DEFAULT_PROFILE
+    total_rows = total_rows or start + n
+    rng = np.random.default_rng(seed)
+
+    chol = np.linalg.cholesky(copula_correlation(profile) if corr is None else corr)
+    u = ndtr(rng.standard_normal((n, len(COPULA_COLUMNS))) @ chol.T)
+    cols = {col: marginal(profile, col, u[:, j]) for j, col in enumerate(COPULA_COLUMNS)}
+
+    # ids: random prefix + scrambled row number (mix64 is a bijection and 62**11 > 2**64),
+    # so ids are unique across chunks
+    row = np.arange(start, start + n, dtype=np.uint64)
+    prefix = _base62(rng.integers(0, 2**63, n, dtype=np.uint64), 11)
+    ids = np.char.add(prefix, _base62(_mix64(row), 11))
+
+    words = NAME_WORDS[rng.integers(0, len(NAME_WORDS), (n, 2))]
+    names = np.char.add(np.char.add(words[:, 0], ' '), words[:, 1])
+
+    # Zipf-like artist popularity over a pool sized from the profile
+    n_pool = max(int(total_rows / profile['tracks_per_artist']), 1)
+    per_track = profile['artists_per_track']
+    counts = np.array([int(k) for k in per_track])[
+        np.searchsorted(np.cumsum(list(per_track.values())), rng.random(n), side='right').clip(0, len(per_track) - 1)]
+    artist_ix = (n_pool * rng.random((n, 3)) ** 2).astype(np.uint64)
+    artist_names = [np.char.add('Artist ', _base62(artist_ix[:, i], 6)) for i in range(3)]
+    artist_ids = [np.char.add(_base62(_mix64(artist_ix[:, i]), 11),
+                              _base62(_mix64(artist_ix[:, i] ^ np.uint64(0x5555555555555555)), 11))
+                  for i in range(3)]
+
+    # release_date with mixed precision
+    precision = profile['date_precision']
+    p = rng.random(n)
+    year = pd.Series(cols.pop('year')).astype(str)
+    month = pd.Series(rng.integers(1, 13, n)).astype(str).str.zfill(2)
+    day = pd.Series(rng.integers(1, 29, n)).astype(str).str.zfill(2)
+    release = np.where(p < precision['year'], year,
+                       np.where(p < precision['year'] + precision['month'],
+                                year + '-' + month, year + '-' + month + '-' + day))
+
+    out = pd.DataFrame({
+        'id': ids,
+        'name': names,
+        'popularity': cols['popularity'],
+        'duration_ms': cols['duration_ms'],
+        'explicit': cols['explicit'],
+        'artists': _list_column(artist_names, counts),
+        'id_artists': _list_column(artist_ids, counts),
+        'release_date': release,
+    })
+    for col in TRACKS_COLUMNS[8:]:
+        out[col] = cols[col]
+    return out
+
+
+def _write_chunk(args):
+    path, n, start, seed, profile, total_rows, fmt, corr = args
+    chunk = generate_chunk(n, start, seed, profile, total_rows, corr)
+    if fmt == 'csv':
+        chunk.to_csv(path, index=False, header=(start == 0))
+    else:
+        chunk.to_parquet(path, index=False)
+    return path
+
+#%%
+# Writers
+
+
+def generate(rows, out, fmt='csv', workers=None, chunk_rows=1_000_000, seed=0, profile=None):
+    """
+    Write `rows` synthetic tracks to `out`, generating chunks in parallel.
+
+    CSV output is a single file (chunk parts are concatenated in order); parquet
+    output is a directory of part files readable with `pd.read_parquet(out)`.
+    The result only depends on `seed` and `chunk_rows`, never on `workers`.
+    """
+    if fmt not in ('csv', 'parquet'):
+        raise ValueError(f"Unknown format: {fmt}")
+    profile = profile or DEFAULT_PROFILE
+    workers = workers or os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn((rows + chunk_rows - 1) // chunk_rows)
+    # Calibrated once, not per chunk
+    corr = copula_correlation(profile)
+
+    if fmt == 'parquet':
+        os.makedirs(out, exist_ok=True)
+        part_dir = out
+    else:
+        part_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out)))
+
+    tasks = []
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        path = os.path.join(part_dir, f'part-{i:05d}.{fmt}')
+        tasks.append((path, min(chunk_rows, rows - start), start, seeds[i], profile, rows, fmt, corr))
+
+    try:
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(_write_chunk, tasks))
+        else:
+            parts = [_write_chunk(t) for t in tasks]
+
+        if fmt == 'csv':
+            with open(out, 'wb') as dst:
+                for part in parts:
+                    with open(part, 'rb') as src:
+                        shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+    finally:
+        if fmt == 'csv':
+            shutil.rmtree(part_dir, ignore_errors=True)
+    return out
+
+
+#%%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic tracks.csv')
+    parser.add_argument('--rows', type=int, default=600_000)
+    parser.add_argument('--out', default='tracks.csv')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', default=None, help='JSON profile written by save_profile')
+    args = parser.parse_args()
+
+    profile = load_profile(args.profile) if args.profile else None
+    generate(args.rows, args.out, args.format, args.workers, args.chunk_rows, args.seed, profile)
@@ -0,0 +1,156 @@
+#%%[markdown]
+## Out-of-fold artist target encoding
+#
+# `artists` never reaches the models: it is a stringified list with one value
+# per artist combination. `ArtistTargetEncoder` turns it into two numeric
+# features per track:
+#
+# * `artist_popularity`: the smoothed share of popular tracks of its artists,
+#   (popular + m * prior) / (tracks + m), averaged over the track's artists;
+# * `artist_tracks`: log1p of the track count of its most prolific artist
+#   (not counting the track itself).
+#
+# Artists are integer codes and every track/artist pair is one entry of a
+# flat array, so the per-artist sums are one `np.bincount` and the per-track
+# mean/max are segment reductions over the entries. `fit_transform` encodes
+# the training rows out of fold: a row in fold f only sees the targets of the
+# other folds, so the model never trains on its own label. `transform` (the
+# test rows, new releases) uses every training row. Unseen artists get the
+# prior.
+#
+#   python tracks_cli.py train --data tracks_clean.parquet --models logistic knn rf --artists
+#
+# `tracks_pipeline.train_model(..., artists=True)` fits the encoder on the
+# train split only and saves it in front of the model, so scoring raw tracks
+# needs nothing else.
+
+#%%
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+ARTIST_FEATURES = ['artist_popularity', 'artist_tracks']
+
+# A quoted item of a list string; Python writes items containing ' in double quotes
+LIST_ITEM = r"""'[^']*'|"[^"]*\""""
+
+
+def artist_entries(artists):
+    """(track position, artist) per entry of the "['a', "b's"]" strings, in track order."""
+    s = pd.Series(np.asarray(artists, dtype=object), dtype='string').fillna('')
+    entries = s.str.findall(LIST_ITEM).explode().str[1:-1]
+    keep = (entries.str.len() > 0).fillna(False).to_numpy(dtype=bool)
+    return entries.index.to_numpy()[keep], entries.to_numpy(dtype=object)[keep]
+
+
+def _track_mean(pos, values, n, default):
+    """Mean of `values` per track (segment mean over the entries); `default` without entries."""
+    total = np.bincount(pos, weights=values, minlength=n)
+    count = np.bincount(pos, minlength=n)
+    return np.divide(total, count, out=np.full(n, default, dtype=np.float64), where=count > 0)
+
+
+def _track_max(pos, values, n):
+    out = np.zeros(n)
+    np.maximum.at(out, pos, values)
+    return out
+
+
+class ArtistTargetEncoder:
+    """
+    Replaces the `column` artists list with ARTIST_FEATURES. `smoothing` is the
+    weight m of the prior; `n_folds` the folds of the out-of-fold encoding.
+    """
+
+    def __init__(self, column='id_artists', smoothing=20.0, n_folds=5, random_state=0):
+        self.column = column
+        self.smoothing = smoothing
+        self.n_folds = n_folds
+        self.random_state = random_state
+
+    def _codes(self, x, fit=False):
+        pos, names = artist_entries(x[self.column])
+        if fit:
+            codes, uniques = pd.factorize(names)
+            self.artists_ = pd.Index(uniques)
+        else:
+            codes = self.artists_.get_indexer(names)
+        return pos, codes
+
+    def fit(self, x, y):
+        self._fit(x, y)
+        return self
+
+    def _fit(self, x, y):
+        y = np.asarray(y, dtype=np.float64).ravel()
+        pos, codes = self._codes(x, fit=True)
+        n_artists = len(self.artists_)
+        self.prior_ = float(y.mean())
+        self.positives_ = np.bincount(codes, weights=y[pos], minlength=n_artists)
+        self.counts_ = np.bincount(codes, minlength=n_artists).astype(np.float64)
+        return y, pos, codes
+
+    def _encode(self, positives, counts, prior):
+        m = self.smoothing
+        return (positives + m * prior) / (counts + m)
+
+    def fit_transform(self, x, y, groups=None):
+        """
+        Encode the training rows out of fold (and fit on all of them for
+        `transform`). With `groups` (tracks_dedup's `dup_group`) near-duplicate
+        tracks share a fold, so none is encoded with its twin's label.
+        """
+        n = len(x)
+        with stage('artist_encode_oof', rows_in=n) as s:
+            y, pos, codes = self._fit(x, y)
+            n_artists, k = len(self.artists_), self.n_folds
+            if groups is None:
+                fold = np.random.default_rng(self.random_state).permutation(n) % k
+            else:
+                from tracks_dedup import group_folds
+
+                fold = group_folds(y, groups, k, self.random_state)
+            entry_fold = fold[pos]
+            # (fold, artist) sums in one bincount; out of fold = total - own fold
+            key = entry_fold * n_artists + codes
+            fold_pos = np.bincount(key, weights=y[pos], minlength=k * n_artists).reshape(k, n_artists)
+            fold_cnt = np.bincount(key, minlength=k * n_artists).reshape(k, n_artists)
+            fold_y = np.bincount(fold, weights=y, minlength=k)
+            fold_n = np.bincount(fold, minlength=k)
+            prior = (y.sum() - fold_y) / np.maximum(n - fold_n, 1)
+
+            enc = self._encode(self.positives_[codes] - fold_pos[entry_fold, codes],
+                               self.counts_[codes] - fold_cnt[entry_fold, codes], prior[entry_fold])
+            out = self._frame(x, _track_mean(pos, enc, n, default=np.nan),
+                              _track_max(pos, np.log1p(self.counts_[codes] - 1), n))
+            # Tracks without artists: their fold's prior
+            missing = out['artist_popularity'].isna().to_numpy()
+            out.loc[missing, 'artist_popularity'] = prior[fold[missing]]
+            s.rows_out = len(out)
+        return out
+
+    def transform(self, x):
+        n = len(x)
+        with stage('artist_encode', rows_in=n):
+            pos, codes = self._codes(x)
+            seen = codes >= 0
+            positives = np.where(seen, self.positives_[codes], 0.0)
+            counts = np.where(seen, self.counts_[codes], 0.0)
+            return self._frame(x, _track_mean(pos, self._encode(positives, counts, self.prior_), n,
+                                              default=self.prior_),
+                               _track_max(pos, np.log1p(counts), n))
+
+    def _frame(self, x, popularity, tracks):
+        out = x.drop(columns=[self.column])
+        out['artist_popularity'] = popularity
+        out['artist_tracks'] = tracks
+        return out
+
+    def get_params(self, deep=True):
+        return {k: getattr(self, k) for k in ('column', 'smoothing', 'n_folds', 'random_state')}
+
+    def set_params(self, **params):
+        for k, v in params.items():
+            setattr(self, k, v)
+        return self
@@ -0,0 +1,162 @@
+#%%[markdown]
+## Top-k queries for the "popular songs" EDA slices
+#
+# The EDA cells filter `popularity > 90` and then sort the slice twice just to
+# show `head(10)` (and the second quicksort does not keep the first order on
+# ties). `TopK` sorts every numeric column once up front; afterwards
+#
+#   top = TopK(spotify)
+#   top.top('danceability', 10, where=[('popularity', '>', 90)],
+#           ties=[('popularity', False)], columns=['name', 'artists', 'popularity', 'danceability'])
+#
+# * turns range predicates into row sets with a binary search on the sorted
+#   column (no scan of the frame),
+# * picks the k best rows by walking the sorted index of `by` when most rows
+#   qualify, or by `np.argpartition` over the qualifying rows otherwise,
+# * orders ties by the `ties` columns, then by row position, so a query always
+#   returns the same rows.
+#
+# NaNs never rank.
+
+#%%
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+OPS = ('>', '>=', '<', '<=', '==', 'between')
+
+# Walk the sorted index when at least this fraction of rows qualifies
+WALK_FRACTION = 0.05
+
+
+class TopK:
+
+    def __init__(self, frame, columns=None):
+        self.frame = frame
+        columns = columns or [c for c in frame.columns if pd.api.types.is_numeric_dtype(frame[c])
+                              and not pd.api.types.is_bool_dtype(frame[c])]
+        self.values, self.order, self.sorted, self.n_valid = {}, {}, {}, {}
+        with stage('topk_index', rows_in=len(frame)):
+            for col in columns:
+                values = frame[col].to_numpy(dtype=np.float64, na_value=np.nan)
+                order = np.argsort(values, kind='stable')  # NaNs last
+                self.values[col] = values
+                self.order[col] = order
+                self.sorted[col] = values[order]
+                self.n_valid[col] = int(len(values) - np.isnan(values).sum())
+
+    def __len__(self):
+        return len(self.frame)
+
+    # Predicates
+
+    def rows(self, column, op, value):
+        """Positions where `column op value` holds, from a binary search on the sorted column."""
+        s, n = self.sorted[column], self.n_valid[column]
+        if op == '>':
+            lo, hi = np.searchsorted(s[:n], value, 'right'), n
+        elif op == '>=':
+            lo, hi = np.searchsorted(s[:n], value, 'left'), n
+        elif op == '<':
+            lo, hi = 0, np.searchsorted(s[:n], value, 'left')
+        elif op == '<=':
+            lo, hi = 0, np.searchsorted(s[:n], value, 'right')
+        elif op == '==':
+            lo, hi = np.searchsorted(s[:n], value, 'left'), np.searchsorted(s[:n], value, 'right')
+        elif op == 'between':
+            lo, hi = np.searchsorted(s[:n], value[0], 'left'), np.searchsorted(s[:n], value[1], 'right')
+        else:
+            raise ValueError(f"Unknown operator {op!r}; use one of {OPS}")
+        return self.order[column][lo:hi]
+
+    def mask(self, where):
+        """
+        Boolean row mask for `where`: None (all rows), a boolean array/Series,
+        a tracks_index.Selection, or a list of (column, op, value) predicates
+        combined with AND (an empty list is all rows, like None).
+        """
+        if where is None or (isinstance(where, list) and not where):
+            return None
+        if hasattr(where, 'positions'):
+            return where.mask()
+        if not isinstance(where, list):
+            return np.asarray(where, dtype=bool)
+        sets = sorted((self.rows(*p) for p in where), key=len)
+        mask = np.zeros(len(self), dtype=bool)
+        mask[sets[0]] = True
+        for rows in sets[1:]:
+            keep = np.zeros(len(self), dtype=bool)
+            keep[rows] = True
+            mask &= keep
+        return mask
+
+    # Queries
+
+    def top(self, by, k=10, where=None, ascending=False, ties=(), columns=None):
+        """
+        The k rows with the largest (or smallest) `by` among the rows matching
+        `where`. `ties` is a list of (column, ascending) tie breakers; row
+        position breaks any tie left.
+        """
+        with stage('topk_query', rows_in=len(self)) as s:
+            mask = self.mask(where)
+            n_match = len(self) if mask is None else int(mask.sum())
+            if n_match >= WALK_FRACTION * len(self):
+                cand = self._walk(by, k, mask, ascending)
+            else:
+                cand = self._partition(by, k, mask, ascending)
+            pos = self._order(cand, by, ascending, ties)[:k]
+            s.rows_out = len(pos)
+        out = self.frame.iloc[pos]
+        return out if columns is None else out[columns]
+
+    def bottom(self, by, k=10, where=None, ties=(), columns=None):
+        return self.top(by, k, where, ascending=True, ties=ties, columns=columns)
+
+    def _walk(self, by, k, mask, ascending):
+        """The first k matching rows along the sorted index of `by`."""
+        order, n = self.order[by], self.n_valid[by]
+        order = order[:n] if ascending else order[:n][::-1]
+        found, n_found, start, block = [], 0, 0, max(4 * k, 1024)
+        while start < n and n_found < k:
+            chunk = order[start:start + block]
+            found.append(chunk if mask is None else chunk[mask[chunk]])
+            n_found += len(found[-1])
+            start += block
+            block *= 4
+        cand = np.concatenate(found)[:k] if found else np.empty(0, dtype=np.intp)
+        return self._with_ties(by, k, cand, mask, ascending)
+
+    def _partition(self, by, k, mask, ascending):
+        """k best matching rows by argpartition over the matching rows only."""
+        rows = np.flatnonzero(mask)
+        values = self.values[by][rows]
+        rows, values = rows[~np.isnan(values)], values[~np.isnan(values)]
+        if len(rows) > k:
+            rows = rows[np.argpartition(values if ascending else -values, k - 1)[:k]]
+        return self._with_ties(by, k, rows, mask, ascending)
+
+    def _with_ties(self, by, k, cand, mask, ascending):
+        """
+        `cand` holds k best rows, but which of several rows tied on the k-th
+        value made it in is arbitrary: swap in every matching row tied with it.
+        """
+        if len(cand) < k or k == 0:
+            return cand
+        values = self.values[by][cand]
+        kth = values.max() if ascending else values.min()
+        better = cand[values < kth] if ascending else cand[values > kth]
+        tied = self.rows(by, '==', kth)
+        if mask is not None:
+            tied = tied[mask[tied]]
+        return np.concatenate([better, tied])
+
+    def _order(self, cand, by, ascending, ties):
+        keys = [cand]  # last resort: row position
+        for col, asc in reversed(list(ties)):
+            v = self.values[col][cand]
+            keys.append(v if asc else -v)
+        v = self.values[by][cand]
+        keys.append(v if ascending else -v)
+        return cand[np.lexsort(keys)]
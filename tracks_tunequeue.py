@@ -0,0 +1,397 @@
+#%%[markdown]
+## Distributed RF tuning over a shared work queue
+#
+# The full RF `param_grid` (5 x 3 x 8 x 3 x 2 x 2 combinations, 5-fold) is
+# split into one trial per parameter combination. Trials live in a queue that
+# any number of worker processes, on one host or many, pull from:
+#
+# * `SqliteQueue` - one SQLite file; claims run in `BEGIN IMMEDIATE`
+#   transactions so two workers never get the same trial. Best on local disk
+#   (SQLite locking over NFS is not reliable).
+# * `DirQueue` - a directory on a shared filesystem; a trial is claimed by
+#   atomically renaming its spec file from `pending/` to `running/`; spec
+#   files are named by a hash of the trial's parameters.
+#
+# Workers heartbeat while they train; the coordinator puts trials whose lease
+# expired (crashed or killed worker) back to pending, so a study resumes where
+# it stopped. A trial whose lease expired on each of its `max_attempts` claims
+# (one that kills its worker every time, e.g. out of memory) is marked failed
+# instead. No broker is needed.
+#
+# The study config carries a `study` key, a hash of the config, the trial
+# specs and the contents of the files the trials read. Re-running `init` with
+# the same inputs keeps the finished trials (resume); with other data, models
+# or grid it clears the old trials first.
+#
+#   python tracks_cli.py queue init   --queue tune.sqlite --data tracks_clean.parquet
+#   python tracks_cli.py queue local  --queue tune.sqlite --workers 4
+#   python tracks_cli.py queue worker --queue /shared/tune_dir     # on other hosts
+#   python tracks_cli.py queue status --queue tune.sqlite
+
+#%%
+import functools
+import hashlib
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+LEASE_S = 600
+MAX_ATTEMPTS = 3
+
+
+def trial_specs(param_grid, n_iter=None, seed=0):
+    """Every grid combination, or `n_iter` of them sampled without replacement."""
+    keys = sorted(param_grid)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+    if n_iter is not None and n_iter < len(combos):
+        pick = np.random.default_rng(seed).choice(len(combos), n_iter, replace=False)
+        combos = [combos[i] for i in sorted(pick)]
+    return combos
+
+
+def params_id(spec):
+    """Stable 63-bit trial id from the trial's parameters."""
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+    return int(digest[:16], 16) >> 1
+
+
+def study_key(config, specs, paths=()):
+    """Digest of the study config, its trial specs and the contents of `paths`."""
+    h = hashlib.sha256(json.dumps([config, specs], sort_keys=True).encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(functools.partial(f.read, 1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+#%%
+# Queue backends
+
+
+class SqliteQueue:
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS study (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS trials (
+                id INTEGER PRIMARY KEY, params TEXT UNIQUE, status TEXT DEFAULT 'pending',
+                worker TEXT, heartbeat REAL, attempts INTEGER DEFAULT 0,
+                result TEXT, error TEXT);
+            CREATE INDEX IF NOT EXISTS trials_status ON trials (status);
+        ''')
+
+    def init(self, config, specs):
+        """Store the study; returns True when the trials of another study were cleared."""
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute("SELECT value FROM study WHERE key = 'config'").fetchone()
+            reset = row is not None and json.loads(row[0]).get('study') != config.get('study')
+            # New ids continue after the old ones, so a late `finish` from a
+            # worker of the old study cannot land on a new trial
+            first = self.conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM trials').fetchone()[0]
+            if reset:
+                self.conn.execute('DELETE FROM trials')
+            self.conn.execute('INSERT OR REPLACE INTO study VALUES (?, ?)', ('config', json.dumps(config)))
+            known = {r[0] for r in self.conn.execute('SELECT params FROM trials')}
+            params = [p for p in dict.fromkeys(json.dumps(s, sort_keys=True) for s in specs) if p not in known]
+            self.conn.executemany('INSERT INTO trials (id, params) VALUES (?, ?)',
+                                  enumerate(params, start=first))
+        return reset
+
+    def config(self):
+        row = self.conn.execute("SELECT value FROM study WHERE key = 'config'").fetchone()
+        return json.loads(row[0])
+
+    def claim(self, worker):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute("SELECT id, params FROM trials WHERE status = 'pending' "
+                                    "ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE trials SET status = 'running', worker = ?, heartbeat = ?, "
+                              "attempts = attempts + 1 WHERE id = ?", (worker, time.time(), row[0]))
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, trial_id):
+        self.conn.execute('UPDATE trials SET heartbeat = ? WHERE id = ?', (time.time(), trial_id))
+
+    def finish(self, trial_id, result=None, error=None):
+        self.conn.execute('UPDATE trials SET status = ?, result = ?, error = ?, heartbeat = ? WHERE id = ?',
+                          ('failed' if error else 'done', json.dumps(result), error, time.time(), trial_id))
+
+    def requeue_stale(self, lease=LEASE_S, max_attempts=None):
+        """Put expired running trials back to pending, or to failed once they used `max_attempts`."""
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            expired = time.time() - lease
+            if max_attempts is not None:
+                self.conn.execute("UPDATE trials SET status = 'failed', worker = NULL, error = ? "
+                                  "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+                                  (f'lease expired on all {max_attempts} attempts', expired, max_attempts))
+            cur = self.conn.execute("UPDATE trials SET status = 'pending', worker = NULL "
+                                    "WHERE status = 'running' AND heartbeat < ?", (expired,))
+        return cur.rowcount
+
+    def retry_failed(self, max_attempts, delay=0):
+        cur = self.conn.execute("UPDATE trials SET status = 'pending', worker = NULL, error = NULL "
+                                "WHERE status = 'failed' AND attempts < ? AND heartbeat < ?",
+                                (max_attempts, time.time() - delay))
+        return cur.rowcount
+
+    def trials(self):
+        return pd.read_sql_query('SELECT id, params, status, worker, attempts, result, error FROM trials',
+                                 self.conn)
+
+
+class DirQueue:
+
+    def __init__(self, path):
+        self.path = path
+        for sub in ('pending', 'running', 'done', 'failed'):
+            os.makedirs(os.path.join(path, sub), exist_ok=True)
+
+    def _write(self, path, obj):
+        tmp = f'{path}.{worker_name()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp, path)
+
+    def init(self, config, specs):
+        """Store the study; returns True when the trials of another study were cleared."""
+        study = os.path.join(self.path, 'study.json')
+        reset = os.path.exists(study) and self.config().get('study') != config.get('study')
+        if reset:
+            for sub in ('pending', 'running', 'done', 'failed'):
+                for name in os.listdir(os.path.join(self.path, sub)):
+                    os.remove(os.path.join(self.path, sub, name))
+        self._write(study, config)
+        known = {f for sub in ('pending', 'running', 'done', 'failed')
+                 for f in os.listdir(os.path.join(self.path, sub))}
+        for spec in specs:
+            name = self._name(params_id(spec))
+            if name not in known:
+                self._write(os.path.join(self.path, 'pending', name), {'params': spec, 'attempts': 0})
+        return reset
+
+    @staticmethod
+    def _name(trial_id):
+        return f'{trial_id:016x}.json'
+
+    def config(self):
+        with open(os.path.join(self.path, 'study.json')) as f:
+            return json.load(f)
+
+    def claim(self, worker):
+        for name in sorted(os.listdir(os.path.join(self.path, 'pending'))):
+            if not name.endswith('.json'):
+                continue
+            src = os.path.join(self.path, 'pending', name)
+            dst = os.path.join(self.path, 'running', name)
+            try:
+                os.rename(src, dst)  # atomic: exactly one worker wins
+            except FileNotFoundError:
+                continue
+            os.utime(dst)
+            with open(dst) as f:
+                spec = json.load(f)
+            spec.update(worker=worker, attempts=spec['attempts'] + 1)
+            self._write(dst, spec)
+            return int(name[:-5], 16), spec['params']
+        return None
+
+    def heartbeat(self, trial_id):
+        try:
+            os.utime(os.path.join(self.path, 'running', self._name(trial_id)))
+        except FileNotFoundError:
+            pass
+
+    def finish(self, trial_id, result=None, error=None):
+        name = self._name(trial_id)
+        src = os.path.join(self.path, 'running', name)
+        if not os.path.exists(src):
+            # Lease expired and the trial was requeued meanwhile: take it back
+            src = os.path.join(self.path, 'pending', name)
+            try:
+                os.rename(src, src + '.finishing')
+            except FileNotFoundError:
+                return
+            src += '.finishing'
+        with open(src) as f:
+            spec = json.load(f)
+        spec.update(result=result, error=error)
+        self._write(os.path.join(self.path, 'failed' if error else 'done', name), spec)
+        os.remove(src)
+
+    def requeue_stale(self, lease=LEASE_S, max_attempts=None):
+        """Put expired running trials back to pending, or to failed once they used `max_attempts`."""
+        moved = 0
+        running = os.path.join(self.path, 'running')
+        for name in os.listdir(running):
+            path = os.path.join(running, name)
+            try:
+                if not name.endswith('.json') or os.path.getmtime(path) >= time.time() - lease:
+                    continue
+                with open(path) as f:
+                    spec = json.load(f)
+                if max_attempts is not None and spec['attempts'] >= max_attempts:
+                    failed = os.path.join(self.path, 'failed', name)
+                    os.rename(path, failed)
+                    spec.update(worker=None, error=f'lease expired on all {max_attempts} attempts')
+                    self._write(failed, spec)
+                else:
+                    os.rename(path, os.path.join(self.path, 'pending', name))
+                    moved += 1
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        return moved
+
+    def retry_failed(self, max_attempts, delay=0):
+        moved = 0
+        failed = os.path.join(self.path, 'failed')
+        for name in os.listdir(failed):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(failed, name)
+            try:
+                if os.path.getmtime(path) > time.time() - delay:
+                    continue
+                with open(path) as f:
+                    spec = json.load(f)
+            except FileNotFoundError:
+                continue
+            if spec['attempts'] < max_attempts:
+                spec.pop('error', None)
+                self._write(path, spec)
+                os.rename(path, os.path.join(self.path, 'pending', name))
+                moved += 1
+        return moved
+
+    def trials(self):
+        rows = []
+        for status in ('pending', 'running', 'done', 'failed'):
+            folder = os.path.join(self.path, status)
+            for name in sorted(os.listdir(folder)):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(folder, name)) as f:
+                        spec = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+                rows.append({'id': int(name[:-5], 16), 'params': json.dumps(spec['params'], sort_keys=True),
+                             'status': status, 'worker': spec.get('worker'), 'attempts': spec['attempts'],
+                             'result': json.dumps(spec.get('result')), 'error': spec.get('error')})
+        return pd.DataFrame(rows, columns=['id', 'params', 'status', 'worker', 'attempts', 'result', 'error'])
+
+
+def open_queue(path):
+    """`.sqlite` / `.sqlite3` / `.db` files are a SqliteQueue, anything else a DirQueue."""
+    if path.endswith(('.sqlite', '.sqlite3', '.db')):
+        return SqliteQueue(path)
+    return DirQueue(path)
+
+#%%
+# Worker and coordinator
+
+
+def evaluate_trial(params, x, y, cv):
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import cross_val_score
+
+    t0 = time.perf_counter()
+    scores = cross_val_score(RandomForestClassifier(random_state=42, **params), x, y, cv=cv)
+    return {'mean_test_score': float(scores.mean()), 'std_test_score': float(scores.std()),
+            'fit_s': time.perf_counter() - t0}
+
+
+def _keep_alive(queue_path, trial_id, stop, every):
+    # Own connection: sqlite3 connections must not be shared across threads
+    queue = open_queue(queue_path)
+    while not stop.wait(every):
+        queue.heartbeat(trial_id)
+
+
+def run_worker(queue_path, max_trials=None, heartbeat_s=30):
+    """Pull and run trials until the queue has no pending work."""
+    import tracks_pipeline as tp
+
+    queue = open_queue(queue_path)
+    config = queue.config()
+    spotifydf = tp.modeling_frame(tp.read_tracks(config['data']))
+    x_train, _, y_train, _ = tp.split(spotifydf, config['features'])
+
+    me, done = worker_name(), 0
+    while max_trials is None or done < max_trials:
+        claimed = queue.claim(me)
+        if claimed is None:
+            break
+        trial_id, params = claimed
+        stop = threading.Event()
+        beat = threading.Thread(target=_keep_alive, args=(queue_path, trial_id, stop, heartbeat_s), daemon=True)
+        beat.start()
+        try:
+            queue.finish(trial_id, result=evaluate_trial(params, x_train, y_train, config['cv']))
+        except Exception as e:  # invalid combination, e.g. oob_score without bootstrap
+            queue.finish(trial_id, error=f'{type(e).__name__}: {e}')
+        finally:
+            stop.set()
+        done += 1
+    return done
+
+
+def init_study(queue_path, data, param_grid=None, n_iter=None, cv=5, features=None, seed=0):
+    import tracks_pipeline as tp
+
+    queue = open_queue(queue_path)
+    config = {'data': os.path.abspath(data), 'cv': cv, 'features': features or tp.RF_FEATURES}
+    specs = trial_specs(param_grid or tp.RF_PARAM_GRID, n_iter, seed)
+    config['study'] = study_key(config, specs, [data])
+    queue.init(config, specs)
+    return queue
+
+
+def results(queue_path, lease=LEASE_S, max_attempts=MAX_ATTEMPTS):
+    """Requeue expired trials and return (status counts, finished trials best first)."""
+    queue = open_queue(queue_path)
+    queue.requeue_stale(lease, max_attempts)
+    trials = queue.trials()
+    counts = trials['status'].value_counts()
+    done = trials[trials['status'] == 'done']
+    table = pd.DataFrame([dict(json.loads(p), **json.loads(r)) for p, r in zip(done['params'], done['result'])])
+    if len(table):
+        table = table.sort_values('mean_test_score', ascending=False, ignore_index=True)
+    return counts, table
+
+
+def run_local(queue_path, workers, lease=LEASE_S, max_attempts=MAX_ATTEMPTS, poll_s=5):
+    """Coordinator: start local worker processes and restart them until the queue drains."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracks_cli.py')
+    argv = [sys.executable, script, 'queue', 'worker', '--queue', queue_path]
+    procs = [subprocess.Popen(argv) for _ in range(workers)]
+    while True:
+        time.sleep(poll_s)
+        counts, _ = results(queue_path, lease, max_attempts)
+        pending, running = counts.get('pending', 0), counts.get('running', 0)
+        alive = [p for p in procs if p.poll() is None]
+        if not pending and not running and not alive:
+            break
+        # Replace workers that exited while work (e.g. requeued trials) remains
+        procs = alive + [subprocess.Popen(argv) for _ in range(min(workers - len(alive), pending))]
+    return results(queue_path, lease, max_attempts)
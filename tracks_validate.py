@@ -0,0 +1,155 @@
+#%%[markdown]
+## Validation against the documented feature ranges
+#
+# The variable descriptions at the top of `Team6_Tracks.py` give hard ranges
+# (0-1 for the audio confidences, `key` in -1..11, `mode` in {0, 1},
+# popularity 0..100, loudness "typically" -60..0 dB). The cleaning cells only
+# `dropna`. `validate` checks every rule as a vectorized mask over the column
+# arrays and packs the result into one uint32 bitmask per row (bit i = RULES[i]),
+# so a row's full list of problems costs four bytes.
+#
+# Soft rules (`strict=False`, e.g. loudness: real tracks reach +5 dB) are
+# counted but do not quarantine. A frame without one of the REQUIRED_COLUMNS
+# is refused with a SchemaError before any rule runs. Validating never copies
+# the frame: the result holds the bitmask and the quarantined positions,
+# `keep` is the boolean mask of the rows to keep, and `valid` / `quarantined`
+# copy out those rows only when asked.
+#
+#   python tracks_cli.py ingest --csv tracks.csv --quarantine bad_rows.csv
+#   python tracks_cli.py ingest --csv tracks.csv --chunksize 100000
+
+#%%
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+Rule = namedtuple('Rule', 'name column low high values strict')
+
+
+def _range(column, low, high, strict=True):
+    return Rule(f'{column}_range', column, low, high, None, strict)
+
+
+def _values(column, values):
+    return Rule(f'{column}_values', column, None, None, tuple(values), True)
+
+
+REQUIRED_COLUMNS = ['id', 'name', 'popularity', 'duration_ms', 'explicit', 'artists', 'id_artists',
+                    'release_date', 'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness',
+                    'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo']
+
+RULES = [Rule('missing', None, None, None, None, True),
+         _range('popularity', 0, 100),
+         _range('duration_ms', 1, np.inf),
+         _values('explicit', (0, 1)),
+         *(_range(c, 0.0, 1.0) for c in ['danceability', 'energy', 'speechiness', 'acousticness',
+                                         'instrumentalness', 'liveness', 'valence']),
+         _values('key', range(-1, 12)),
+         _values('mode', (0, 1)),
+         _range('loudness', -60.0, 0.0, strict=False),
+         _range('tempo', 0.0, np.inf)]
+
+STRICT_BITS = np.uint32(sum(1 << i for i, r in enumerate(RULES) if r.strict))
+
+
+class SchemaError(ValueError):
+    """The frame lacks some of the REQUIRED_COLUMNS."""
+
+
+def check_schema(tracks):
+    missing = [c for c in REQUIRED_COLUMNS if c not in tracks.columns]
+    if missing:
+        raise SchemaError(f"Missing required columns: {', '.join(missing)}")
+
+
+class ValidationResult:
+
+    def __init__(self, mask, n_rows):
+        self.mask = mask
+        self.n_rows = n_rows
+        self.bad = np.flatnonzero(mask & STRICT_BITS)
+
+    def counts(self):
+        """Rows violating each rule (a row can count under several)."""
+        counts = {r.name: int(np.count_nonzero(self.mask & np.uint32(1 << i))) for i, r in enumerate(RULES)}
+        return pd.Series(counts, name='rows')
+
+    @property
+    def keep(self):
+        """Boolean mask of the rows that pass every strict rule."""
+        keep = np.ones(self.n_rows, dtype=bool)
+        keep[self.bad] = False
+        return keep
+
+    def valid(self, tracks):
+        """The rows to keep: `tracks` itself when all pass, otherwise a copy of them."""
+        if not len(self.bad):
+            return tracks
+        return tracks[self.keep]
+
+    def quarantined(self, tracks):
+        """Rejected rows with their `violations` bitmask and rule names."""
+        bad = tracks.iloc[self.bad]
+        mask = self.mask[self.bad]
+        return bad.assign(violations=mask, rules=describe(mask))
+
+
+def describe(mask):
+    """Comma-separated rule names for each bitmask value."""
+    names = {}
+    for value in np.unique(mask):
+        names[value] = ','.join(r.name for i, r in enumerate(RULES) if value & (1 << i))
+    return [names[v] for v in mask]
+
+
+def validate(tracks):
+    """Check every rule over `tracks` and return a ValidationResult; SchemaError if columns are missing."""
+    check_schema(tracks)
+    with stage('validate', rows_in=len(tracks)) as s:
+        mask = np.zeros(len(tracks), dtype=np.uint32)
+        for bit, rule in enumerate(RULES):
+            if rule.column is None:
+                violated = np.zeros(len(tracks), dtype=bool)
+                for col in REQUIRED_COLUMNS:
+                    violated |= tracks[col].isna().to_numpy()
+            else:
+                values = tracks[rule.column].to_numpy(dtype=np.float64, na_value=np.nan)
+                if rule.values is not None:
+                    violated = ~np.isin(values, rule.values) & ~np.isnan(values)
+                else:
+                    violated = (values < rule.low) | (values > rule.high)
+            mask |= violated.astype(np.uint32) << np.uint32(bit)
+        result = ValidationResult(mask, len(tracks))
+        s.rows_out = len(tracks) - len(result.bad)
+    return result
+
+
+class ChunkedValidator:
+    """
+    Validate an iterable of frames (e.g. `pd.read_csv(..., chunksize=...)`).
+
+    `run` yields the valid part of every chunk and appends rejected rows to
+    the `quarantine` CSV; `counts` holds the per-rule totals so far.
+    """
+
+    def __init__(self, quarantine=None):
+        self.quarantine = quarantine
+        self.counts = pd.Series(0, index=[r.name for r in RULES], name='rows')
+        self.rows = self.rejected = 0
+
+    def run(self, chunks):
+        if self.quarantine and os.path.exists(self.quarantine):
+            os.remove(self.quarantine)
+        for chunk in chunks:
+            result = validate(chunk)
+            self.counts += result.counts()
+            self.rows += len(chunk)
+            self.rejected += len(result.bad)
+            if self.quarantine and len(result.bad):
+                header = not os.path.exists(self.quarantine)
+                result.quarantined(chunk).to_csv(self.quarantine, mode='a', header=header, index=False)
+            yield result.valid(chunk)
@@ -0,0 +1,136 @@
+#%%[markdown]
+## Warm-start forest growth
+#
+# The tuning grid tries n_estimators = 100, 200, ..., 500 as independent fits,
+# so the first 100 trees are grown five times. With `warm_start=True` sklearn
+# keeps the fitted trees and only grows the new ones, and with a fixed
+# `random_state` the trees are the same as in a fresh fit of that size.
+#
+# `forest_curve` grows one forest block by block and records OOB and holdout
+# accuracy/AUC after every block. OOB and holdout probabilities are kept as
+# running sums, so each tree is evaluated exactly once.
+#
+# `warm_grid_search` runs the RF `param_grid` with n_estimators collapsed into
+# one warm-started fit per (other params, CV fold), scoring the held-out fold
+# at every size like GridSearchCV would.
+
+#%%
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from tracks_profile import stage
+
+
+def oob_indices(forest, tree, n_samples):
+    """
+    Rows a fitted tree of `forest` did not see in its bootstrap sample.
+
+    Replays the bootstrap draw sklearn makes from the tree's random_state
+    (unweighted fits), instead of relying on its private helpers whose
+    signatures change between releases.
+    """
+    max_samples = forest.max_samples
+    if max_samples is None:
+        n_bootstrap = n_samples
+    elif isinstance(max_samples, float):
+        n_bootstrap = max(round(n_samples * max_samples), 1)
+    else:
+        n_bootstrap = max_samples
+    drawn = np.random.RandomState(tree.random_state).randint(0, n_samples, n_bootstrap)
+    return np.flatnonzero(np.bincount(drawn, minlength=n_samples) == 0)
+
+
+def _metrics(y, prob, prefix):
+    from sklearn.metrics import roc_auc_score
+
+    ok = ~np.isnan(prob)
+    y, prob = y[ok], prob[ok]
+    auc = roc_auc_score(y, prob) if len(np.unique(y)) == 2 else np.nan
+    return {f'{prefix}_accuracy': float(np.mean((prob > 0.5) == y)), f'{prefix}_auc': auc,
+            f'{prefix}_coverage': float(ok.mean())}
+
+
+def forest_curve(x_train, y_train, x_holdout=None, y_holdout=None, sizes=(100, 200, 300, 400, 500),
+                 forest=None, **params):
+    """
+    Grow one forest to max(sizes) trees and return (curve, forest).
+
+    `curve` has one row per size with OOB metrics (when bootstrapping) and
+    holdout metrics (when a holdout set is given). `forest` may be an existing
+    warm-startable forest to keep growing.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    if forest is None:
+        params = dict({'random_state': 42}, **params)
+        params.pop('oob_score', None)
+        forest = RandomForestClassifier(warm_start=True, **params)
+    forest.set_params(warm_start=True)
+
+    y_train = np.asarray(y_train).ravel()
+    x_fit = np.ascontiguousarray(x_train, dtype=np.float32)
+    n = len(x_fit)
+    oob_sum, oob_n = np.zeros(n), np.zeros(n)
+    if x_holdout is not None:
+        x_hold = np.ascontiguousarray(x_holdout, dtype=np.float32)
+        y_holdout = np.asarray(y_holdout).ravel()
+        hold_sum = np.zeros(len(x_hold))
+
+    rows, done = [], 0
+    for size in sorted(sizes):
+        forest.set_params(n_estimators=size)
+        with stage('forest_grow_block', rows_in=n, trees=size - done):
+            forest.fit(x_fit, y_train)
+        pos = list(forest.classes_).index(1) if 1 in forest.classes_ else -1
+
+        row = {'n_estimators': size}
+        for tree in forest.estimators_[done:]:
+            if forest.bootstrap:
+                idx = oob_indices(forest, tree, n)
+                oob_sum[idx] += tree.predict_proba(x_fit[idx], check_input=False)[:, pos]
+                oob_n[idx] += 1
+            if x_holdout is not None:
+                hold_sum += tree.predict_proba(x_hold, check_input=False)[:, pos]
+        done = size
+
+        if forest.bootstrap:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                row.update(_metrics(y_train, oob_sum / oob_n, 'oob'))
+        if x_holdout is not None:
+            row.update(_metrics(y_holdout, hold_sum / done, 'holdout'))
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('n_estimators'), forest
+
+
+def warm_grid_search(x_train, y_train, param_grid, cv=5, random_state=42):
+    """
+    GridSearchCV over `param_grid` with one warm-started fit per n_estimators axis.
+
+    Returns a DataFrame with one row per full parameter combination and its
+    mean/std held-out accuracy across folds, best first.
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    grid = dict(param_grid)
+    sizes = sorted(grid.pop('n_estimators', [100]))
+    grid.pop('oob_score', None)  # OOB is tracked by the curve itself
+    keys = list(grid)
+    folds = list(StratifiedKFold(cv).split(x_train, y_train))
+    x_train = np.asarray(x_train, dtype=np.float32)
+    y_train = np.asarray(y_train).ravel()
+
+    rows = []
+    for combo in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, combo), random_state=random_state)
+        scores = []
+        for train_idx, test_idx in folds:
+            curve, _ = forest_curve(x_train[train_idx], y_train[train_idx],
+                                    x_train[test_idx], y_train[test_idx], sizes, **params)
+            scores.append(curve['holdout_accuracy'])
+        scores = pd.concat(scores, axis=1)
+        for size in sizes:
+            rows.append(dict(params, n_estimators=size, mean_test_score=scores.loc[size].mean(),
+                             std_test_score=scores.loc[size].std(ddof=0)))
+    return pd.DataFrame(rows).sort_values('mean_test_score', ascending=False, ignore_index=True)